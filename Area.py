@@ -16,11 +16,17 @@ Classes
 Area:                           A class for processing change in area (i.e. a 
                                 lake or plume) through an image sequence, with 
                                 methods for automated and manual detection
+AreaSeries:                     A compact container for the areas of an image
+                                sequence, with all polygon vertices held in a 
+                                single array
 
 Key class functions
 calcAutoAreas:                  Automatically detect areas of 
                                 interest from a sequence of images and return 
                                 uv and xyz measurements
+calcClassAreas:                 Automatically detect areas of several classes
+                                (colour ranges) from a sequence of images in a 
+                                single pass
 calcManualAreas:                Manually define areas of interest from a 
                                 sequence of images and return uv and xyz 
                                 measurements
@@ -32,6 +38,22 @@ calcAutoArea:                   Automatically detect areas of interest from an
                                 image pair and return uv and xyz measurements
 calcManualArea:                 Manually define areas of interest from an
                                 image pair and return uv and xyz measurements       
+cleanMask:                      Remove noise from a detected area mask
+detectAreaMask:                 Detect the extent of a colour range in an 
+                                image
+changedTiles:                   Find the tiles of an image that have changed 
+                                from a reference image
+polygonAreas:                   Calculate the areas of a set of polygons held 
+                                in a single array
+polygonArea:                    Calculate the area of a polygon
+polygonCentroids:               Calculate the centroids of a set of polygons 
+                                held in a single array
+polygonCentroid:                Calculate the centroid of a polygon
+polygonList:                    Get a list of polygons from area coordinates
+dropNaNPts:                     Remove NaN points from a set of polygons/lines
+                                held in a single array
+countPolygonPixels:             Count the image pixels covered by a set of 
+                                polygons
                                                                                                                           
 @author: Penny How (p.how@ed.ac.uk)
          Nick Hulton 
@@ -39,18 +61,16 @@ calcManualArea:                 Manually define areas of interest from an
 '''
 
 #Import packages
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
 import numpy as np
 import cv2
-from PIL import Image
-import ogr
 
 #Import PyTrx functions and classes
-from FileHandler import readMask
-from Images import ImageSequence, enhanceImage
+from FileHandler import (readMask, writeSelectionNPZ, readSelectionNPZ, 
+                         readBatchFile)
+from Images import (ImageSequence, enhanceImage, undistortPts, distortMask, 
+                    maskBBox)
 from Velocity import Velocity
-from CamEnv import invproject, setInvProjVars
+from CamEnv import invproject
 
 
 #------------------------------------------------------------------------------
@@ -144,9 +164,14 @@ class Area(Velocity):
         self._maximg = 0
         self._mask = None
         self._enhance = None
+        self._colourrange = None
+        self._threshold = None
+        self._cleanup = None
+        self._incremental = None
 
 
-    def calcAutoAreas(self, colour=False, verify=False):
+    def calcAutoAreas(self, colour=False, verify=False, sparse=False, 
+                      selectFile=None, colourFile=None):
         '''Detects areas of interest from a sequence of images, and returns 
         pixel and xyz areas. 
         
@@ -156,23 +181,34 @@ class Area(Velocity):
                                     or only once.
         verify (boolean):           Flag to denote whether detected polygons
                                     should be manually verified by user.
+        sparse (boolean):           Flag to denote whether only the detected 
+                                    polygon vertices are corrected for 
+                                    distortion (if the calibration flag is 
+                                    True). Areas are then detected from the 
+                                    raw images, and the mask is transformed 
+                                    into the raw image space once, so that no
+                                    full images are corrected.
+        selectFile (str):           File path for the selection of verified 
+                                    polygons, which is replayed if it exists
+                                    (see verifyAreas).
+        colourFile (str):           File path for the lightest and darkest 
+                                    points of the colour range, keyed by image 
+                                    name (GeoJSON/.npz, see readBatchFile). 
+                                    Colour ranges are defined from these 
+                                    points instead of by user input.
     
         Returns
-        area (list):                XYZ and UV area information
+        area (AreaSeries):          XYZ and UV area information
         '''               
         print '\n\nCOMMENCING AUTOMATED AREA DETECTION' 
 
-        #Get DEM from camera environment
-        dem = self._camEnv.getDEM() 
-
-        #Get inverse projection variables through camera info               
-        invprojvars = setInvProjVars(dem, self._camEnv._camloc, 
-                                     self._camEnv._camDirection, 
-                                     self._camEnv._radCorr, 
-                                     self._camEnv._tanCorr, 
-                                     self._camEnv._focLen, 
-                                     self._camEnv._camCen, 
-                                     self._camEnv._refImage)
+        #Get colour range points if given
+        colourpts={}
+        if colourFile is not None:
+            colourpts=readBatchFile(colourFile)
+
+        #Get inverse projection variables from camera environment
+        invprojvars = self._camEnv.getInvProjVars()
             
         #If user is only defining the color range once
         if colour is False: 
@@ -207,50 +243,83 @@ class Area(Velocity):
                                            self._enhance[1], self._enhance[2])
                 
                 #Define colour range
-                defineColourrange(setting, setimn, pxplot=self._pxplot)    
+                self._colourrange = defineColourrange(setting, setimn, 
+                                                      self._pxplot, 
+                                                      colourpts.get(setimn))    
             
         #Set up output datasets
         area=[]
+        
+        #Get calibration and mask for sparse correction of polygon vertices
+        calib, exclude, bbox = self.getDetectionSetup(sparse)
+        
+        #Incremental detection is not supported with per-image colour ranges
+        if self._incremental is not None and colour is True:
+            print ('\nIncremental detection is not supported when the colour '
+                   'range is defined for each image. Detecting areas from '
+                   'all tiles of every image')
                        
         #Cycle through image sequence (numbered from 0)
         for i in range(self.getLength()):
             
-            #Get corrected/distorted image
-            if self._calibFlag is True:
-                cameraMatrix=self._camEnv.getCamMatrixCV2()
-                distortP=self._camEnv.getDistortCoeffsCV2()
-                img1 = self._imageSet[i].getImageCorr(cameraMatrix, 
-                                                      distortP)
-            else:
-                img1=self._imageSet[i].getImageArray()
-
-            #Get image name
-            imn=self._imageSet[i].getImageName()
-               
-            #Make a copy of the image array
-            img2 = np.copy(img1)
-            
-            #Mask image if mask is present
-            if self._mask is not None:
-                booleanMask = np.array(self._mask, dtype=bool)
-                booleanMask = np.invert(booleanMask)
-                
-                #Mask extent image with boolean array
-                np.where(booleanMask, 0, img2) #Fit arrays to each other
-                img2[booleanMask] = 0 #Mask image with boolean mask object
-            
-            #Enhance image if enhancement parameters are present
-            if self._enhance is not None:
-                img2 = enhanceImage(img2, self._enhance[0], self._enhance[1],
-                                    self._enhance[2])
+            #Get corrected/distorted, masked, cropped and enhanced image
+            img2, imn = self.getDetectionImage(i, exclude, sparse, bbox)
             
             #Define colour range if required
             if colour is True:
-                defineColourrange(img2, imn, pxplot=self._pxplot)
+                if colourFile is None or imn in colourpts:
+                    self._colourrange = defineColourrange(img2, imn, 
+                                                          self._pxplot, 
+                                                          colourpts.get(imn),
+                                                          bbox)
+                else:
+                    print ('\nNo colour range points given for ' + imn + 
+                           '. Using previous colour range')
             
+            #Detect extent only in changed tiles if incremental detection is
+            #set (and the colour range is fixed)
+            if self._incremental is not None and colour is False:
+                
+                #Reuse previous polygons if no tiles have changed
+                if i > 0:
+                    changed = changedTiles(img2, ref, self._incremental[0], 
+                                           self._incremental[1])
+                    if not changed.any():
+                        print '\nNo change detected in ' + imn
+                        area.append(area[-1])
+                        self._imageSet[i].clearImage()
+                        self._imageSet[i].clearImageArray()
+                        continue
+                else:
+                    ref = np.copy(img2)
+                    extent = detectAreaMask(img2, self._colourrange)
+                    changed = None
+                    cache = {}
+                
+                #Update extent and reference image in changed tiles
+                if changed is not None:
+                    tile = self._incremental[1]
+                    rows, cols = np.nonzero(changed)
+                    print ('\nChange detected in %d of %d tiles in %s' 
+                           % (len(rows), changed.size, imn))
+                    for r, c in zip(rows, cols):
+                        ys = slice(r*tile, (r+1)*tile)
+                        xs = slice(c*tile, (c+1)*tile)
+                        extent[ys,xs] = detectAreaMask(img2[ys,xs], 
+                                                       self._colourrange)
+                        ref[ys,xs] = img2[ys,xs]
+                
+                #Calculate extent from updated extent mask
+                out = calcAutoArea(img2, imn, self._colourrange, 
+                                   self._threshold, invprojvars, calib, 
+                                   self._cleanup, np.copy(extent), bbox, 
+                                   cache)
+                
             #Calculate extent
-            out = calcAutoArea(img2, imn, self._colourrange, self._threshold, 
-                               invprojvars)  
+            else:
+                out = calcAutoArea(img2, imn, self._colourrange, 
+                                   self._threshold, invprojvars, calib, 
+                                   self._cleanup, offset=bbox)  
             
             area.append(out)
 
@@ -260,52 +329,219 @@ class Area(Velocity):
         
         #Verify areas if flag is true
         if verify is True:
-            area = self.verifyAreas(area, invprojvars)
+            area = self.verifyAreas(area, invprojvars, selectFile)
 
         #Return all xy coordinates and pixel extents                 
-        return area
+        return AreaSeries(area)
+
+
+    def calcClassAreas(self, classes, hsv=False, sparse=False):
+        '''Detects areas of several classes (e.g. plume, open water and ice
+        melange) from a sequence of images, each with its own colour range. 
+        Each image is loaded, corrected, masked and enhanced once, and then 
+        areas of all classes are detected from it. The threshold and cleanup 
+        parameters set for the Area object are used for all classes.
+        
+        Args
+        classes (dict):             Colour range ([upper, lower]) for each 
+                                    class, keyed by class name.
+        hsv (boolean):              Flag to denote whether colour ranges are 
+                                    given in HSV (hue, saturation, value) 
+                                    rather than RBG. Only used for three-band 
+                                    images.
+        sparse (boolean):           Flag to denote whether only the detected 
+                                    polygon vertices are corrected for 
+                                    distortion (see calcAutoAreas).
+    
+        Returns
+        areas (dict):               XYZ and UV area information 
+                                    (AreaSeries), keyed by class name
+        '''               
+        print '\n\nCOMMENCING AUTOMATED MULTI-CLASS AREA DETECTION' 
 
+        #Get inverse projection variables from camera environment
+        invprojvars = self._camEnv.getInvProjVars()
+        
+        #Set up output datasets
+        areas=dict((name, []) for name in classes)
+        
+        #Get calibration and mask for sparse correction of polygon vertices
+        calib, exclude, bbox = self.getDetectionSetup(sparse)
+        
+        #Cycle through image sequence (numbered from 0)
+        for i in range(self.getLength()):
+            
+            #Get corrected/distorted, masked, cropped and enhanced image
+            img2, imn = self.getDetectionImage(i, exclude, sparse, bbox)
+            
+            #Convert to HSV if required
+            if hsv is True and img2.ndim == 3:
+                img2 = cv2.cvtColor(img2, cv2.COLOR_RGB2HSV)
+            
+            #Calculate extent of each class
+            for name in classes:
+                print '\nClass: ' + str(name)
+                out = calcAutoArea(img2, imn, classes[name], self._threshold, 
+                                   invprojvars, calib, self._cleanup, 
+                                   offset=bbox)
+                areas[name].append(out)
+                
+            #Clear memory
+            self._imageSet[i].clearImage()
+            self._imageSet[i].clearImageArray()
+            
+        #Return all xy coordinates and pixel extents for each class
+        for name in areas:
+            areas[name] = AreaSeries(areas[name])
+        return areas
+    
+    
+    def getDetectionSetup(self, sparse=False):
+        '''Get the calibration parameters, mask and cropping box for 
+        automated area detection. If sparse correction is used (see 
+        calcAutoAreas), the mask is transformed into the raw image space. 
+        Images are cropped to the bounding box of the mask (plus a margin for 
+        mask cleanup), so that only the region of interest is processed. The
+        mask is returned as a cropped boolean array of the pixels to exclude,
+        so that it is only converted once for the sequence.
+        
+        Args
+        sparse (boolean):           Flag to denote whether only the detected 
+                                    polygon vertices are corrected for 
+                                    distortion.
+        
+        Returns
+        calib (list):               Camera matrix, distortion parameters and 
+                                    image size for correcting polygon vertices 
+                                    (None if images are corrected instead)
+        exclude (arr):              Boolean array of pixels to exclude from 
+                                    the cropped images (None if there is no 
+                                    mask)
+        bbox (tuple):               Bounding box that images are cropped to 
+                                    (None if there is no mask)
+        '''
+        calib=None
+        mask=self._mask
+        if self._calibFlag is True and sparse is True:
+            calib=[self._camEnv.getCamMatrixCV2(), 
+                   self._camEnv.getDistortCoeffsCV2()]
+            if mask is not None:
+                mask=distortMask(mask, calib[0], calib[1])
+                calib.append((mask.shape[1], mask.shape[0]))
+        
+        #Get cropping box and cropped boolean exclusion mask from mask
+        bbox=None
+        exclude=None
+        if mask is not None:
+            margin=2
+            if self._cleanup is not None:
+                margin=margin+self._cleanup[0]
+            bbox=maskBBox(mask, margin)
+            if bbox is not None:
+                mask=mask[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+            exclude=np.invert(np.array(mask, dtype=bool))
+        return calib, exclude, bbox
+    
+    
+    def getDetectionImage(self, i, exclude=None, sparse=False, bbox=None):
+        '''Get an image from the sequence for automated area detection. The 
+        image is corrected for distortion (unless sparse correction is used), 
+        masked, cropped and enhanced.
+        
+        Args
+        i (int):                    Image sequence number
+        exclude (arr):              Boolean array of pixels to exclude from 
+                                    the cropped image (see getDetectionSetup)
+        sparse (boolean):           Flag to denote whether only the detected 
+                                    polygon vertices are corrected for 
+                                    distortion.
+        bbox (tuple):               Bounding box to crop the image to
+        
+        Returns
+        img2 (arr):                 Image for detection
+        imn (str):                  Image name
+        '''
+        #Get corrected/distorted image
+        if self._calibFlag is True and sparse is False:
+            cameraMatrix=self._camEnv.getCamMatrixCV2()
+            distortP=self._camEnv.getDistortCoeffsCV2()
+            img1 = self._imageSet[i].getImageCorr(cameraMatrix, 
+                                                  distortP)
+        else:
+            img1=self._imageSet[i].getImageArray()
 
-    def calcManualAreas(self):
+        #Get image name
+        imn=self._imageSet[i].getImageName()
+           
+        #Crop image to bounding box
+        if bbox is not None:
+            img1 = img1[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+           
+        #Make a copy of the image array
+        img2 = np.copy(img1)
+        
+        #Mask image with boolean mask object if mask is present
+        if exclude is not None:
+            img2[exclude] = 0
+        
+        #Enhance image if enhancement parameters are present
+        if self._enhance is not None:
+            img2 = enhanceImage(img2, self._enhance[0], self._enhance[1],
+                                self._enhance[2])
+        
+        return img2, imn
+        
+        
+    def calcManualAreas(self, inputFile=None):
         '''Manually define areas of interest in a sequence of images. User 
         input is facilitated through an interactive plot to click around the 
-        area of interest
+        area of interest, or areas are read from a file without user input.
+        
+        Args
+        inputFile (str):            File path for area polygons keyed by image
+                                    name (GeoJSON/.npz, see readBatchFile). 
+                                    Images are not loaded if this is given.
         
         Returns
-        area (list):                XYZ and UV area information
+        area (AreaSeries):          XYZ and UV area information
         '''                
         '\n\nCOMMENCING MANUAL AREA DETECTION'
             
         #Set up output dataset
         area=[]
 
-        #Get DEM from camera environment
-        dem = self._camEnv.getDEM() 
-
-        #Get inverse projection variables through camera info               
-        invprojvars = setInvProjVars(dem, self._camEnv._camloc, 
-                                     self._camEnv._camDirection, 
-                                     self._camEnv._radCorr, 
-                                     self._camEnv._tanCorr, 
-                                     self._camEnv._focLen, 
-                                     self._camEnv._camCen, 
-                                     self._camEnv._refImage)
+        #Get inverse projection variables from camera environment
+        invprojvars = self._camEnv.getInvProjVars()
+                
+        #Get area polygons if given
+        inputs=None
+        if inputFile is not None:
+            inputs=readBatchFile(inputFile)
                 
         #Cycle through images        
         for i in (range(self.getLength())):
-            
-            #Call corrected/uncorrected image
-            if self._calibFlag is True:
-                img=self._imageSet[i].getImageCorr(self._camEnv.getCamMatrixCV2(), 
-                                                   self._camEnv.getDistortCoeffsCV2())      
-            else:
-                img=self._imageSet[i].getImageArray()          
 
             #Get image name
             imn=self._imageSet[i].getImageName()
             
+            #Get area polygon from inputs
+            if inputs is not None:
+                img=None
+                pxpts=inputs.get(imn, [])
+                if len(pxpts)==0:
+                    print '\nNo area given for ' + imn
+            
+            #Call corrected/uncorrected image
+            else:
+                pxpts=None
+                if self._calibFlag is True:
+                    img=self._imageSet[i].getImageCorr(self._camEnv.getCamMatrixCV2(), 
+                                                       self._camEnv.getDistortCoeffsCV2())      
+                else:
+                    img=self._imageSet[i].getImageArray()          
+            
             #Manually define extent and append
-            polys = calcManualArea(img, imn, self._pxplot, invprojvars)       
+            polys = calcManualArea(img, imn, self._pxplot, invprojvars, pxpts)       
             area.append(polys)
             
             #Clear memory
@@ -313,17 +549,20 @@ class Area(Velocity):
             self._imageSet[i].clearImageArray()
     
         #Return all extents, all cropped images and corresponding image names       
-        return area
+        return AreaSeries(area)
     
         
-    def verifyAreas(self, areas, invprojvars):
+    def verifyAreas(self, areas, invprojvars, selectFile=None):
         '''Method to manually verify all polygons in images. Plots sequential
         images with detected polygons and the user manually verifies them by 
-        clicking them.
+        clicking them. If a selection file is given and exists, the verified 
+        polygons are instead replayed from the file without user input. 
+        Otherwise, the selection made is written to the file.
         
         Args
-        area (list):                XYZ and UV area information
+        area (list/AreaSeries):     XYZ and UV area information
         invprojvars (list):         Inverse projection variables
+        selectFile (str):           File path for selection file (.npz)
         
         Returns
         verified (list):            Verified XYZ and UV area information
@@ -333,24 +572,49 @@ class Area(Velocity):
         
         #Get UV point coordinates
         uvpts=[item[1][1] for item in areas]
+        
+        #Load selection if it already exists
+        selection=None
+        if selectFile is not None:
+            try:
+                selection=readSelectionNPZ(selectFile)
+                print '\nVerified areas loaded from ' + selectFile
+            except IOError:
+                print ('\nSelection file not found. Proceeding to manually '
+                       'verify...')
+        replay = selection is not None
+        if selection is None:
+            selection={}
                 
         #Verify pixel polygons in each image        
         for i in range(len(uvpts)):
             
-            #Call corrected/uncorrected image
-            if self._calibFlag is True:
-                img1=self._imageSet[i].getImageCorr(self._camEnv.getCamMatrixCV2(), 
-                                                    self._camEnv.getDistortCoeffsCV2())      
-            else:
-                img1=self._imageSet[i].getImageArray()            
-            
             #Get image name
             imn=self._imageSet[i].getImageName()
             
-            #Verify polygons
-            img2 = np.copy(img1)
-            
-            if 1:                            
+            if replay is True:
+                
+                #Get verified polygons from selection
+                verf=[]
+                for v in selection.get(imn, []):
+                    if v < len(uvpts[i]):
+                        verf.append(int(v))
+                    else:
+                        print ('Verified polygon ' + str(v) + ' not found in ' 
+                               + imn)
+                
+            else:
+                
+                #Call corrected/uncorrected image
+                if self._calibFlag is True:
+                    img1=self._imageSet[i].getImageCorr(self._camEnv.getCamMatrixCV2(), 
+                                                        self._camEnv.getDistortCoeffsCV2())      
+                else:
+                    img1=self._imageSet[i].getImageArray()            
+                
+                #Verify polygons
+                img2 = np.copy(img1)
+                                        
                 print '\nVerifying detected areas from ' + imn
                 
                 #Set up empty output list                
@@ -359,26 +623,22 @@ class Area(Velocity):
                 #Function for click verification within a plot
                 def onpick(event):
                     
-                    #Get XY coordinates for clicked point in a plot
-                    v = []
+                    #Get index of clicked polygon
                     thisline = event.artist
-                    xdata = thisline.get_xdata()
-                    ydata = thisline.get_ydata()
-                    
-                    #Append XY coordinates
-                    for x,y in zip(xdata,ydata):
-                        v.append([x,y])
-                    v2=np.array(v, dtype=np.int32).reshape((len(xdata)),2)
-                    verf.append(v2)
+                    verf.append(thisline.polyindex)
                     
                     #Verify extent if XY coordinates coincide with a
                     #detected area
+                    xdata = thisline.get_xdata()
+                    ydata = thisline.get_ydata()
                     ind=event.ind
                     print ('Verified extent at ' + 
                            str(np.take(xdata, ind)[0]) + ', ' + 
                            str(np.take(ydata, ind)[0]))
                 
                 #Plot image
+                import matplotlib.pyplot as plt
+                from matplotlib.lines import Line2D
                 fig, ax1 = plt.subplots()
                 fig.canvas.set_window_title(imn + ': Click on valid areas.')
                 ax1.imshow(img2, cmap='gray')
@@ -389,70 +649,66 @@ class Area(Velocity):
                               self._pxplot[2],self._pxplot[3]])
                 
                 #Plot all detected areas
-                for a in uvpts[i]:
-                    x=[]
-                    y=[]
-                    for b in a:
-                        for c in b:
-                            x.append(c[0])
-                            y.append(c[1])
-                    line = Line2D(x, y, linestyle='-', color='y', picker=True)
+                for n,a in enumerate(uvpts[i]):
+                    a=np.asarray(a).reshape(-1,2)
+                    line = Line2D(a[:,0], a[:,1], linestyle='-', color='y', 
+                                  picker=True)
+                    line.polyindex=n
                     ax1.add_line(line)
                 
                 #Verify extents using onpick function
                 fig.canvas.mpl_connect('pick_event', onpick)
             
-            #Show plot
-            plt.show()           
+                #Show plot
+                plt.show()
+                
+                #Clear memory            
+                self._imageSet[i].clearImage()
+                self._imageSet[i].clearImageArray()
+                
+                #Record selection (each polygon once)
+                verf=sorted(set(verf))
+                selection[imn]=verf
             
             #Append all verified extents
-            vpx=[]
-            vpx=verf               
+            vpx=[np.asarray(uvpts[i][v]).reshape(-1,2) for v in verf]
             
             #Get areas of verified extents
-            h = img2.shape[0]
-            w = img2.shape[1]
-            px_im = Image.new('L', (w,h), 'black')
-            px_im = np.array(px_im) 
-            cv2.drawContours(px_im, vpx, -1, (255,255,255), 4)
-            for p in vpx:
-                cv2.fillConvexPoly(px_im, p, color=(255,255,255))           
-            output = Image.fromarray(px_im)
-
-            pixels = output.getdata()
-            values = []    
-            for px in pixels:
-                if px > 0:
-                    values.append(px)
-            pxext = len(values)        
+            pxext=countPolygonPixels(vpx)
             print 'Total verified extent: ', pxext  
 
             #Get xyz coordinates with inverse projection
+            vxyzpts=None
+            vxyzarea=None
             if invprojvars is not None:
-                vxyzpts=[]
-                vxyzarea=[]
-                for i in vpx:
-                    #Inverse project points 
-                    proj=invproject(i, invprojvars)           
-                    vxyzpts.append(proj)
-                    ogrpol = getOGRArea(proj)                   
-                    vxyzarea.append(ogrpol.GetArea())
+                offsets=np.cumsum([0] + [len(v) for v in vpx])
+                if len(vpx) > 0:
+                    xyz=invproject(np.vstack(vpx), invprojvars)
+                else:
+                    xyz=np.zeros([0,3])
+                vxyzpts=np.split(xyz, offsets[1:-1])
+                
+                #Get areas for xyz polygons
+                vxyzarea=list(polygonAreas(xyz, offsets))
                     
                 print 'Total verified area: ', str(sum(vxyzarea)), ' m'            
 
-            verified.append([[pxext, vpx],[vxyzarea, vxyzpts]])                    
-            
-            #Clear memory            
-            self._imageSet[i].clearImage()
-            self._imageSet[i].clearImageArray()
+            verified.append([[vxyzarea, vxyzpts],[pxext, vpx]])                    
         
+        #Write selection to file
+        if selectFile is not None and replay is False:
+            writeSelectionNPZ(selection, selectFile)
+            print '\nVerified areas written to ' + selectFile
+            
         #Rewrite verified area data
         return verified
         
 
     def setMax(self, maxMaskPath, maxim):
         '''Set image in sequence which pictures the maximum extent of the area
-        of interest.
+        of interest. The mask is read from maxMaskPath if it exists (a mask 
+        polygon can be given as a GeoJSON/.npz file keyed by image name), 
+        otherwise it is manually defined.
         '''
         #Calibrate image if calibration flag is true
         if self._calibFlag is True:
@@ -464,7 +720,8 @@ class Area(Velocity):
             maxi = self._imageSet[maxim].getImageArray()
             
         #Define mask on image with maximum areal extent
-        self._mask = readMask(maxi, maxMaskPath)
+        self._mask = readMask(maxi, maxMaskPath, 
+                              self._imageSet[maxim].getImageName())
         
         #Retain image sequence number for image with maximum extent
         self._maximg = maxim
@@ -532,18 +789,333 @@ class Area(Velocity):
                                   into one of three pixel values.
         '''
         self._enhance = diff, phi, theta
- 
 
-#------------------------------------------------------------------------------   
 
-def calcAutoArea(img, imn, colourrange, threshold=None, invprojvars=None):
+    def setCleanup(self, kernel=3, opening=True, closing=True, minpix=40, 
+                   simple=True):
+        '''Set cleanup of the detected (colour range) mask before polygons 
+        are extracted. Noise is removed with morphological opening/closing and
+        by removing small connected regions, so that noisy regions are not 
+        traced as polygons. See the cleanMask function for a detailed 
+        explanation of the parameters.
+        
+        Args
+        kernel (int):             Size of the morphological kernel (px).
+        opening (boolean):        Flag to apply morphological opening, which 
+                                  removes small specks.
+        closing (boolean):        Flag to apply morphological closing, which 
+                                  fills small holes and gaps.
+        minpix (int):             Minimum area (px) of regions that will be 
+                                  retained.
+        simple (boolean):         Flag to compress polygon vertices along 
+                                  straight edges (OpenCV's CHAIN_APPROX_SIMPLE)
+                                  rather than retaining every boundary pixel.
+        '''
+        self._cleanup = kernel, opening, closing, minpix, simple
+
+
+    def setIncremental(self, diffthresh=2.0, tile=128):
+        '''Set incremental area detection (for calcAutoAreas with a fixed 
+        colour range). Each image is compared with the last image that areas
+        were detected from, in tiles. If no tile has changed, the polygons of 
+        the previous image are reused. Otherwise, the colour range is only 
+        re-applied to the changed tiles, and mask cleanup and polygon 
+        extraction are then run over the whole (cropped) image, as regions 
+        can span several tiles. Only polygons that differ from those of the
+        previous image are corrected for distortion and inverse projected; 
+        unchanged polygons are reused. As masked pixels are set to zero, only
+        changes inside the mask are detected.
+        
+        Incremental detection is not used when the colour range is defined 
+        for each image (calcAutoAreas with colour=True), as tiles that have 
+        not changed would still be classified differently with a new colour 
+        range. It is also not used by calcClassAreas.
+        
+        Args
+        diffthresh (float):       Mean absolute pixel difference within a 
+                                  tile above which the tile is changed.
+        tile (int):               Tile size (px).
+        '''
+        self._incremental = diffthresh, tile
+
+
+#------------------------------------------------------------------------------
+
+class AreaSeries(object):
+    '''A compact container for the areas of an image sequence. The vertices
+    of all polygons in the sequence are held in one contiguous array (for uv
+    and xyz coordinates), with the offset to the first vertex of each polygon
+    and the offset to the first polygon of each image. Polygon areas are
+    calculated from the vertices in one pass when the container is filled.
+
+    Indexing the container returns the area information of an image in the
+    same nested form as calcAutoArea (i.e. [[xyzarea, xyzpts], [pxextent,
+    pxpts]]), so it can be used in place of a list of area outputs. If the 
+    pixel extent of an image is given as a single value (e.g. the verified
+    pixel count from verifyAreas), it is kept as the extent of that image 
+    instead of the sum of its polygon areas.
+
+    Args
+    areas (list):              XYZ and UV area information for each image, as
+                               returned by calcAutoArea/calcManualArea
+                               (optional).
+    '''
+
+    #Object initialisation
+    def __init__(self, areas=None):
+
+        #Get polygons from each image
+        uvpolys=[]
+        xyzpolys=[]
+        counts=[]
+        pxextent=[]
+        for i, item in enumerate(areas or []):
+            uv = polygonList(item[1][1], 2)
+            uvpolys.extend(uv)
+            counts.append(len(uv))
+            
+            #Keep pixel extent if given as a single value for the image
+            if item[1][0] is not None and np.isscalar(item[1][0]):
+                pxextent.append(float(item[1][0]))
+            else:
+                pxextent.append(np.nan)
+
+            if item[0][1] is None:
+                xyzpolys = None
+            elif xyzpolys is not None:
+                xyz = polygonList(item[0][1], 3)
+                
+                #Check xyz polygons match uv polygons
+                if len(xyz) != len(uv):
+                    raise ValueError('Image %d has %d xyz polygons but %d uv '
+                                     'polygons' % (i, len(xyz), len(uv)))
+                for n in range(len(uv)):
+                    if len(xyz[n]) != len(uv[n]):
+                        raise ValueError('Polygon %d in image %d has %d xyz '
+                                         'vertices but %d uv vertices' 
+                                         % (n+1, i, len(xyz[n]), len(uv[n])))
+                xyzpolys.extend(xyz)
+
+        #Concatenate all polygon vertices, with offsets to each polygon and
+        #the first polygon of each image
+        polyoffsets = np.cumsum([0] + [len(p) for p in uvpolys])
+        imageoffsets = np.cumsum([0] + counts)
+        uv = np.concatenate(uvpolys + [np.zeros([0,2])])
+        if xyzpolys is not None:
+            xyz = np.concatenate(xyzpolys + [np.zeros([0,3])])
+        else:
+            xyz = None
+        
+        #Only keep pixel extents if any are given
+        if np.isnan(pxextent).all():
+            pxextent = None
+
+        self.setVertices(uv, xyz, polyoffsets, imageoffsets, pxextent)
+
+
+    def setVertices(self, uv, xyz, polyoffsets, imageoffsets, pxextent=None):
+        '''Set the polygon vertices of the image sequence and calculate the
+        area of each polygon.
+
+        Args
+        uv (arr):                 UV coordinates of all polygon vertices (N,2)
+        xyz (arr):                XYZ coordinates of all polygon vertices
+                                  (N,3), or None
+        polyoffsets (arr):        Index of the first vertex of each polygon,
+                                  followed by the total number of vertices
+        imageoffsets (arr):       Index of the first polygon of each image,
+                                  followed by the total number of polygons
+        pxextent (arr):           Pixel extent of each image (NaN where it 
+                                  is the sum of the polygon areas), or None
+        '''
+        self._uv = np.asarray(uv, dtype=np.float64).reshape(-1,2)
+        self._polyoffsets = np.asarray(polyoffsets, dtype=np.int64)
+        self._imageoffsets = np.asarray(imageoffsets, dtype=np.int64)
+        if self._polyoffsets[-1] != len(self._uv):
+            raise ValueError('Polygon offsets do not match the number of uv '
+                             'vertices')
+        if self._imageoffsets[-1] != len(self._polyoffsets)-1:
+            raise ValueError('Image offsets do not match the number of '
+                             'polygons')
+        self._pxarea = polygonAreas(self._uv, self._polyoffsets)
+        if pxextent is not None:
+            self._pxextent = np.asarray(pxextent, dtype=np.float64)
+        else:
+            self._pxextent = None
+
+        if xyz is not None:
+            self._xyz = np.asarray(xyz, dtype=np.float64).reshape(-1,3)
+            if len(self._xyz) != len(self._uv):
+                raise ValueError('%d xyz vertices do not match %d uv vertices'
+                                 % (len(self._xyz), len(self._uv)))
+            self._xyzarea = polygonAreas(self._xyz, self._polyoffsets)
+        else:
+            self._xyz = None
+            self._xyzarea = None
+
+
+    def __len__(self):
+        '''Return the number of images.'''
+        return len(self._imageoffsets)-1
+
+
+    def __getitem__(self, i):
+        '''Return the area information of an image in nested form, i.e.
+        [[xyzarea, xyzpts], [pxextent, pxpts]].'''
+        if i < 0:
+            i = i + len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('Image index out of range')
+
+        if self._xyz is not None:
+            xyz = [list(self.getXYZArea(i)), self.getXYZPts(i)]
+        else:
+            xyz = [None, None]
+        if self._pxextent is not None and not np.isnan(self._pxextent[i]):
+            pxextent = self._pxextent[i]
+        else:
+            pxextent = list(self.getPXArea(i))
+        return [xyz, [pxextent, self.getPXPts(i)]]
+
+
+    def toList(self):
+        '''Return the area information of all images in nested form (see
+        calcAutoAreas).'''
+        return [self[i] for i in range(len(self))]
+
+
+    def getPolygons(self, i):
+        '''Return the index range of the polygons in an image.'''
+        return self._imageoffsets[i], self._imageoffsets[i+1]
+
+
+    def getVertices(self, i):
+        '''Return the index range of the polygon vertices in an image.'''
+        a, b = self.getPolygons(i)
+        return self._polyoffsets[a], self._polyoffsets[b]
+
+
+    def getPXPts(self, i):
+        '''Return the UV coordinates of each polygon in an image (as views of
+        the vertex array).'''
+        a, b = self.getPolygons(i)
+        return [self._uv[self._polyoffsets[p]:self._polyoffsets[p+1]]
+                for p in range(a, b)]
+
+
+    def getXYZPts(self, i):
+        '''Return the XYZ coordinates of each polygon in an image (as views
+        of the vertex array), or None if areas are not georectified.'''
+        if self._xyz is None:
+            return None
+        a, b = self.getPolygons(i)
+        return [self._xyz[self._polyoffsets[p]:self._polyoffsets[p+1]]
+                for p in range(a, b)]
+
+
+    def getPXArea(self, i):
+        '''Return the pixel area of each polygon in an image.'''
+        a, b = self.getPolygons(i)
+        return self._pxarea[a:b]
+
+
+    def getXYZArea(self, i):
+        '''Return the XYZ area of each polygon in an image, or None if areas
+        are not georectified.'''
+        if self._xyzarea is None:
+            return None
+        a, b = self.getPolygons(i)
+        return self._xyzarea[a:b]
+
+
+    def getPXExtent(self):
+        '''Return the total pixel area of each image (or the pixel extent 
+        given for the image).'''
+        extent = self.sumImages(self._pxarea)
+        if self._pxextent is not None:
+            given = ~np.isnan(self._pxextent)
+            extent[given] = self._pxextent[given]
+        return extent
+
+
+    def getXYZExtent(self):
+        '''Return the total XYZ area of each image, or None if areas are not
+        georectified.'''
+        if self._xyzarea is None:
+            return None
+        return self.sumImages(self._xyzarea)
+
+
+    def sumImages(self, values):
+        '''Sum polygon values (e.g. areas) for each image.'''
+        ids = np.repeat(np.arange(len(self)), np.diff(self._imageoffsets))
+        return np.bincount(ids, weights=values, minlength=len(self))
+
+
+    def getPXPath(self, i):
+        '''Return the UV coordinates of all polygons in an image as one
+        array, with polygons separated by NaN rows (for plotting).'''
+        return self.getPath(self._uv, i)
+
+
+    def getXYZPath(self, i):
+        '''Return the XYZ coordinates of all polygons in an image as one
+        array, with polygons separated by NaN rows (for plotting), or None if
+        areas are not georectified.'''
+        if self._xyz is None:
+            return None
+        return self.getPath(self._xyz, i)
+
+
+    def getPath(self, pts, i):
+        '''Get the vertices of an image from a vertex array, with polygons
+        separated by NaN rows.'''
+        a, b = self.getPolygons(i)
+        start, end = self.getVertices(i)
+        breaks = self._polyoffsets[a+1:b] - start
+        return np.insert(pts[start:end], breaks, np.nan, axis=0)
+
+
+    def getPXVertices(self):
+        '''Return the UV coordinates of all polygon vertices.'''
+        return self._uv
+
+
+    def getXYZVertices(self):
+        '''Return the XYZ coordinates of all polygon vertices, or None if
+        areas are not georectified.'''
+        return self._xyz
+
+
+    def getPolygonOffsets(self):
+        '''Return the index of the first vertex of each polygon, followed by
+        the total number of vertices.'''
+        return self._polyoffsets
+
+
+    def getImageOffsets(self):
+        '''Return the index of the first polygon of each image, followed by
+        the total number of polygons.'''
+        return self._imageoffsets
+
+
+#------------------------------------------------------------------------------
+
+def calcAutoArea(img, imn, colourrange, threshold=None, invprojvars=None,
+                 calib=None, cleanup=None, extent=None, offset=None, 
+                 cache=None):
     '''Detects areas of interest from a given image, and returns pixel and xyz 
     areas along with polygon coordinates. Detection is performed from the image 
     using a predefined RBG colour range. The colour range is then used to 
     extract pixels within that range using the OpenCV function inRange. If a 
     threshold has been set (using the setThreshold function) then only nth 
     polygons will be retained. XYZ areas and polygon coordinates are only 
-    calculated when a set of inverse projection variables are provided.
+    calculated when a set of inverse projection variables are provided. If 
+    calibration parameters are given, the image is assumed to be raw 
+    (uncorrected) and only the retained polygon vertices are corrected for 
+    distortion. If cleanup parameters are given, the detected mask is cleaned
+    (see cleanMask) and all remaining regions are retained, otherwise only 
+    polygons with at least 40 vertices are retained.
     
     Args
     img (arr):            Image array
@@ -551,6 +1123,23 @@ def calcAutoArea(img, imn, colourrange, threshold=None, invprojvars=None):
     colourrange (list):   RBG colour range for areas to be detected from
     threshold (int):      Threshold number of detected areas to retain
     invprojvars (list):   Inverse projection variables
+    calib (list):         Camera matrix and distortion parameters (and the
+                          full image size, if the image is cropped) for 
+                          correcting polygon vertices (None if the image is
+                          already corrected)
+    cleanup (list):       Mask cleanup parameters (kernel size, opening flag,
+                          closing flag, minimum region size, and simple 
+                          polygon flag)
+    extent (arr):         Extent mask already detected from the image with 
+                          the colour range (see detectAreaMask), if any
+    offset (tuple):       Position (x,y) of the image in the full image, if
+                          the image is cropped (e.g. a bounding box from 
+                          maskBBox)
+    cache (dict):         Corrected and georectified polygons from the 
+                          previous image, keyed by their raw vertices. Only
+                          polygons not in the cache are corrected and inverse
+                          projected, and the cache is then replaced with the 
+                          polygons of this image
     
     Returns
     xyzarea (list):       Sum of total detected areas (xyz)
@@ -558,72 +1147,114 @@ def calcAutoArea(img, imn, colourrange, threshold=None, invprojvars=None):
     pxextent (list):      Sum of total detected areas (px)
     pxpts (list):         UV coordinates of detected areas
     '''                       
-    #Get upper and lower RBG boundaries from colour range
-    upper_boundary = colourrange[0]
-    lower_boundary = colourrange[1]
-
-    #Transform RBG range to array    
-    upper_boundary = np.array(upper_boundary, dtype='uint8')
-    lower_boundary = np.array(lower_boundary, dtype='uint8')
-
     #Extract extent based on RBG range
-    mask = cv2.inRange(img, lower_boundary, upper_boundary)
+    if extent is None:
+        mask = detectAreaMask(img, colourrange)
+    else:
+        mask = extent
 
-#    #Speckle filter to remove noise - needs fixing
-#    mask = cv2.filterSpeckles(mask, 1, 30, 2)
+    #Remove noise from extent if cleanup parameters are given
+    approx = cv2.CHAIN_APPROX_NONE
+    if cleanup is not None:
+        mask = cleanMask(mask, cleanup[0], cleanup[1], cleanup[2], cleanup[3])
+        if cleanup[4] is True:
+            approx = cv2.CHAIN_APPROX_SIMPLE
 
     #Polygonize extents using OpenCV findContours function        
-    polyimg, line, hier = cv2.findContours(mask, cv2.RETR_EXTERNAL, 
-                                           cv2.CHAIN_APPROX_NONE)
+    polyimg, line, hier = cv2.findContours(mask, cv2.RETR_EXTERNAL, approx)
     
     print '\nDetected ' + str(len(line)) + ' regions in ' + imn
     
     #Append all polygons from the polys list that have more than 
-    #a given number of points     
-    pxpts = []
-    for c in line:
-        if len(c) >= 40:
-            pxpts.append(c)
+    #a given number of points (noise is otherwise already removed)     
+    if cleanup is None:
+        pxpts = []
+        for c in line:
+            if len(c) >= 40:
+                pxpts.append(c)
+        length = len
+    else:
+        pxpts = list(line)
+        length = lambda c: cv2.arcLength(c, True)
     
     #If threshold has been set, only keep the nth longest polygons
     if threshold is not None:
         if len(pxpts) >= threshold:
-            pxpts.sort(key=len)
+            pxpts.sort(key=length)
             pxpts = pxpts[-(threshold):]        
 
     print 'Kept %d regions' % (len(pxpts))
     
-    #Calculate areas
-    pxextent=[]
-    for p in range(len(pxpts)): 
-
-        try:        
-            #Create geometry
-            pxpoly=getOGRArea(pxpts[p].squeeze())
-            
-            #Calculate area of polygon area
-            pxextent.append(pxpoly.Area())
+    #Return polygon vertices to full image frame if image is cropped
+    if offset is not None:
+        shift = np.array(offset[:2], dtype=np.int32)
+        pxpts = [c + shift for c in pxpts]
+    
+    #Get polygons that were corrected and georectified in the previous
+    #image if a cache is given (unchanged polygons have identical vertices)
+    keys = [c.tobytes() for c in pxpts]
+    if cache is not None:
+        new = [n for n in range(len(pxpts)) if keys[n] not in cache]
+        print 'Reused %d unchanged regions' % (len(pxpts)-len(new))
+    else:
+        new = range(len(pxpts))
+    newpts = [pxpts[n] for n in new]
+    
+    #Correct new polygon vertices for distortion (all polygons at once)
+    if calib is not None and len(newpts) > 0:
+        if len(calib) > 2:
+            size = calib[2]
+        else:
+            size = (img.shape[1], img.shape[0])
+        corr = undistortPts(np.vstack(newpts).astype(np.float32), calib[0], 
+                            calib[1], size)
+        newpts = np.split(corr, np.cumsum([len(c) for c in newpts])[:-1])
+    
+    #Inverse project new polygon vertices (all polygons at once)
+    newxyz = [None]*len(newpts)
+    if invprojvars is not None and len(newpts) > 0:
+        newoffsets = np.cumsum([0] + [len(c) for c in newpts])
+        xyz = invproject(np.vstack(newpts).reshape(-1,2).astype(np.float64), 
+                         invprojvars)
+        newxyz = np.split(xyz, newoffsets[1:-1])
+    
+    #Combine reused and new polygons
+    xyzpts = [None]*len(pxpts)
+    if cache is not None:
+        for n in range(len(pxpts)):
+            if keys[n] in cache:
+                pxpts[n], xyzpts[n] = cache[keys[n]]
+    for n, c, x in zip(new, newpts, newxyz):
+        pxpts[n] = c
+        xyzpts[n] = x
         
-        #Create zero object if no polygon has been recorded 
-        except:
-            pxextent = 0
+    #Keep polygons of this image for the next image
+    if cache is not None:
+        cache.clear()
+        cache.update(zip(keys, zip(pxpts, xyzpts)))
+    
+    #Concatenate all polygon vertices, with offsets to each polygon
+    offsets = np.cumsum([0] + [len(c) for c in pxpts])
+    if len(pxpts) > 0:
+        uv = np.vstack(pxpts).reshape(-1,2).astype(np.float64)
+    else:
+        uv = np.zeros([0,2])
+    
+    #Calculate areas
+    pxextent = list(polygonAreas(uv, offsets))
         
     print ('Total extent: ' + str(sum(pxextent)) + 'px (out of ' 
             + str(img.shape[0]*img.shape[1]) + 'px)')  
     
-    #Get xyz coordinates with inverse projection
+    #Get xyz areas from inverse projected polygons
     if invprojvars is not None:
-        xyzpts=[]
-        xyzarea=[]
+        if len(xyzpts) > 0:
+            xyz = np.vstack(xyzpts)
+        else:
+            xyz = np.zeros([0,3])
         
-        for i in pxpts:           
-            #Inverse project points 
-            proj=invproject(i, invprojvars)           
-            xyzpts.append(proj)
-            
-            #Get areas for xyz polygons
-            ogrpol = getOGRArea(proj)                   
-            xyzarea.append(ogrpol.GetArea())
+        #Get areas for xyz polygons
+        xyzarea = list(polygonAreas(xyz, offsets))
             
         print 'Total area: ', str(sum(xyzarea)), 'm'
                 
@@ -635,87 +1266,192 @@ def calcAutoArea(img, imn, colourrange, threshold=None, invprojvars=None):
         return [[None, None], [pxextent, pxpts]]
         
 
-def calcManualArea(img, imn, pxplot=None, invprojvars=None):
+def detectAreaMask(img, colourrange):
+    '''Detect the extent of pixels within a given RBG colour range in an 
+    image, using the OpenCV function inRange.
+    
+    Args
+    img (arr):            Image array
+    colourrange (list):   RBG colour range for areas to be detected from
+    
+    Returns
+    mask (arr):           Binary extent mask (uint8, 0 or 255)
+    '''
+    #Get upper and lower RBG boundaries from colour range
+    upper_boundary = colourrange[0]
+    lower_boundary = colourrange[1]
+
+    #Transform RBG range to array    
+    upper_boundary = np.array(upper_boundary, dtype='uint8')
+    lower_boundary = np.array(lower_boundary, dtype='uint8')
+
+    #Extract extent based on RBG range
+    return cv2.inRange(img, lower_boundary, upper_boundary)
+    
+    
+def changedTiles(img, ref, diffthresh, tile):
+    '''Find the tiles of an image which have changed from a reference 
+    image, based on the mean absolute pixel difference within each tile.
+    
+    Args
+    img (arr):            Image array
+    ref (arr):            Reference image array
+    diffthresh (float):   Mean absolute difference above which a tile is 
+                          changed
+    tile (int):           Tile size (px)
+    
+    Returns
+    changed (arr):        Boolean array of changed tiles (rows, columns)
+    '''
+    #Get absolute difference (maximum across bands)
+    diff = cv2.absdiff(img, ref)
+    if diff.ndim == 3:
+        diff = diff.max(axis=2)
+    
+    #Pad difference to whole tiles and sum difference in each tile
+    h, w = diff.shape
+    nr = -(-h // tile)
+    nc = -(-w // tile)
+    padded = np.zeros((nr*tile, nc*tile), dtype=np.float32)
+    padded[:h,:w] = diff
+    sums = padded.reshape(nr, tile, nc, tile).sum(axis=(1,3))
+    
+    #Get mean difference over the image pixels in each tile (edge tiles are
+    #smaller than the tile size)
+    rows = np.minimum(tile, h - np.arange(nr)*tile)
+    cols = np.minimum(tile, w - np.arange(nc)*tile)
+    means = sums / np.outer(rows, cols)
+    return means > diffthresh
+    
+    
+def cleanMask(mask, kernel=3, opening=True, closing=True, minpix=40):
+    '''Remove noise from a binary mask (e.g. the output of cv2.inRange) 
+    before polygons are extracted from it. Small specks are removed with a 
+    morphological opening, small holes and gaps are filled with a 
+    morphological closing, and connected regions smaller than a given area 
+    are removed.
+    
+    Args
+    mask (arr):           Binary mask (uint8, 0 or 255)
+    kernel (int):         Size of the (elliptical) morphological kernel (px)
+    opening (boolean):    Flag to apply morphological opening
+    closing (boolean):    Flag to apply morphological closing
+    minpix (int):         Minimum area (px) of connected regions to retain
+                          (None if no regions are removed)
+    
+    Returns
+    mask (arr):           Cleaned binary mask
+    '''
+    #Apply morphological opening and closing
+    k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel,kernel))
+    if opening is True:
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, k)
+    if closing is True:
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, k)
+    
+    #Remove small connected regions
+    if minpix is not None:
+        out = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        n, labels, stats = out[0], out[1], out[2]
+        keep = stats[:,cv2.CC_STAT_AREA] >= minpix
+        keep[0] = False
+        print 'Removed %d small regions' % (n-1-np.count_nonzero(keep))
+        mask = (keep.astype(np.uint8)*255)[labels]
+    
+    return mask
+    
+    
+def calcManualArea(img, imn, pxplot=None, invprojvars=None, pxpts=None):
     '''Manually define an area in a given image. User input is facilitated
     through an interactive plot to click around the area of interest. XYZ areas
-    are calculated if a set of inverse projection variables are given.
+    are calculated if a set of inverse projection variables are given. If 
+    the area coordinates are given, no user input is needed.
     
     Args
     img (arr):          Image array (for plotting the image).
     imn (str):          Image name
     pxplot (list):      Plotting extent for manual area definition
     invprojvars (list): Inverse projection variables
+    pxpts (arr):        UV coordinates of area (defined by user if None)
     
     Returns
-    xyzarea (list):       Sum of total detected areas (xyz)
-    xyzpts (list):        XYZ coordinates of detected areas
+    xyzarea (list):       Sum of total detected areas (xyz), or None if no
+                          inverse projection variables are given
+    xyzpts (list):        XYZ coordinates of detected areas, or None if no 
+                          inverse projection variables are given
     pxextent (list):      Sum of total detected areas (px)
     pxpts (list):         UV coordinates of detected areas
     '''    
-    #Initialise figure window and plot image
-    fig=plt.gcf()
-    fig.canvas.set_window_title(imn + ': Click around region. Press enter '
-                                'to record points.')
-    plt.imshow(img, origin='upper', cmap='gray')
-    
-    #Set plotting extent if required
-    if pxplot is not None:
-        plt.axis([pxplot[0],pxplot[1],
-                  pxplot[2],pxplot[3]]) 
-    
-    #Manual input of points from clicking on plot using pyplot.ginput
-    pxpts = plt.ginput(n=0, timeout=0, show_clicks=True, mouse_add=1, 
-                    mouse_pop=3, mouse_stop=2)
-    print '\n' + imn + ': you clicked ' + str(len(pxpts)) + ' points'
-    
-    #Show plot
-    plt.show()
-    plt.close()
-        
-    #Create polygon if area has been recorded   
-    try:
-        
-        #Complete the polygon ring             
-        pxpts.append(pxpts[0]) 
+    if pxpts is None:
         
-        #Create geometry
-        pxpoly=getOGRArea(pxpts)
+        #Initialise figure window and plot image
+        import matplotlib.pyplot as plt
+        fig=plt.gcf()
+        fig.canvas.set_window_title(imn + ': Click around region. Press enter '
+                                    'to record points.')
+        plt.imshow(img, origin='upper', cmap='gray')
         
-        #Calculate area of polygon area
-        pxextent = pxpoly.Area()
-    
-    #Create zero object if no polygon has been recorded 
-    except:
-        pxextent = 0
+        #Set plotting extent if required
+        if pxplot is not None:
+            plt.axis([pxplot[0],pxplot[1],
+                      pxplot[2],pxplot[3]]) 
+        
+        #Manual input of points from clicking on plot using pyplot.ginput
+        pxpts = plt.ginput(n=0, timeout=0, show_clicks=True, mouse_add=1, 
+                        mouse_pop=3, mouse_stop=2)
+        print '\n' + imn + ': you clicked ' + str(len(pxpts)) + ' points'
+        
+        #Show plot
+        plt.show()
+        plt.close()
     
-    print ('Total extent: ' + str(pxextent) + 'px (out of ' 
-            + str(img.shape[0]*img.shape[1]) + 'px)')    
+    else:
+        pxpts = [tuple(p) for p in pxpts]
+        
+    #Complete the polygon ring if area has been recorded
+    if len(pxpts) > 0:
+        pxpts.append(pxpts[0]) 
+        
+    #Calculate area of polygon
+    pxextent = polygonArea(np.array(pxpts).reshape(-1,2))
     
-    #Convert pts list to array
-    pxpts = np.array(pxpts)           
-    pxpts = np.squeeze(pxpts)
+    if img is not None:
+        print ('Total extent: ' + str(pxextent) + 'px (out of ' 
+                + str(img.shape[0]*img.shape[1]) + 'px)')    
+    else:
+        print 'Total extent: ' + str(pxextent) + 'px'
     
+    #Convert pts list to array, with no polygon if no area was recorded
+    pxpts = np.array(pxpts, dtype=np.float64).reshape(-1,2)
+    if len(pxpts) > 0:
+        pxextent = [pxextent]
+        pxpts = [pxpts]
+    else:
+        pxextent = []
+        pxpts = []
 
     if invprojvars is not None:
         #Get xyz coordinates with inverse projection
-        xyzpts=invproject(pxpts, invprojvars) 
+        xyzpts = [invproject(p, invprojvars) for p in pxpts]
         
         #Calculate area of xyz polygon
-        xyzarea = getOGRArea(xyzpts)                   
-        xyzarea=xyzarea.GetArea()
+        xyzarea = [polygonArea(p) for p in xyzpts]
         
         #Return XYZ and pixel areas
-        print 'Total area: ', str(xyzarea), 'm'
-        return [[[xyzarea], [xyzpts]], [[pxextent], [pxpts]]]
+        print 'Total area: ', str(sum(xyzarea)), 'm'
+        return [[xyzarea, xyzpts], [pxextent, pxpts]]
 
     #Return pixel areas only    
     else:
         return [[None, None], [pxextent, pxpts]]          
 
 
-def defineColourrange(img, imn, pxplot=None):
+def defineColourrange(img, imn, pxplot=None, colours=None, offset=None):
     '''Define colour range manually by clicking on the lightest and 
-    darkest regions of the target extent that will be defined.
+    darkest regions of the target extent that will be defined. If the 
+    coordinates of these two points are given, no user input is needed. If 
+    the image is cropped, the plotting extent and points are given in the 
+    full image frame and are shifted by the crop offset.
     
     Plot interaction information:
         Left click to select.
@@ -726,39 +1462,63 @@ def defineColourrange(img, imn, pxplot=None):
     Args
     img (arr):                  Image array (for plotting the image)
     imn (str):                  Image name
+    pxplot (list):              Plotting extent
+    colours (arr):              UV coordinates of the lightest and darkest
+                                points (defined by user if None)
+    offset (tuple):             Position of the cropped image in the full 
+                                image frame (xmin, ymin, ...), or None if the
+                                image is not cropped
     
     Returns:
     upper_boundary (int):       Upper RGB range for detection
     lower_boundary (int):       Lower RGB range for detection
     '''
-    #Initialise figure window
-    fig=plt.gcf()
-    fig.canvas.set_window_title(imn + ': Click lightest colour and darkest' 
-                                ' colour')
-    
-    #Plot image
-    plt.imshow(img, origin='upper')
-    
-    #Define plotting extent if required
-    if pxplot is not None:
-        plt.axis([pxplot[0],pxplot[1],pxplot[2],pxplot[3]])
-
-    #Manually interact to select lightest and darkest part of the region            
-    colours = plt.ginput(n=2, timeout=0, show_clicks=True, mouse_add=1, 
-                        mouse_pop=3, mouse_stop=2)
+    if colours is None:
+        
+        #Initialise figure window
+        import matplotlib.pyplot as plt
+        fig=plt.gcf()
+        fig.canvas.set_window_title(imn + ': Click lightest colour and darkest' 
+                                    ' colour')
+        
+        #Plot image (in the full image frame if cropped)
+        if offset is not None:
+            x0, y0 = offset[0], offset[1]
+            plt.imshow(img, origin='upper', 
+                       extent=[x0-0.5, x0+img.shape[1]-0.5, 
+                               y0+img.shape[0]-0.5, y0-0.5])
+        else:
+            plt.imshow(img, origin='upper')
+        
+        #Define plotting extent if required
+        if pxplot is not None:
+            plt.axis([pxplot[0],pxplot[1],pxplot[2],pxplot[3]])
     
-    print '\n' + imn + ': you clicked ', colours
+        #Manually interact to select lightest and darkest part of the region            
+        colours = plt.ginput(n=2, timeout=0, show_clicks=True, mouse_add=1, 
+                            mouse_pop=3, mouse_stop=2)
+        
+        print '\n' + imn + ': you clicked ', colours
+        
+        #Show plot
+        plt.show()
     
-    #Show plot
-    plt.show()
+    #Get point positions in the (cropped) image
+    pts = np.asarray(colours, dtype=np.float64)[:2].astype(int)
+    if offset is not None:
+        pts = pts - np.array(offset[:2], dtype=int)
+    for u, v in pts:
+        if u < 0 or v < 0 or u >= img.shape[1] or v >= img.shape[0]:
+            raise ValueError('Colour range point outside of image (or mask '
+                             'bounding box) in ' + imn)
     
     #Get pixel intensity value for pt1       
-    col1_rbg = img[colours[0][1],colours[0][0]]
+    col1_rbg = img[pts[0][1],pts[0][0]]
     if col1_rbg == 0:
         col1_rbg=1
 
     #Get pixel intensity value for pt2        
-    col2_rbg = img[colours[1][1],colours[1][0]]
+    col2_rbg = img[pts[1][1],pts[1][0]]
     if col2_rbg == 0:
         col2_rbg=1
         
@@ -778,24 +1538,179 @@ def defineColourrange(img, imn, pxplot=None):
     return [upper_boundary, lower_boundary]
    
     
-def getOGRArea(pts):
-    '''Get real world OGR polygons (.shp) from xyz poly pts with real world 
-    points which are compatible with mapping software (e.g. ArcGIS).
+def countPolygonPixels(polys):
+    '''Count the number of image pixels covered by a set of polygons (with
+    overlapping areas counted once). The polygons are rasterized onto a grid
+    spanning only their bounding box.
     
     Args
-    pts (arr):                UV/XYZ coordinates of a given area shape
+    polys (list):             UV coordinates of each polygon
     
     Returns
-    polygons (list):          OGR geometry polygon                           
-    '''                       
-    #Create geometries from uv/xyz coordinates using ogr                     
-    ring = ogr.Geometry(ogr.wkbLinearRing)
-    for p in pts:
-        if np.isnan(p[0]) == False:
-            if len(p)==2:
-                ring.AddPoint(int(p[0]),int(p[1]))
-            else:                  
-                ring.AddPoint(p[0],p[1],p[2])
-    poly = ogr.Geometry(ogr.wkbPolygon)
-    poly.AddGeometry(ring)
-    return poly
\ No newline at end of file
+    count (int):              Number of pixels covered
+    '''
+    polys=[np.round(np.asarray(p).reshape(-1,2)).astype(np.int32) 
+           for p in polys if len(p) > 0]
+    if len(polys)==0:
+        return 0
+    
+    #Get bounding box of all polygons
+    allpts=np.vstack(polys)
+    xmin, ymin = allpts.min(axis=0)
+    xmax, ymax = allpts.max(axis=0)
+    
+    #Rasterize polygons and count covered pixels
+    grid=np.zeros((ymax-ymin+1, xmax-xmin+1), dtype=np.uint8)
+    cv2.fillPoly(grid, polys, 1, offset=(-int(xmin),-int(ymin)))
+    return int(np.count_nonzero(grid))
+    
+    
+def polygonList(pts, dimension=2):
+    '''Get a list of polygon vertex arrays from area coordinates, which are
+    given either as a list of polygons or as the vertices of a single polygon.
+
+    Args
+    pts (list/arr):           UV/XYZ coordinates of polygons
+    dimension (int):          Number of dimensions in point coordinates i.e.
+                              2 or 3
+
+    Returns
+    polys (list):             UV/XYZ coordinates of each polygon (N,dimension)
+    '''
+    if pts is None:
+        return []
+    if isinstance(pts, np.ndarray) and pts.dtype != object and pts.ndim <= 2:
+        if pts.size == 0:
+            return []
+        return [pts.reshape(-1,dimension).astype(np.float64)]
+    return [np.asarray(p, dtype=np.float64).reshape(-1,dimension)
+            for p in pts]
+
+
+def dropNaNPts(pts, offsets):
+    '''Remove points with NaN coordinates from a set of polygons/lines held
+    in a single array, and update the offsets to each polygon/line 
+    accordingly.
+    
+    Args
+    pts (arr):                UV/XYZ coordinates of all vertices
+    offsets (arr):            Index of the first vertex of each polygon/line 
+                              in pts, followed by the total number of vertices
+    
+    Returns
+    pts (arr):                UV/XYZ coordinates without NaN vertices
+    offsets (arr):            Updated offsets
+    '''
+    pts = np.asarray(pts, dtype=np.float64)
+    if pts.ndim != 2:
+        pts = pts.reshape(len(pts),-1)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    valid = ~np.isnan(pts[:,0])
+    if valid.all():
+        return pts, offsets
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    return pts[valid], counts[offsets]
+    
+    
+def polygonAreas(pts, offsets):
+    '''Calculate the planimetric areas of a set of polygons using the 
+    shoelace formula, with the vertices of all polygons held in one array. 
+    Polygon rings do not need to be closed, and vertices with NaN coordinates
+    are ignored.
+    
+    Args
+    pts (arr):                UV/XYZ coordinates of all polygon vertices
+    offsets (arr):            Index of the first vertex of each polygon in 
+                              pts, followed by the total number of vertices
+    
+    Returns
+    areas (arr):              Area of each polygon
+    '''
+    pts, offsets = dropNaNPts(pts, offsets)
+    npoly = len(offsets)-1
+    if npoly < 1:
+        return np.zeros(0)
+    
+    #Index of the next vertex around each polygon ring
+    nxt = np.arange(1, pts.shape[0]+1)
+    starts = offsets[:-1][offsets[1:]>offsets[:-1]]
+    ends = offsets[1:][offsets[1:]>offsets[:-1]]
+    nxt[ends-1] = starts
+    
+    #Sum cross products for each polygon
+    cross = pts[:,0]*pts[nxt,1] - pts[nxt,0]*pts[:,1]
+    ids = np.repeat(np.arange(npoly), np.diff(offsets))
+    return np.abs(np.bincount(ids, weights=cross, minlength=npoly))/2.
+    
+    
+def polygonArea(pts):
+    '''Calculate the planimetric area of a polygon using the shoelace 
+    formula (see polygonAreas).
+    
+    Args
+    pts (arr):                UV/XYZ coordinates of polygon vertices
+    
+    Returns
+    area (float):             Area of polygon
+    '''
+    return float(polygonAreas(pts, [0, len(pts)])[0])
+    
+    
+def polygonCentroids(pts, offsets):
+    '''Calculate the planimetric centroids of a set of polygons held in 
+    one array. The mean vertex position is returned for polygons with zero 
+    area, and NaN for polygons with no vertices.
+    
+    Args
+    pts (arr):                UV/XYZ coordinates of all polygon vertices
+    offsets (arr):            Index of the first vertex of each polygon in 
+                              pts, followed by the total number of vertices
+    
+    Returns
+    centroids (arr):          XY centroid of each polygon (N,2)
+    '''
+    pts, offsets = dropNaNPts(pts, offsets)
+    npoly = len(offsets)-1
+    if npoly < 1:
+        return np.zeros([0,2])
+    
+    #Index of the next vertex around each polygon ring
+    nxt = np.arange(1, pts.shape[0]+1)
+    starts = offsets[:-1][offsets[1:]>offsets[:-1]]
+    ends = offsets[1:][offsets[1:]>offsets[:-1]]
+    nxt[ends-1] = starts
+    
+    #Sum cross products and weighted vertex positions for each polygon
+    x = pts[:,0]
+    y = pts[:,1]
+    cross = x*y[nxt] - x[nxt]*y
+    ids = np.repeat(np.arange(npoly), np.diff(offsets))
+    a = np.bincount(ids, weights=cross, minlength=npoly)
+    cx = np.bincount(ids, weights=(x+x[nxt])*cross, minlength=npoly)
+    cy = np.bincount(ids, weights=(y+y[nxt])*cross, minlength=npoly)
+    
+    #Use mean vertex position where polygon area is zero
+    n = np.maximum(np.diff(offsets), 1)
+    mx = np.bincount(ids, weights=x, minlength=npoly)/n
+    my = np.bincount(ids, weights=y, minlength=npoly)/n
+    zero = a==0
+    a[zero] = 1.
+    centroids = np.column_stack([np.where(zero, mx, cx/(3.*a)),
+                                 np.where(zero, my, cy/(3.*a))])
+    
+    #Return NaN centroids for polygons with no vertices
+    centroids[np.diff(offsets)==0] = np.nan
+    return centroids
+    
+    
+def polygonCentroid(pts):
+    '''Calculate the planimetric centroid of a polygon (see 
+    polygonCentroids).
+    
+    Args
+    pts (arr):                UV/XYZ coordinates of polygon vertices
+    
+    Returns
+    centroid (arr):           XY centroid of polygon
+    '''
+    return polygonCentroids(pts, [0, len(pts)])[0]
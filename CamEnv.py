@@ -28,15 +28,27 @@ CamEnv:                     A class that represents the camera object. This
                             and direction), GCPs, and the DEM
 
 Key stand-alone functions
+findChessboard:             Find chessboard corners in a calibration image,
+                            with an optional downscaled first pass
+calibHash:                  Get a hash of a set of calibration images and 
+                            chessboard dimensions
 calibrateImages:            Calibrate a camera from a set of input calibration
                             images. Calibration is performed using a chessboard 
                             calibration approach         
 project:                    Project xyz world coordinates into corresponding 
                             image coordinates (uv)
+optimiseCamera:             Optimise the camera pose (and optionally location
+                            and focal length) against GCPs by minimising their
+                            reprojection error
 setInvProjVars:             Set the inverse projection variables, based on the 
                             DEM
+updateInvProjVars:          Update the inverse projection variables for a 
+                            new camera pose without recalculating the viewshed
 invproject:                 Inverse project image coordinates (uv) to xyz world 
                             coordinates using inverse projection variables         
+getInvProjInterpolator:     Get the (cached) interpolator of xyz world 
+                            coordinates for a set of inverse projection 
+                            variables
 
 @author: Penny How (p.how@ed.ac.uk)
          Nick Hulton 
@@ -44,17 +56,20 @@ invproject:                 Inverse project image coordinates (uv) to xyz world
 '''
 
 #Import PyTrx packages
-from FileHandler import readImg, readMatrixDistortion, readGCPs
-from Utilities import plotGCPs, plotPrincipalPoint, plotCalib
-from DEM import ExplicitRaster,load_DEM,voxelviewshed
-from Images import CamImage
+from FileHandler import (readImg, readMatrixDistortion, readGCPs, 
+                         writeCalibNPZ, readCalibNPZ)
+from DEM import (ExplicitRaster,loadCachedDEM,voxelviewshed,viewBBox,
+                 pyramidSample)
+from Images import (CamImage, undistortImage, undistortPts, 
+                    clearUndistortCache)
 
 #Import other packages
-from scipy import interpolate
-from PIL import Image
 import numpy as np
 import cv2
 import glob
+import os
+import hashlib
+from multiprocessing import Pool
 
 #------------------------------------------------------------------------------
 
@@ -140,11 +155,15 @@ class CamCalib(object):
                             calibration text files, a list of raw parameters, 
                             or a set of calibration images (along with 
                             calibration chessboard dimensions) 
+    processes (int):        Number of processes used to find chessboard 
+                            corners when calibrating from images (keyword 
+                            only; serial by default, see calibrateImages)
     '''
     
-    def __init__(self, *args): 
+    def __init__(self, *args, **kwargs): 
         '''Constructor to initiate a calibration object.'''            
         failed=False 
+        processes=kwargs.get('processes')
             
         #Read calibration from file
         if isinstance(args[0],str):
@@ -196,7 +215,7 @@ class CamCalib(object):
                     calibimgs.append(i)
                     
                 arg, err = calibrateImages(calibimgs,[int(args[0][1]),
-                                           int(args[0][2])])
+                                           int(args[0][2])], processes)
                 arg = self.checkMatrix(arg)
                 
                 if arg==None:
@@ -283,6 +302,22 @@ class CamCalib(object):
         return self._intrMatCV2
 
         
+    def undistortImage(self, img):
+        '''Return an image array corrected for distortion with the camera 
+        calibration. Undistortion maps are calculated once and then reused 
+        for all images of the same size.'''
+        return undistortImage(img, self.getCamMatrixCV2(), 
+                              self.getDistortCoeffsCV2())
+        
+        
+    def undistortPoints(self, pts, size):
+        '''Return point positions (N x 1 x 2) corrected for distortion with 
+        the camera calibration, for an image of a given size (w,h). This 
+        does not require the image itself to be corrected.'''
+        return undistortPts(pts, self.getCamMatrixCV2(), 
+                            self.getDistortCoeffsCV2(), size)
+        
+        
     def reportCalibData(self):
         '''Self reporter for Camera Calibration object data.'''
         print '\nDATA FROM CAMERA CALIBRATION OBJECT'
@@ -356,9 +391,11 @@ class CamEnv(CamCalib):
                     End
     coords:         The x,y,z coordinates of the camera location, as a list.
     ypr:            The yaw, pitch and roll of the camera, as a list.
+    processes:      Number of processes used when calibrating from images 
+                    (serial by default).
     '''
     
-    def __init__(self, envFile):
+    def __init__(self, envFile, processes=None):
         '''Constructor to initiate Camera Environment object.''' 
         print '\nINITIALISING CAMERA ENVIRONMENT'
  
@@ -409,13 +446,17 @@ class CamEnv(CamCalib):
 
         #Initialise CamCalib object for calibration information        
         self._calibPath=calibPath
-        CamCalib.__init__(self,calibPath)                
+        CamCalib.__init__(self, calibPath, processes=processes)                
                 
-        #Leave DEM and inverse projection variables empty to begin with
+        #Leave DEM and inverse projection variables empty to begin with (set 
+        #on first use with getDEM and getInvProjVars)
         self._DEM = None
+        self._DEMbbox = None
         self._invProjVars = None
+        self._invProjAdaptive = None
       
         #Initialise GCPs object for GCP and DEM information
+        self._gcp=None
         if (self._GCPpath!=None and self._imagePath!=None):
             print '\nCreating GCP environment'
             self._gcp=GCPs(self._DEM, self._GCPpath, self._imagePath)        
@@ -544,19 +585,121 @@ class CamEnv(CamCalib):
         return self._refImage.getImageSize()
 
 
+    def setDEMRange(self, maxrange, fov=None):
+        '''Limit the DEM to the area in view of the camera, out to a maximum
+        range (in DEM units). Only this part of the DEM is subsequently read 
+        from file. The horizontal field of view (in radians) is calculated 
+        from the diagonal of the reference image and the focal length if it 
+        is not given, so that camera roll is also accounted for.'''
+        #Calculate field of view from reference image and focal length
+        if fov is None:
+            size = self.getRefImageSize()
+            diag = np.sqrt(float(size[0])**2 + float(size[1])**2)
+            fov = 2*np.arctan(diag/(2*min(self._focLen)))
+            
+        #Set DEM bounding box, and reset DEM and inverse projection variables
+        self._DEMbbox = viewBBox(self._camloc, self._camDirection[0], 
+                                 maxrange, fov)
+        self._DEM = None
+        self._invProjVars = None
+        print '\nDEM range set to bounding box: ' + str(self._DEMbbox)
+        
+        
+    def getDEMRange(self):
+        '''Return the DEM bounding box [xmin,xmax,ymin,ymax] (None if the 
+        full DEM is used).'''
+        return self._DEMbbox
+        
+        
+    def setInvProjAdaptive(self, adaptive):
+        '''Set the target DEM cell size (in image pixels) for 
+        distance-adaptive sampling of the DEM when the inverse projection 
+        variables are set (see setInvProjVars). The DEM is then sampled from
+        the DEM pyramid instead of at full resolution. Set to None to sample
+        the full resolution DEM. Cached inverse projection variables (see
+        getInvProjVars) are reset.'''
+        self._invProjAdaptive = adaptive
+        self._invProjVars = None
+        
+        
+    def getInvProjAdaptive(self):
+        '''Return the target DEM cell size (in image pixels) for 
+        distance-adaptive inverse projection (None if the full resolution 
+        DEM is used).'''
+        return self._invProjAdaptive
+        
+        
     def getDEM(self):
-        '''Return DEM as ExplicitRaster type.'''
+        '''Return DEM as ExplicitRaster type. The DEM is loaded and 
+        densified once, and shared with any other camera environments using 
+        the same DEM.'''
         if self._DEM is None:
-            dem = load_DEM(self._DEMpath)
-            if self._DEMdensify>1:
-                dem=dem.densify(self._DEMdensify)
-            self._DEM=dem
+            self._DEM = loadCachedDEM(self._DEMpath, self._DEMdensify, 
+                                      self._DEMbbox)
             return self._DEM
         
         else:
             return self._DEM
-
-
+            
+            
+    def getInvProjVars(self):
+        '''Return the inverse projection variables for the camera 
+        environment (see setInvProjVars). The variables are calculated once 
+        and then reused, until the DEM range, the adaptive sampling or the 
+        camera parameters are changed with setDEMRange, setInvProjAdaptive or
+        optimiseCamera.'''
+        if self._invProjVars is None:
+            self._invProjVars = setInvProjVars(self.getDEM(), self._camloc, 
+                                               self._camDirection, 
+                                               self._radCorr, self._tanCorr,
+                                               self._focLen, self._camCen, 
+                                               self._refImage, 
+                                               self._invProjAdaptive)
+        return self._invProjVars
+
+
+    def optimiseCamera(self, optloc=False, optdir=True, optfoc=False):
+        '''Optimise the camera pose (and optionally the camera location and 
+        focal length) against the GCPs, using the optimiseCamera function. 
+        The camera environment is updated with the optimised parameters, and
+        the residual statistics are returned. If the focal length is 
+        optimised then the camera matrix is also updated, so that images and
+        points are corrected for distortion with the optimised focal 
+        length.'''
+        #Get GCP positions
+        if self._gcp is None:
+            raise ValueError('No GCPs defined for camera environment ' + 
+                             str(self._name) + '. Camera optimisation '
+                             'requires a GCP file')
+        xyz, uv = self._gcp.getGCPs()
+        
+        #Optimise camera parameters
+        loc, ypr, foc, stats = optimiseCamera(xyz, uv, self._camloc, 
+                                              self._camDirection, 
+                                              self._radCorr, self._tanCorr, 
+                                              self._focLen, self._camCen, 
+                                              self._refImage, optloc, optdir, 
+                                              optfoc)
+        
+        #Update camera environment
+        if stats is not None:
+            self._camloc = loc
+            self._camDirection = ypr
+            
+            #Update camera matrix and reset undistortion caches
+            if optfoc is True:
+                clearUndistortCache(self.getCamMatrixCV2(), 
+                                    self.getDistortCoeffsCV2())
+                self._focLen = [foc[0], foc[1]]
+                self._intrMat[0,0] = foc[0]
+                self._intrMat[1,1] = foc[1]
+                self._intrMatCV2 = None
+                
+            #Reset inverse projection variables
+            self._invProjVars = None
+        return stats
+        
+        
     def showGCPs(self):
         '''Plot GCPs in image plane and DEM scene.'''
         xyz, uv = self._gcp.getGCPs()               #Get GCP positions
@@ -566,6 +709,7 @@ class CamEnv(CamCalib):
         imn = refimage.getImageName()               #Get image name
 
         #Plot GCPs
+        from Utilities import plotGCPs
         plotGCPs([xyz,uv], img, imn, dem, self._camloc, extent=None)            
 
 
@@ -576,6 +720,7 @@ class CamEnv(CamCalib):
         imn = refimage.getImageName()               #Get image name
         
         #Plot principal point 
+        from Utilities import plotPrincipalPoint
         plotPrincipalPoint(self._camCen, img, imn)
 
 
@@ -588,6 +733,7 @@ class CamEnv(CamCalib):
         distort = self.getDistortCoeffsCV2()        #Get distortion parameters
 
         #Plot calibrated image
+        from Utilities import plotCalib
         plotCalib(matrix, distort, img, imn)       
 
 
@@ -669,17 +815,120 @@ class CamEnv(CamCalib):
         self.reportCalibData()
 
 
-def calibrateImages(imageFiles, xy):
+#Chessboard corners already detected, keyed by image file, modification time
+#and chessboard dimensions
+chessboardCache={}
+
+
+def findChessboard(args):
+    '''Function for finding the chessboard corners in a calibration image, 
+    to subpixel accuracy. If a downscaled size is given, the chessboard is 
+    first searched for in a downscaled copy of the image (which is much 
+    quicker), and the corners found are then refined at full resolution. The
+    full resolution image is searched if the chessboard is not found in the 
+    downscaled copy. The inputs are given as one tuple so that the function 
+    can be mapped over a process pool.
+    
+    Inputs
+    fname:              Image file path
+    xy:                 Chessboard dimensions (number of corner features)
+    downscale:          Maximum image dimension for the first pass (None for
+                        full resolution only)
+    
+    Outputs
+    patternFound:       Flag denoting whether the chessboard was found
+    corners:            Chessboard corners (None if not found)
+    shape:              Image shape
+    '''
+    fname, xy, downscale = args
+    
+    #Read file as an image and change RGB values to grayscale
+    gray = cv2.cvtColor(cv2.imread(fname),cv2.COLOR_BGR2GRAY)
+    
+    #Find chessboard corners in downscaled image
+    patternFound = False
+    corners = None
+    scale = 1.
+    if downscale is not None and max(gray.shape) > downscale:
+        scale = float(downscale)/max(gray.shape)
+        small = cv2.resize(gray, None, fx=scale, fy=scale, 
+                           interpolation=cv2.INTER_AREA)
+        patternFound, corners = cv2.findChessboardCorners(small,
+                                                          (xy[1],xy[0]),
+                                                          None)
+        if patternFound == True:
+            corners = (corners/scale).astype(np.float32)
+            
+    #Find chessboard corners at full resolution if needed
+    if patternFound != True:
+        scale = 1.
+        patternFound, corners = cv2.findChessboardCorners(gray,
+                                                          (xy[1],xy[0]),
+                                                          None)
+    
+    #Determine chessboard corners to subpixel accuracy
+    #Inputs: winSize specified 11x11 (enlarged for corners from the 
+    #downscaled image), zeroZone is nothing (-1,-1), opencv criteria
+    if patternFound == True:
+        win = int(max(11, np.ceil(2./scale)))
+        cv2.cornerSubPix(gray,corners,(win,win),(-1,-1),
+                         (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER,
+                         30,0.001))
+    else:
+        corners = None
+        
+    return bool(patternFound), corners, gray.shape
+    
+    
+def calibHash(imageFiles, xy):
+    '''Function for getting a hash of a set of calibration images (from the 
+    contents of each image file) and the chessboard dimensions. This is used
+    to identify cached calibrations.'''
+    h = hashlib.sha1()
+    h.update(str([int(i) for i in xy]))
+    for fname in sorted(imageFiles):
+        f = open(fname, 'rb')
+        for chunk in iter(lambda: f.read(1048576), ''):
+            h.update(chunk)
+        f.close()
+    return h.hexdigest()
+    
+    
+def calibrateImages(imageFiles, xy, processes=None, downscale=1000, 
+                    cache=True):
     '''Function for calibrating a camera from a set of input calibration
     images. Calibration is performed using OpenCV's chessboard calibration 
     functions. Input images (imageFile) need to be of a chessboard with 
-    regular dimensions and a known number of corner features (xy).
+    regular dimensions and a known number of corner features (xy). 
+    
+    Chessboard corners are found with the findChessboard function, using a 
+    pool of processes if processes is greater than 1 (serially if processes 
+    is None or 1), and a downscaled first pass if a downscaled size 
+    (maximum image dimension) is given. A process pool re-imports the 
+    calling script in each worker on Windows, so scripts that use more than 
+    one process must be guarded with if __name__ == '__main__'. 
+    Detected corners are cached for each image, so images are only searched
+    once per session. 
+    
+    If cache is True then the calibration output is also written to a .npz
+    file in the directory of the calibration images, named from the hash of 
+    the image set and the chessboard dimensions. If this file already exists
+    then the calibration is read from it and not recalculated.
     
     Please note that OpenCV's calibrateCamera function is incompatible 
     between different versions of OpenCV. Included here are both functions 
     for version 2 and version 3. Please see OpenCV's documentation for 
     newer versions.
     '''        
+    #Return cached calibration if present
+    if cache is True:
+        cachedir = os.path.dirname(os.path.abspath(imageFiles[0]))
+        cachefile = os.path.join(cachedir, 'calib_' + 
+                                 calibHash(imageFiles, xy)[:16] + '.npz')
+        if os.path.exists(cachefile):
+            print '\nCamera calibration read from cache: ' + cachefile
+            return readCalibNPZ(cachefile)
+            
     #Define shape of array
     objp = np.zeros((xy[0]*xy[1],3), np.float32)           
     objp[:,:2] = np.mgrid[0:xy[1],0:xy[0]].T.reshape(-1,2) 
@@ -688,52 +937,51 @@ def calibrateImages(imageFiles, xy):
     objpoints = []                                   
     imgpoints = []                                   
     
-    #Set image counter for loop
-    imageCount = 0
+    #Get cache keys and images without cached corners
+    keys = [(os.path.abspath(f), os.path.getmtime(f), tuple(xy)) 
+            for f in imageFiles]
+    todo = [[f, k] for f, k in zip(imageFiles, keys) 
+            if k not in chessboardCache]
+    
+    #Find chessboard corners, in parallel if more than one process is used
+    args = [(f, xy, downscale) for f, k in todo]
+    if processes is not None and processes > 1 and len(args) > 1:
+        pool = Pool(processes)
+        try:
+            found = pool.map(findChessboard, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        found = [findChessboard(a) for a in args]
+    
+    #Add detected corners to cache
+    for (f, k), result in zip(todo, found):
+        chessboardCache[k] = result
     
     #Loop to determine if each image contains a chessboard pattern and 
     #store corner values if it does
-    for fname in imageFiles:
-        
-        #Read file as an image using OpenCV
-        img = cv2.imread(fname)   
-
-        #Change RGB values to grayscale             
-        gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)    
-        
-        #Find chessboard corners in image
-        patternFound, corners = cv2.findChessboardCorners(gray,
-                                                          (xy[1],xy[0]),
-                                                          None)
+    for imageCount, (fname, key) in enumerate(zip(imageFiles, keys)):
+        patternFound, corners, shape = chessboardCache[key]
         
         #Cycle through images, print if chessboard corners have been found 
         #for each image
-        imageCount += 1
-        print str(imageCount) + ': ' + str(patternFound) + ' ' + fname
+        print str(imageCount+1) + ': ' + str(patternFound) + ' ' + fname
         
         #If found, append object points to objp array
         if patternFound == True:
             objpoints.append(objp)
-            
-            #Determine chessboard corners to subpixel accuracy
-            #Inputs: winSize specified 11x11, zeroZone is nothing (-1,-1), 
-            #opencv criteria
-            cv2.cornerSubPix(gray,corners,(11,11),(-1,-1),
-                             (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER,
-                             30,0.001))
-                             
             imgpoints.append(corners)
             
-            #Draw and display corners
-            cv2.drawChessboardCorners(img,(xy[1],xy[0]),corners,
-                                      patternFound)
+    #Get image size for calibration
+    imsize = shape[::-1]
     
     #Try OpenCV v3 calibration function
     try:
         #Calculate initial camera matrix and distortion
         err,mtx,dist,rvecs,tvecs = cv2.calibrateCamera(objpoints,
                                                        imgpoints,
-                                                       gray.shape[::-1],
+                                                       imsize,
                                                        None,
                                                        5)
         #Retain principal point coordinates
@@ -742,7 +990,7 @@ def calibrateImages(imageFiles, xy):
         #Optimise camera matrix and distortion using fixed principal point
         err,mtx,dist,rvecs,tvecs = cv2.calibrateCamera(objpoints,
                                                        imgpoints,
-                                                       gray.shape[::-1],
+                                                       imsize,
                                                        mtx,
                                                        5,
                                                        flags=cv2.CALIB_FIX_PRINCIPAL_POINT)
@@ -752,7 +1000,7 @@ def calibrateImages(imageFiles, xy):
         #Calculate initial camera matrix and distortion
         err,mtx,dist,rvecs,tvecs = cv2.calibrateCamera(objpoints,
                                                        imgpoints,
-                                                       gray.shape[::-1])
+                                                       imsize)
 
         #Retain principal point coordinates
         pp = [mtx[0][2],mtx[1][2]]
@@ -760,7 +1008,7 @@ def calibrateImages(imageFiles, xy):
         #Optimise camera matrix and distortion using fixed principal point
         err,mtx,dist,rvecs,tvecs = cv2.calibrateCamera(objpoints,
                                                        imgpoints,
-                                                       gray.shape[::-1],
+                                                       imsize,
                                                        cameraMatrix=mtx,
                                                        flags=cv2.CALIB_FIX_PRINCIPAL_POINT)                                                                     
 
@@ -774,44 +1022,51 @@ def calibrateImages(imageFiles, xy):
     rad = np.array([dist[0],dist[1],dist[4], 0.0, 0.0, 0.0]).reshape(6)
     tan = np.array(dist[2:4]).reshape(2)
     
+    #Write calibration to cache
+    if cache is True:
+        try:
+            writeCalibNPZ(mtx, tan, rad, err, cachefile)
+        except IOError:
+            print '\nUnable to write calibration cache: ' + cachefile
+    
     #Return matrix, radial distortion and tangential distortion parameters
     return [mtx, tan, rad], err
         
 
-def constructDEM(dempath, densefactor):
-    '''Return the dem object.'''
-    #Prepare DEM from file
-    dem=load_DEM(dempath)
-        
-    #DEM densification
-    if densefactor>1:
-        dem=dem.densify(densefactor)
-            
-    return dem
+def constructDEM(dempath, densefactor, bbox=None):
+    '''Return the dem object, optionally only covering a bounding box 
+    [xmin,xmax,ymin,ymax]. The DEM is taken from the process-wide DEM cache,
+    so it is only loaded and densified once.'''
+    return loadCachedDEM(dempath, densefactor, bbox)
 
             
-def setInvProjVars(dem, camloc, camdir, radial, tangen, foclen, camcen, refimg):
-    '''Set the inverse projection variables, based on the DEM.'''             
+def setInvProjVars(dem, camloc, camdir, radial, tangen, foclen, camcen, refimg,
+                   adaptive=None):
+    '''Set the inverse projection variables, based on the DEM. The DEM can 
+    be given as a DEM object or as a list of [path, densify factor], with an
+    optional bounding box as a third item. If a target cell size in image 
+    pixels is given (adaptive) then the DEM is sampled from the DEM pyramid,
+    with fine cells near the camera and coarse cells far away, so that the 
+    inverse projection points have roughly uniform density in the image.'''             
     print '\nSetting inverse projection coefficients'         
 
     if isinstance(dem, list):
-        dem=constructDEM(dem[0], dem[1])
-        X=dem.getData(0)
-        Y=dem.getData(1)
-        Z=dem.getData(2)        
-    else:    
+        dem=constructDEM(*dem)
+    
+    #Sample DEM at distance-adaptive resolution
+    if adaptive is not None:
+        XYZ=pyramidSample(dem, camloc, max(foclen), adaptive)
+        
+    else:
         X=dem.getData(0)
         Y=dem.getData(1)
         Z=dem.getData(2)
     
-    #Define visible extent of the DEM from the location of the camera
-    visible=voxelviewshed(dem, camloc)
-#    self._visible=visible
-#        Z=Z/visible
-
+        #Define visible extent of the DEM from the location of the camera
+        visible=voxelviewshed(dem, camloc)
+        XYZ=np.column_stack([X[visible[:]],Y[visible[:]],Z[visible[:]]])
 
     #Snap image plane to DEM extent
-    XYZ=np.column_stack([X[visible[:]],Y[visible[:]],Z[visible[:]]])
     uv0,dummy,inframe=project(camloc, camdir, radial, tangen, foclen, 
                               camcen, refimg, XYZ)
     uv0=np.column_stack([uv0,XYZ])
@@ -829,6 +1084,24 @@ def setInvProjVars(dem, camloc, camdir, radial, tangen, foclen, camcen, refimg):
     return invProjVars
             
 
+def updateInvProjVars(invprojvars, camloc, camdir, radial, tangen, foclen, 
+                      camcen, refimg):
+    '''Update the inverse projection variables for a new camera pose (e.g. 
+    after a small change in camera direction), without recalculating the 
+    viewshed. The visible DEM points held in the existing inverse projection
+    variables are reprojected into the image with the new pose, which is 
+    valid whilst the camera location does not change.'''
+    #Get visible DEM points
+    XYZ=np.column_stack([invprojvars[0],invprojvars[1],invprojvars[2]])
+    
+    #Project points with new camera pose
+    uv0,dummy,inframe=project(camloc, camdir, radial, tangen, foclen, 
+                              camcen, refimg, XYZ)
+    
+    #Return updated inverse projection variables
+    return [XYZ[inframe,0],XYZ[inframe,1],XYZ[inframe,2],uv0[inframe,:]]
+    
+    
 def project(camloc, camdirection, radial, tangen, foclen, camcen, refimg, xyz):
     '''Project the xyz world coordinates into the corresponding image 
     coordinates (uv). This is primarily executed using the ImGRAFT 
@@ -887,21 +1160,12 @@ def project(camloc, camdirection, radial, tangen, foclen, camcen, refimg, xyz):
 
     #ImGRAFT/Matlab version of code below: 
     #uv=[cam.f[1]*xy(:,1)+cam.c(1), cam.f(2)*xy(:,2)+cam.c(2)];       (MAT)
-    uv=np.empty([xy.shape[0],xy.shape[1]])
-               
-    for i in range(xy.shape[0]):
-        uv[i,0]=foclen[0] * xy[i,0] + camcen[0]
-        uv[i,1]=foclen[1] * xy[i,1] + camcen[1]
+    uv=np.column_stack([foclen[0]*xy[:,0]+camcen[0], 
+                        foclen[1]*xy[:,1]+camcen[1]])
  
-    for i in range(xy.shape[0]):
-        if xyz[i,2]<=0:
-            uv[i,0]=np.nan
-            uv[i,1]=np.nan
-
+    #Remove points behind the camera
     depth=xyz[:,2]
-    
-    #Create empty array representing the image
-    inframe=np.zeros(xy.shape[0],dtype=bool)
+    uv[depth<=0,:]=np.nan
 
     #Get size of reference image
     if isinstance(refimg, str):
@@ -912,19 +1176,166 @@ def project(camloc, camdirection, radial, tangen, foclen, camcen, refimg, xyz):
     else:
         ims=refimg.getImageSize()
     
-    for i in range(xy.shape[0]):
-        inframe[i]=(depth[i]>0)&(uv[i,0]>=1)&(uv[i,1]>=1)
-        inframe[i]=inframe[i]&(uv[i,0]<=ims[1])&(uv[i,1]<=ims[0])
+    #Define whether each point is inside the image frame
+    inframe=(depth>0)&(uv[:,0]>=1)&(uv[:,1]>=1)
+    inframe=inframe&(uv[:,0]<=ims[1])&(uv[:,1]<=ims[0])
     
     return uv,depth,inframe
 
+
+def optimiseCamera(gcpxyz, gcpuv, camloc, camdir, radial, tangen, foclen, 
+                   camcen, refimg, optloc=False, optdir=True, optfoc=False):
+    '''Optimise the camera pose (and optionally location and focal length) 
+    by minimising the reprojection error of the ground control points. The 
+    GCPs are projected with the project function for all points at once, and
+    the pose is solved with SciPy's least_squares function (using 
+    finite-difference Jacobians evaluated on the whole GCP set).
+    
+    Inputs
+    gcpxyz:             GCP world coordinates (N x 3)
+    gcpuv:              GCP image coordinates (N x 2)
+    camloc:             Camera location [x,y,z]
+    camdir:             Camera direction [yaw,pitch,roll]
+    radial:             Radial distortion coefficients
+    tangen:             Tangential distortion coefficients
+    foclen:             Focal length [fx,fy]
+    camcen:             Camera centre [cx,cy]
+    refimg:             Reference image (used for image size)
+    optloc:             Flag denoting whether camera location is optimised
+    optdir:             Flag denoting whether camera direction is optimised
+    optfoc:             Flag denoting whether focal length is optimised (as a
+                        single scaling of fx and fy)
+    
+    Outputs
+    camloc:             Optimised camera location
+    camdir:             Optimised camera direction
+    foclen:             Optimised focal length
+    stats:              Dictionary of residual statistics (in pixels) before 
+                        ('rms0', 'mean0', 'max0') and after ('rms', 'mean', 
+                        'median', 'max') optimisation, as well as the 
+                        residual of each GCP ('residuals')
+    '''
+    from scipy.optimize import least_squares
+    gcpxyz=np.asarray(gcpxyz,dtype=np.float64)
+    gcpuv=np.asarray(gcpuv,dtype=np.float64)
+    camloc=np.asarray(camloc,dtype=np.float64)
+    camdir=np.asarray(camdir,dtype=np.float64)
+    foclen=np.asarray(foclen,dtype=np.float64)
+    
+    #Get image size for penalising points behind the camera
+    if isinstance(refimg, str):
+        refimg=readImg(refimg)
+    if isinstance(refimg, np.ndarray):
+        ims=refimg.shape
+    else:
+        ims=refimg.getImageSize()
+    penalty=float(np.hypot(ims[0],ims[1]))
+    
+    #Unpack camera parameters from parameter vector
+    def unpack(params):
+        i=0
+        loc=camloc
+        ypr=camdir
+        foc=foclen
+        if optloc is True:
+            loc=params[i:i+3]
+            i=i+3
+        if optdir is True:
+            ypr=params[i:i+3]
+            i=i+3
+        if optfoc is True:
+            foc=foclen*params[i]
+        return loc,ypr,foc
+    
+    #Get GCP residuals for parameter vector
+    def residuals(params):
+        loc,ypr,foc=unpack(params)
+        uv,depth,inframe=project(loc, ypr, radial, tangen, foc, camcen, 
+                                 refimg, gcpxyz)
+        res=(uv-gcpuv).ravel()
+        res[np.isnan(res)]=penalty
+        return res
+    
+    #Define initial parameter vector
+    params0=[]
+    if optloc is True:
+        params0.extend(camloc)
+    if optdir is True:
+        params0.extend(camdir)
+    if optfoc is True:
+        params0.append(1.)
+    params0=np.array(params0)
+    if params0.size==0:
+        print '\nNo camera parameters set for optimisation'
+        return camloc, camdir, foclen, None
+    
+    #Get residuals before optimisation
+    res0=np.hypot(*residuals(params0).reshape(-1,2).T)
+        
+    #Optimise camera parameters
+    print '\nOptimising camera parameters from ' + str(len(gcpxyz)) + ' GCPs'
+    result=least_squares(residuals, params0, x_scale='jac')
+    loc,ypr,foc=unpack(result.x)
+    
+    #Get residual statistics
+    res=np.hypot(*residuals(result.x).reshape(-1,2).T)
+    stats={'residuals':res, 
+           'rms0':np.sqrt(np.mean(res0**2)), 'mean0':np.mean(res0), 
+           'max0':np.max(res0), 'rms':np.sqrt(np.mean(res**2)), 
+           'mean':np.mean(res), 'median':np.median(res), 'max':np.max(res)}
+    print ('GCP residual RMS: ' + str(stats['rms0']) + ' px before, ' + 
+           str(stats['rms']) + ' px after optimisation')
+    
+    return np.array(loc), np.array(ypr), np.array(foc), stats
+
  
+#Interpolators already constructed for sets of inverse projection variables,
+#keyed by the id of the uv0 array (which is also stored, so that the id 
+#cannot be reused whilst the entry is held)
+invprojCache={}
+
+
+def getInvProjInterpolator(invprojvars):
+    '''Return a linear interpolator of the xyz world coordinates over the 
+    image plane for a set of inverse projection variables. A single Delaunay 
+    triangulation of the uv0 coordinates is shared by the X, Y and Z values, 
+    and the interpolator is only constructed once for each set of variables.
+    
+    Inputs
+    invprojvars:        Inverse projection variables
+    
+    Outputs
+    interp:             Interpolator, returning an (N,3) array of xyz 
+                        coordinates for an (N,2) array of uv coordinates
+    '''
+    from scipy import interpolate
+    uv0=invprojvars[3]
+    cached=invprojCache.get(id(uv0))
+    if cached is not None and cached[0] is uv0:
+        return cached[1]
+    
+    #Construct interpolator from stacked X, Y and Z values
+    xyz0=np.column_stack([np.ravel(invprojvars[0]), np.ravel(invprojvars[1]),
+                          np.ravel(invprojvars[2])])
+    interp=interpolate.LinearNDInterpolator(uv0, xyz0)
+    
+    #Hold a limited number of interpolators (e.g. when the camera pose is 
+    #updated for each image)
+    if len(invprojCache) >= 8:
+        invprojCache.clear()
+    invprojCache[id(uv0)]=(uv0, interp)
+    return interp
+    
+    
 def invproject(uv, invprojvars):  
     '''Inverse project image coordinates (uv) to xyz world coordinates
     using inverse projection variables (set using self._setInvProjVars).         
     This is primarily executed using the ImGRAFT projection function 
     found in camera.m:            
     uv,depth,inframe=cam.project(xyz)
+    All uv coordinates should be passed in a single call where possible (e.g.
+    all polygon vertices in an image), as the interpolation is then performed 
+    at once.
     
     Inputs
     uv:                 Pixel coordinates in image
@@ -933,23 +1344,14 @@ def invproject(uv, invprojvars):
     Outputs
     xyz:                World coordinates 
     '''                  
-    #Create empty numpy array
-    xyz=np.zeros([uv.shape[0],3])
-    xyz[::]=float('NaN')
-    
-    #Get XYZ real world coordinates and corresponding uv coordinates
-    X=invprojvars[0]
-    Y=invprojvars[1]
-    Z=invprojvars[2]
-    uv0=invprojvars[3]
-    
     #Snap uv and xyz grids together
-    xi=interpolate.griddata(uv0, X, uv, method='linear')
-    yi=interpolate.griddata(uv0, Y, uv, method='linear')
-    zi=interpolate.griddata(uv0, Z, uv, method='linear')
+    uv=np.asarray(uv, dtype=np.float64).reshape(-1,2)
+    if uv.shape[0]==0:
+        return np.zeros([0,3])
+    interp=getInvProjInterpolator(invprojvars)
     
     #Return xyz grids                
-    xyz=np.column_stack([xi,yi,zi])       
+    xyz=interp(uv)       
     return xyz
 
 
@@ -11,14 +11,36 @@ this data into the camera environment (CamEnv) object class.
 Classes
 ExplicitRaster:                 A class to represent a numeric Raster with 
                                 explicit XY cell referencing in each grid cell
+ImplicitRaster:                 A class to represent a numeric Raster on a 
+                                regular grid, with XY cell referencing 
+                                described by an affine geotransform
 
 
 Key functions
 densify:                        Densify a DEM array by a given densification 
                                 factor (i.e. 'smoothing')           
+coarsen:                        Coarsen a DEM array by averaging blocks of 
+                                cells
+getPyramid:                     Return a (cached) pyramid of coarsened DEMs
 
 Key stand-alone functions
-load_DEM:                       Load DEM from .mat or .tiff file
+load_DEM:                       Load DEM from .mat or .tiff file, 
+                                optionally reading only a bounding box
+blockMean:                      Average a grid over blocks of cells, ignoring
+                                NaN cells
+densifyAxes:                    Get densified cell-centre axes for a given 
+                                densification factor
+bilinearGrid:                   Bilinearly interpolate a regular grid onto new
+                                axes, ignoring NaN cells
+setDEMCacheDir:                 Set a directory for memory-mapped DEM caches
+                                shared between processes
+invalidateDEMCache:             Remove DEMs from the process-wide DEM cache
+loadCachedDEM:                  Load (and densify) a DEM once per process
+saveCachedArray:                Write a .npy DEM cache file atomically
+viewBBox:                       Calculate the bounding box of the DEM area 
+                                in view of a camera
+pyramidSample:                  Sample visible DEM cells at a resolution that 
+                                adapts to the distance from the camera
 voxelviewshed:                  Calculate a viewshed over a DEM from a given 
                                 viewpoint in the DEM scene    
       
@@ -29,13 +51,10 @@ voxelviewshed:                  Calculate a viewshed over a DEM from a given
 
 #Import packages
 import numpy as np
-import scipy.io as sio
-import gdal
 import math
-from scipy import interpolate
-from gdalconst import GA_ReadOnly 
-import struct
-from scipy.interpolate import RectBivariateSpline
+import os
+import hashlib
+import tempfile
 
 #------------------------------------------------------------------------------
 
@@ -63,6 +82,7 @@ class ExplicitRaster(object):
         #Define class atrributes
         self._data=np.array([X,Y,Z]) 
         self._nodata=nodata
+        self._pyramid=None
         self._extents=[X[0][0]-0.5*(X[0][1]-X[0][0]),X[-1][-1]+0.5*(X[-1][-1]-
                        X[-1][-2]),Y[0][0]-0.5*(Y[1][0]-Y[0][0]),Y[-1][-1]+0.5*
                        (Y[-1][-1]-Y[-2][-1])]
@@ -137,55 +157,80 @@ class ExplicitRaster(object):
         return ExplicitRaster(X,Y,Z)
  
        
+    def clip(self,bbox):
+        '''Return the subset of the DEM array that covers a given bounding 
+        box, given as [xmin,xmax,ymin,ymax]. One extra cell is kept on each 
+        side so that the bounding box is fully enclosed by cell centres.
+        '''
+        #Get cell-centre coordinates along each axis
+        x=self.getData(0)[0,:]
+        y=self.getData(1)[:,0]
+        
+        #Find columns and rows covering the bounding box
+        cmin=np.searchsorted(x,bbox[0],side='left')-1
+        cmax=np.searchsorted(x,bbox[1],side='right')+1
+        rmin=np.searchsorted(y,bbox[2],side='left')-1
+        rmax=np.searchsorted(y,bbox[3],side='right')+1
+        
+        #Extract subset
+        return self.subset(cmin,cmax,rmin,rmax)
+        
+        
     def densify(self, densefac=2):
         '''Function to densify the DEM array by a given densification factor.
-        The array is multiplied by the given densification factor and then
-        subsequently values are interpolated using the SciPy function 
-        RectBivariateSpline. The densification factor is set to 2 by default,
-        meaning that the size of the DEM array is doubled.
+        The number of grid cells along each axis is multiplied by the given 
+        densification factor (which does not need to be an integer) and then 
+        values are bilinearly interpolated over the whole grid at once using 
+        the bilinearGrid function, which ignores NaN cells. The densification
+        factor is set to 2 by default, meaning that the size of the DEM array 
+        is doubled.
         '''
-        
         #Get XYZ dem data
         x=self._data[0,0,:]
         y=self._data[1,:,0]        
-        z=np.transpose(self._data[2])
-        
-        #Multipy size of xy arrays by the densification factor
-        nx=((x.size-1)*densefac)+1
-        ny=((y.size-1)*densefac)+1
         
         #Define new array data spacing
-        xd = np.linspace(x[0], x[-1], nx)
-        yd = np.linspace(y[0], y[-1], ny)
+        xd,yd=densifyAxes(x,y,densefac)
         
-        #Create mesh grid
-        yv,xv = np.meshgrid(yd,xd)
-
-        #Interpolate 
-        f=RectBivariateSpline(x, y, z, bbox=[None, None, None, None], 
-                              kx=1, ky=1, s=0)
-
-        #Create empty array for Z data
-        zv=np.zeros((nx,ny))
+        #Interpolate over grid
+        zv=bilinearGrid(x,y,self._data[2],xd,yd)
         
-        #Reshape XYZ arrays
-        xv=np.reshape(xv,(nx*ny))
-        yv=np.reshape(yv,(nx*ny))
-        zv=np.reshape(zv,(nx*ny))
-             
-        #Populate empty Z array
-        for i in range(xv.size):
-            zv[i]=f(xv[i],yv[i])
-
-        #Transpose arrays for compatibility        
-        xv=np.transpose(np.reshape(xv,(nx,ny)))
-        yv=np.transpose(np.reshape(yv,(nx,ny)))
-        zv=np.transpose(np.reshape(zv,(nx,ny)))
+        #Create mesh grid
+        xv,yv=np.meshgrid(xd,yd)
 
         #Construct new XYZ array        
         return ExplicitRaster(xv,yv,zv)
                
         
+    def coarsen(self, factor=2):
+        '''Function to coarsen the DEM array by a given integer factor, 
+        averaging each block of factor x factor cells (ignoring NaN cells).
+        '''
+        X=blockMean(self.getData(0),factor)
+        Y=blockMean(self.getData(1),factor)
+        Z=blockMean(self.getData(2),factor)
+        return ExplicitRaster(X,Y,Z,self._nodata)
+        
+        
+    def getPyramid(self, levels=6):
+        '''Return a pyramid of the DEM, as a list of rasters where each level
+        is coarsened by a factor of 2 from the previous one (starting with 
+        the DEM itself). The pyramid is only built once and then reused, and 
+        stops early if a level becomes smaller than 4 cells across.
+        '''
+        if self._pyramid is None:
+            self._pyramid=[self]
+            
+        #Add coarser levels as needed
+        while len(self._pyramid)<levels:
+            last=self._pyramid[-1]
+            if min(last.getShape())<8:
+                break
+            self._pyramid.append(last.coarsen(2))
+            
+        return self._pyramid[:levels]
+        
+        
     def reportDEM(self):
         '''Self reporter for DEM class object. Returns the number of rows and
         columns in the array, how NaN values in the array are filled, and the
@@ -199,20 +244,252 @@ class ExplicitRaster(object):
                self.getExtent())
  
     
-def load_DEM(demfile):
+class ImplicitRaster(ExplicitRaster):
+    '''A class to represent a numeric Raster on a regular grid, where XY cell 
+    referencing is described by an affine geotransform rather than stored for
+    each grid cell. Only the Z data is held in memory; X and Y are generated
+    as read-only broadcast views when requested. The accessor methods are the
+    same as the ExplicitRaster class.
+    
+    Args
+    Z:              Z data (with rows ordered by increasing Y)
+    geotransform:   Affine geotransform, given as [originX, pixelWidth, 0, 
+                    originY, 0, pixelHeight] (as returned by GDAL), where
+                    the origin is the corner of the first grid cell
+    nodata:         Condition for NaN data values (default: 'nan')
+    '''
+    
+    #Basic constuctor method
+    def __init__(self, Z, geotransform, nodata=float('nan')): 
+        
+        #Define class atrributes
+        self._z=Z
+        self._transform=[float(g) for g in geotransform]
+        self._nodata=nodata
+        self._pyramid=None
+        
+        
+    def getTransform(self):
+        '''Return the affine geotransform of the DEM.'''
+        return self._transform
+        
+        
+    def getXY(self):
+        '''Return the 1D cell-centre X and Y coordinates of the DEM.'''
+        ox,pw,dummy,oy,dummy,ph=self._transform
+        x=ox+(np.arange(self._z.shape[1])+0.5)*pw
+        y=oy+(np.arange(self._z.shape[0])+0.5)*ph
+        return x,y
+        
+        
+    def getData(self,dim=None):
+        '''Return DEM data. XYZ dimensions can be individually called with the
+        dim input variable (integer: 0, 1, or 2). X and Y are returned as 
+        read-only broadcast views of the cell-centre coordinates. If no 
+        dimension is specified then the full XYZ array is constructed.
+        '''
+        #Return all DEM data if no dimension is specified
+        if dim==None:
+            return np.array([self.getData(0),self.getData(1),self._z])
+        
+        #Return X or Y as broadcast views
+        elif dim==0:
+            x,y=self.getXY()
+            return np.broadcast_to(x[np.newaxis,:],self._z.shape)
+        elif dim==1:
+            x,y=self.getXY()
+            return np.broadcast_to(y[:,np.newaxis],self._z.shape)
+        
+        #Return Z data
+        elif dim==2:
+            return self._z
+        
+        #Return None if no DEM data present 
+        else:
+            return None
+            
+            
+    def getShape(self):
+        '''Return the shape of the DEM data array.'''
+        return self._z.shape
+
+    
+    def getRows(self):
+        '''Return the number of rows in the DEM data array.'''
+        return self._z.shape[0]
+
+        
+    def getCols(self):
+        '''Return the number of columns in the DEM data array.'''
+        return self._z.shape[1]
+        
+        
+    def getExtent(self):
+        '''Return DEM extent.'''
+        ox,pw,dummy,oy,dummy,ph=self._transform
+        return [ox,ox+self._z.shape[1]*pw,oy,oy+self._z.shape[0]*ph]
+        
+        
+    def subset(self,cmin,cmax,rmin,rmax):
+        '''Return a specified subset of the DEM array. The Z data of the 
+        subset is a view of the original array.
+        '''
+        #Find minimum extent value
+        cmin=int(max(0,cmin))
+        rmin=int(max(0,rmin))
+        
+        #Find maximum extent value
+        cmax=int(min(self._z.shape[1],cmax))
+        rmax=int(min(self._z.shape[0],rmax))
+        
+        #Shift geotransform origin to the subset
+        ox,pw,rx,oy,ry,ph=self._transform
+        transform=[ox+cmin*pw,pw,rx,oy+rmin*ph,ry,ph]
+        
+        #Construct new raster 
+        return ImplicitRaster(self._z[rmin:rmax,cmin:cmax],transform,
+                              self._nodata)
+        
+        
+    def coarsen(self, factor=2):
+        '''Function to coarsen the DEM array by a given integer factor, 
+        averaging each block of factor x factor cells (ignoring NaN cells).
+        '''
+        ox,pw,rx,oy,ry,ph=self._transform
+        transform=[ox,pw*factor,rx,oy,ry,ph*factor]
+        return ImplicitRaster(blockMean(self._z,factor),transform,
+                              self._nodata)
+        
+        
+    def densify(self, densefac=2):
+        '''Function to densify the DEM array by a given densification factor.
+        Grid spacing is divided by the densification factor (which does not 
+        need to be an integer), with the first and last cell centres kept the 
+        same, and values are bilinearly interpolated over the whole grid at 
+        once using the bilinearGrid function, which ignores NaN cells.
+        '''
+        #Get XYZ dem data
+        x,y=self.getXY()
+        
+        #Define new array data spacing
+        xd,yd=densifyAxes(x,y,densefac)
+        
+        #Interpolate over grid
+        zv=bilinearGrid(x,y,self._z,xd,yd)
+        
+        #Define new geotransform
+        ox,pw,rx,oy,ry,ph=self._transform
+        if xd.size>1:
+            pw=xd[1]-xd[0]
+        if yd.size>1:
+            ph=yd[1]-yd[0]
+        transform=[xd[0]-0.5*pw,pw,rx,yd[0]-0.5*ph,ry,ph]
+        
+        #Construct new raster
+        return ImplicitRaster(zv,transform,self._nodata)
+        
+        
+def blockMean(z, factor):
+    '''Function to average a grid over blocks of factor x factor cells, 
+    ignoring NaN cells. Cells beyond the last whole block are dropped.
+    '''
+    #Trim grid to whole blocks and split into blocks
+    rows=(z.shape[0]//factor)*factor
+    cols=(z.shape[1]//factor)*factor
+    z=np.asarray(z[:rows,:cols],dtype=np.float64)
+    z=z.reshape(rows//factor,factor,cols//factor,factor)
+    
+    #Average valid cells in each block
+    valid=~np.isnan(z)
+    count=valid.sum(axis=(1,3))
+    total=np.where(valid,z,0.).sum(axis=(1,3))
+    zb=np.full(count.shape,np.nan)
+    np.divide(total,count,out=zb,where=count>0)
+    return zb
+    
+    
+def densifyAxes(x, y, densefac):
+    '''Function to get densified cell-centre axes, keeping the first and last
+    cell centres the same and multiplying the number of grid cells along each
+    axis by the densification factor.
+    '''
+    #Multipy size of xy arrays by the densification factor
+    nx=int(round((x.size-1)*densefac))+1
+    ny=int(round((y.size-1)*densefac))+1
+    
+    #Define new array data spacing
+    xd=np.linspace(x[0], x[-1], max(nx,2))
+    yd=np.linspace(y[0], y[-1], max(ny,2))
+    return xd,yd
+    
+    
+def bilinearGrid(x, y, z, xd, yd):
+    '''Function to bilinearly interpolate a regular grid (z, with cell-centre
+    axes x and y) onto a new grid defined by the axes xd and yd. The 
+    interpolation is separable, so the whole grid is evaluated at once from 
+    the four surrounding cells of each new cell. NaN cells are ignored by 
+    renormalising the weights of the remaining cells, and new cells are only 
+    NaN if all four surrounding cells are NaN.
+    
+    Inputs
+    x, y:                       Ascending cell-centre axes of the input grid
+    z:                          Input grid (len(y) x len(x))
+    xd, yd:                     Cell-centre axes of the output grid
+    
+    Output
+    zd:                         Output grid (len(yd) x len(xd))
+    '''
+    #Get fractional index of each new cell along each axis
+    def fracIndex(a, ad):
+        if a.size<2:
+            return np.zeros(ad.size,dtype=int),np.zeros(ad.size)
+        f=(ad-a[0])/(a[1]-a[0])
+        i=np.clip(np.floor(f).astype(int),0,a.size-2)
+        return i,np.clip(f-i,0.,1.)
+    ix,tx=fracIndex(x,xd)
+    iy,ty=fracIndex(y,yd)
+    ix1=np.minimum(ix+1,x.size-1)
+    iy1=np.minimum(iy+1,y.size-1)
+    
+    #Get valid cell mask and zero-filled grid
+    z=np.asarray(z)
+    valid=~np.isnan(z)
+    zf=np.where(valid,z,0.)
+    
+    #Sum weighted values and weights of the four surrounding cells
+    tx=tx[np.newaxis,:]
+    ty=ty[:,np.newaxis]
+    num=np.zeros((yd.size,xd.size))
+    den=np.zeros((yd.size,xd.size))
+    for rows,wy in [[iy,1.-ty],[iy1,ty]]:
+        for cols,wx in [[ix,1.-tx],[ix1,tx]]:
+            w=wy*wx*valid[np.ix_(rows,cols)]
+            num+=w*zf[np.ix_(rows,cols)]
+            den+=w
+    
+    #Normalise by weights, leaving NaN where no cells are valid
+    zd=np.full((yd.size,xd.size),np.nan)
+    np.divide(num,den,out=zd,where=den>0)
+    return zd
+    
+    
+def load_DEM(demfile, bbox=None):
     '''Function for loading DEM data from different file types, which is 
-    automatically detected. Recognised file types: .mat and .tif.
+    automatically detected. Recognised file types: .mat and .tif. If a 
+    bounding box ([xmin,xmax,ymin,ymax]) is given then only the part of the 
+    DEM covering it is returned, with .tif files read as a window so that 
+    the rest of the raster is never loaded.
     '''   
     #Determine file type based on filename suffix
     suffix=demfile.split('.')[-1].upper()
     
     #MAT file import if detected
     if suffix==("MAT"):
-        return DEM_FromMat(demfile)
+        return DEM_FromMat(demfile, bbox)
         
     #TIF file import if detected
     elif suffix==("TIF") or suffix==("TIFF"):
-        return DEM_FromTiff(demfile)
+        return DEM_FromTiff(demfile, bbox)
     
     #No DEM data passed if file type is not recognised
     else:
@@ -221,10 +498,139 @@ def load_DEM(demfile):
         return None
 
     
-def DEM_FromMat(matfile):
+#Loaded DEMs shared by all camera environments, keyed by file, modification 
+#time, densification factor and bounding box
+demCache={}
+
+#Directory for memory-mapped DEM caches (None if not used)
+demCacheDir=[None]
+
+
+def setDEMCacheDir(cachedir):
+    '''Set a directory where loaded DEMs are written as .npy files. These are
+    read back as memory-mapped arrays, so processes (e.g. pool workers) using 
+    the same DEM share one copy through the operating system page cache 
+    rather than each loading and densifying it. Set to None to disable.
+    '''
+    if cachedir is not None and not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    demCacheDir[0]=cachedir
+    
+    
+def invalidateDEMCache(demfile=None):
+    '''Remove DEMs from the process-wide DEM cache, either for a given DEM 
+    file or (if no file is given) for all DEMs. Memory-mapped .npy caches on
+    disk are not removed, but are no longer used once the DEM file changes.
+    '''
+    if demfile is None:
+        demCache.clear()
+    else:
+        path=os.path.abspath(demfile)
+        for key in demCache.keys():
+            if key[0]==path:
+                del demCache[key]
+                
+                
+def loadCachedDEM(demfile, densefactor=1, bbox=None):
+    '''Function for loading (and densifying) a DEM once per process. DEMs 
+    are held in a process-wide cache keyed by the file path, file 
+    modification time, densification factor and bounding box, so subsequent
+    calls with the same DEM return the same object. If a DEM cache directory
+    has been set (setDEMCacheDir) then the DEM arrays are also shared 
+    between processes as memory-mapped .npy files. Cache files are written 
+    to a temporary file and renamed into place (the geotransform before the 
+    DEM array), so other processes only ever see complete files, and the DEM
+    is rebuilt if a cache file cannot be read. Cached DEMs should not be 
+    modified in place.
+    '''
+    #Define cache key
+    path=os.path.abspath(demfile)
+    if bbox is not None:
+        bbox=tuple([float(b) for b in bbox])
+    key=(path, os.path.getmtime(path), densefactor, bbox)
+    
+    #Return cached DEM if present
+    if key in demCache:
+        return demCache[key]
+        
+    #Define memory-mapped cache files
+    cachedir=demCacheDir[0]
+    if cachedir is not None:
+        name=os.path.join(cachedir, hashlib.md5(repr(key)).hexdigest())
+        zfile=name + '_z.npy'
+        tfile=name + '_gt.npy'
+        xyzfile=name + '_xyz.npy'
+    
+    #Read DEM from memory-mapped cache files
+    dem=None
+    if cachedir is not None:
+        try:
+            if os.path.exists(zfile):
+                dem=ImplicitRaster(np.load(zfile, mmap_mode='r'), 
+                                   np.load(tfile))
+            elif os.path.exists(xyzfile):
+                xyz=np.load(xyzfile, mmap_mode='r')
+                dem=ExplicitRaster(xyz[0], xyz[1], xyz[2])
+        except (IOError, OSError, ValueError):
+            print '\nUnable to read DEM cache files. Rebuilding DEM'
+            dem=None
+        
+    if dem is None:
+        #Prepare DEM from file
+        dem=load_DEM(demfile, bbox)
+        if dem is None:
+            return None
+            
+        #DEM densification
+        if densefactor>1:
+            dem=dem.densify(densefactor)
+            
+        #Write memory-mapped cache files
+        if cachedir is not None:
+            if isinstance(dem, ImplicitRaster):
+                saveCachedArray(tfile, np.array(dem.getTransform()))
+                saveCachedArray(zfile, dem.getZ())
+                dem=ImplicitRaster(np.load(zfile, mmap_mode='r'), 
+                                   dem.getTransform())
+            else:
+                saveCachedArray(xyzfile, dem.getData())
+                xyz=np.load(xyzfile, mmap_mode='r')
+                dem=ExplicitRaster(xyz[0], xyz[1], xyz[2])
+    
+    demCache[key]=dem
+    return dem
+    
+    
+def saveCachedArray(fname, array):
+    '''Function for writing an array to a .npy cache file. The array is 
+    written to a temporary file in the same directory and then renamed, so 
+    that the cache file only appears once it is complete.
+    '''
+    #Write array to temporary file
+    fd, tmpfile=tempfile.mkstemp(suffix='.tmp', 
+                                 dir=os.path.dirname(fname))
+    f=os.fdopen(fd, 'wb')
+    try:
+        np.save(f, array)
+    finally:
+        f.close()
+        
+    #Move temporary file into place
+    try:
+        os.rename(tmpfile, fname)
+    except OSError:
+        #Cache file already written by another process (Windows)
+        os.remove(tmpfile)
+        if not os.path.exists(fname):
+            raise
+            
+            
+def DEM_FromMat(matfile, bbox=None):
     '''Function for loading a DEM array from a Matlab (.mat) file containing
-    separate X, Y, Z matrices.
+    separate X, Y, Z matrices. The DEM is clipped to the bounding box 
+    ([xmin,xmax,ymin,ymax]) if one is given.
     '''
+    import scipy.io as sio
     
     #Load Matlab file and XYZ matrices as arrays
     mat = sio.loadmat(matfile)
@@ -241,13 +647,26 @@ def DEM_FromMat(matfile):
     
     #Construct DEM array
     dem=ExplicitRaster(X,Y,Z)
+    
+    #Clip DEM to bounding box
+    if bbox is not None:
+        dem=dem.clip(bbox)
+        
     return dem 
 
 
-def DEM_FromTiff(tiffFile):
+def DEM_FromTiff(tiffFile, bbox=None):
     '''Function for loading a DEM array from a .tiff file containing
-    raster-formatted data. The tiff data importing is handled by GDAL.
+    raster-formatted data. The tiff data importing is handled by GDAL. If a 
+    bounding box ([xmin,xmax,ymin,ymax]) is given then only the window of 
+    the raster covering it is read (with a one cell margin). The 
+    band is read directly into an array of its native data type, and cells 
+    matching the band's nodata value are set to NaN (promoting integer bands 
+    to float32 where needed). The DEM is returned as an ImplicitRaster, with
+    XY cell referencing described by the geotransform.
     '''
+    import gdal
+    from gdalconst import GA_ReadOnly
     
     #Open tiff file with GDAL
     dataset = gdal.Open(tiffFile, GA_ReadOnly)
@@ -263,36 +682,151 @@ def DEM_FromTiff(tiffFile):
     pixelWidth = geotransform[1]
     pixelHeight = geotransform[5]
     
-    #Get Z data from raster
+    #Define raster window from bounding box
+    xoff = 0
+    yoff = 0
+    if bbox is not None:
+        c = (np.array(bbox[0:2]) - originX) / pixelWidth
+        r = (np.array(bbox[2:4]) - originY) / pixelHeight
+        xoff = int(max(0, np.floor(c.min()) - 1))
+        yoff = int(max(0, np.floor(r.min()) - 1))
+        cols = int(min(cols, np.ceil(c.max()) + 1)) - xoff
+        rows = int(min(rows, np.ceil(r.max()) + 1)) - yoff
+        if cols <= 0 or rows <= 0:
+            print '\nBounding box does not overlap DEM: ' + tiffFile
+            return None
+        
+        #Shift origins to the window
+        originX = originX + xoff * pixelWidth
+        originY = originY + yoff * pixelHeight
+    
+    #Get Z data from raster window in its native data type
     band = dataset.GetRasterBand(1)
-    scanline = band.ReadRaster( 0, 0, band.XSize, band.YSize,band.XSize, 
-                               band.YSize, band.DataType)
-    value = struct.unpack('f' * band.XSize *band.YSize, scanline)
-    Z=np.array(value).reshape(rows,cols)
-
-    #Create empty arrays for XY data    
-    X=np.zeros((rows,cols))
-    Y=np.zeros((rows,cols))
-    
-    #Populate empty arrays from origins
-    originX=originX+(pixelWidth*0.5)
-    originY=originY+(pixelWidth*0.5)
-    for i in range(rows):
-        for j in range(cols):
-            X[i,j]=(j*pixelWidth)+originX
-            Y[i,j]=(i*pixelHeight)+originY
+    Z = band.ReadAsArray(xoff, yoff, cols, rows)
     
-    #Flip array if not compatible
-    if Y[0,0]>Y[-1,0]:   
-        X=np.flipud(X) 
-        Y=np.flipud(Y)
-        Z=np.flipud(Z)
-     
-    #Construct DEM array
-    dem=ExplicitRaster(X,Y,Z)    
+    #Set nodata values to NaN
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        if not np.issubdtype(Z.dtype, np.floating):
+            Z = Z.astype(np.float32)
+        Z[Z==nodata] = np.nan
+    
+    #Flip array if not compatible (rows ordered by increasing Y)
+    if pixelHeight < 0:
+        originY = originY + rows * pixelHeight
+        pixelHeight = -pixelHeight
+        Z = np.flipud(Z)
+    
+    #Close dataset
+    band = None
+    dataset = None
+    
+    #Construct DEM raster from geotransform
+    transform = [originX, pixelWidth, 0.0, originY, 0.0, pixelHeight]
+    dem=ImplicitRaster(Z,transform)    
     return dem
 
             
+def viewBBox(camloc, yaw, maxrange, fov=None):
+    '''Calculate the bounding box of the area of a DEM that can be seen from
+    a camera, given as a wedge from the camera location out to a maximum 
+    range. The bounding box can be passed to load_DEM so that only this part 
+    of the DEM is read.
+    
+    Inputs
+    camloc:                     Camera location [x,y,z]
+    yaw:                        Camera view direction (in radians, measured 
+                                anticlockwise from the x axis, as in the 
+                                camera yaw-pitch-roll)
+    maxrange:                   Maximum distance from the camera to include
+    fov:                        Horizontal field of view (in radians). The 
+                                full circle around the camera is used if this 
+                                is not given
+    
+    Output
+    bbox:                       Bounding box [xmin,xmax,ymin,ymax]
+    '''
+    #Use full circle if field of view is not given
+    if fov is None or fov >= 2*math.pi:
+        return [camloc[0]-maxrange, camloc[0]+maxrange, 
+                camloc[1]-maxrange, camloc[1]+maxrange]
+    
+    #Sample arc at the edge of the view wedge
+    theta = np.linspace(yaw-fov/2., yaw+fov/2., 
+                        max(2, int(np.ceil(fov/(math.pi/36.)))+1))
+    x = np.append(camloc[0]+maxrange*np.cos(theta), camloc[0])
+    y = np.append(camloc[1]+maxrange*np.sin(theta), camloc[1])
+    
+    #Add arc extremes at the cardinal directions within the wedge
+    for a in np.arange(4)*(math.pi/2.):
+        if abs((a-yaw+math.pi)%(2*math.pi)-math.pi) <= fov/2.:
+            x = np.append(x, camloc[0]+maxrange*np.cos(a))
+            y = np.append(y, camloc[1]+maxrange*np.sin(a))
+            
+    return [x.min(), x.max(), y.min(), y.max()]
+            
+            
+def pyramidSample(dem, viewpoint, focal, pxsize=2., levels=6):
+    '''Sample the visible cells of a DEM at a resolution that adapts to the 
+    distance from the camera, using the DEM pyramid. Fine cells are used 
+    near the camera and progressively coarser cells further away, so that 
+    each sampled cell covers roughly the same number of image pixels. Each 
+    pyramid level is used over a distance annulus, with the viewshed for 
+    that level calculated only over the window enclosing the annulus (so 
+    every level costs roughly the same).
+    
+    Inputs
+    dem:                        Input DEM (regular grid)
+    viewpoint:                  3-element vector specifying the viewpoint
+    focal:                      Camera focal length (in pixels)
+    pxsize:                     Target size of sampled cells in the image (in
+                                pixels)
+    levels:                     Maximum number of pyramid levels to use
+    
+    Output
+    xyz:                        Visible cell coordinates (N x 3)
+    '''
+    #Get pyramid and base cell size
+    pyramid=dem.getPyramid(levels)
+    X=dem.getData(0)
+    cell=abs(X[0,1]-X[0,0])
+    
+    #Get furthest distance from the viewpoint to the DEM extent
+    ext=dem.getExtent()
+    maxdist=max([math.hypot(x-viewpoint[0],y-viewpoint[1]) 
+                 for x in ext[0:2] for y in ext[2:4]])
+    
+    xyz=[]
+    for k in range(len(pyramid)):
+        
+        #Define distance annulus for pyramid level
+        rmin=0. if k==0 else focal*cell*2**k/pxsize
+        rmax=float('inf') if k==len(pyramid)-1 else focal*cell*2**(k+1)/pxsize
+        
+        #Window pyramid level to annulus
+        level=pyramid[k]
+        if rmax<maxdist:
+            level=level.clip([viewpoint[0]-rmax, viewpoint[0]+rmax, 
+                              viewpoint[1]-rmax, viewpoint[1]+rmax])
+        if level.getRows()<2 or level.getCols()<2:
+            continue
+        
+        #Get visible cells within annulus
+        vis=voxelviewshed(level, viewpoint)
+        X=level.getData(0)
+        Y=level.getData(1)
+        Z=level.getData(2)
+        dist=np.hypot(X-viewpoint[0],Y-viewpoint[1])
+        keep=vis&(dist>=rmin)&(dist<rmax)
+        xyz.append(np.column_stack([X[keep],Y[keep],Z[keep]]))
+        
+        #Stop if the annulus reaches the edge of the DEM
+        if rmax>=maxdist:
+            break
+        
+    return np.vstack(xyz+[np.empty((0,3))])
+    
+    
 def voxelviewshed(dem, viewpoint):
     '''Calculate a viewshed over a DEM from a given viewpoint in the DEM scene.
     This function is based on the viewshed function (voxelviewshed.m) available 
@@ -309,6 +843,7 @@ def voxelviewshed(dem, viewpoint):
     vis:                        Boolean visibility matrix (which is the same 
                                 size as dem)
     '''
+    from scipy import interpolate
     #Get XYZ arrays    
     X=dem.getData(0)
     Y=dem.getData(1)
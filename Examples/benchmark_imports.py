@@ -0,0 +1,67 @@
+'''
+PYTRX EXAMPLE IMPORT BENCHMARK
+
+This script is part of PyTrx, an object-oriented programme created for the
+purpose of calculating real-world measurements from oblique images and
+time-lapse image series.
+
+This script measures the time taken to import each of the PyTrx modules in a
+fresh Python process (as paid by every worker process in a pool), and reports
+which heavy optional packages (matplotlib, GDAL/OGR and SciPy submodules) are
+loaded on import. These packages should only be loaded when the functions
+that need them are first called.
+
+
+@author: Penny How (p.how@ed.ac.uk)
+         Nick Hulton
+         Lynne Buie
+'''
+
+#Import packages
+import sys
+import os
+import subprocess
+
+#Define PyTrx modules to benchmark
+modules = ['Images', 'FileHandler', 'DEM', 'CamEnv', 'Velocity', 'Area',
+           'Line']
+
+#Define heavy packages to check for after import
+heavy = ['matplotlib', 'pylab', 'gdal', 'ogr', 'osgeo', 'scipy.io',
+         'scipy.interpolate', 'scipy.optimize']
+
+#Define number of repeats per module
+repeats = 5
+
+#Script run in a fresh process to time the import of a module
+script = '''
+import sys, time
+sys.path.append(%r)
+t = time.time()
+import %s
+t = time.time() - t
+loaded = [m for m in %r if m in sys.modules]
+print repr((t, loaded))
+'''
+
+#Get PyTrx directory
+pytrx = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+#--------------------------   Benchmark imports   -----------------------------
+
+print '\nImport times (best of ' + str(repeats) + ' fresh processes)'
+for m in modules:
+    times = []
+    for r in range(repeats):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       script % (pytrx, m, heavy)])
+        t, loaded = eval(out.strip().splitlines()[-1])
+        times.append(t)
+    print '%-12s %8.1f ms   heavy modules loaded: %s' % (m, min(times)*1000.,
+                                                         ', '.join(loaded) or
+                                                         'none')
+
+
+#------------------------------------------------------------------------------
+print '\nFinished'
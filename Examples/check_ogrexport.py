@@ -0,0 +1,118 @@
+'''
+PYTRX EXAMPLE OGR EXPORT CHECK
+
+This script is part of PyTrx, an object-oriented programme created for the
+purpose of calculating real-world measurements from oblique images and
+time-lapse image series.
+
+This script checks that area and line features can be written to shapefiles
+and GeoPackage files and read back with OGR. A known polygon and line are
+written, and the areas and lengths of the features read back from file are
+compared to the expected values.
+
+
+@author: Penny How (p.how@ed.ac.uk)
+         Nick Hulton
+         Lynne Buie
+'''
+
+#Import packages
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+from osgeo import ogr
+
+#Import PyTrx modules
+sys.path.append('../')
+from FileHandler import (writeAreaSHP, writeAreaGPKG, writeLineSHP,
+                         writeLineGPKG)
+
+#Define known polygon (100 x 50 m rectangle at 10 m elevation) and line
+#(30 m long)
+polygon = np.array([[0.,0.,10.], [100.,0.,10.], [100.,50.,10.],
+                    [0.,50.,10.]])
+line = np.array([[0.,0.,10.], [10.,0.,10.], [10.,20.,10.]])
+area = 5000.
+length = 30.
+
+#Define image name and projection
+imn = ['check']
+proj = 32633
+
+#Get temporary output directory
+dest = tempfile.mkdtemp() + '/'
+
+
+def readFeatures(fname):
+    '''Read all features from each layer of an OGR file.
+
+    Args
+    fname (str):            OGR file path
+
+    Returns
+    features (list):        Geometry and attribute field values of each
+                            feature
+    '''
+    ds = ogr.Open(fname)
+    features = []
+    for i in range(ds.GetLayerCount()):
+        layer = ds.GetLayer(i)
+        for f in layer:
+            geom = f.GetGeometryRef()
+            features.append([geom.Clone(), f.items()])
+    ds = None
+    return features
+
+
+def check(name, value, expected):
+    '''Compare a value read back from file with the expected value.'''
+    if abs(value-expected) < 1e-6:
+        print '%-40s OK (%.1f)' % (name, value)
+        return True
+    else:
+        print '%-40s FAILED (%.1f, expected %.1f)' % (name, value, expected)
+        return False
+
+
+#-------------------------   Write and read files   ---------------------------
+
+passed = True
+try:
+    #Write and read back areas
+    writeAreaSHP([[polygon]], imn, dest + 'shp/', proj)
+    writeAreaGPKG([[polygon]], imn, dest + 'areas.gpkg', proj)
+    for fname in [dest + 'shp/check_area.shp', dest + 'areas.gpkg']:
+        features = readFeatures(fname)
+        passed = check(os.path.basename(fname) + ' features', len(features),
+                       1) and passed
+        for geom, fields in features:
+            passed = check(os.path.basename(fname) + ' geometry area',
+                           geom.GetArea(), area) and passed
+            passed = check(os.path.basename(fname) + ' area field',
+                           fields['area'], area) and passed
+
+    #Write and read back lines
+    writeLineSHP([line], imn, dest + 'shp/', proj)
+    writeLineGPKG([line], imn, dest + 'lines.gpkg', proj)
+    for fname in [dest + 'shp/check_line.shp', dest + 'lines.gpkg']:
+        features = readFeatures(fname)
+        passed = check(os.path.basename(fname) + ' features', len(features),
+                       1) and passed
+        for geom, fields in features:
+            passed = check(os.path.basename(fname) + ' geometry length',
+                           geom.Length(), length) and passed
+            passed = check(os.path.basename(fname) + ' length field',
+                           fields['length'], length) and passed
+
+finally:
+    shutil.rmtree(dest)
+
+
+#------------------------------------------------------------------------------
+if passed is True:
+    print '\nFinished: all checks passed'
+else:
+    print '\nFinished: some checks FAILED'
+    sys.exit(1)
@@ -119,10 +119,8 @@ areas = lakes.calcAutoAreas(colour, verify)
 matrix, tancorr, radcorr = cameraenvironment.getCalibdata()         #CV2 calib
 imn = lakes.getImageNames()                                         #Img names
 proj = 32633                                                        #Projection (WGS84)
-xyzpts = [item[0][1] for item in areas]                             #XYZ coords
 dem = cameraenvironment.getDEM()                                    #DEM
 imgset=lakes._imageSet                                              #Images
-uvpts = [item[1][1] for item in areas]                              #UV coords
 cameraMatrix=cameraenvironment.getCamMatrixCV2()                    #Matrix
 distortP=cameraenvironment.getDistortCoeffsCV2()                    #Distort
 
@@ -136,16 +134,18 @@ writeAreaFile(areas, imn, destination)
 
 #Create shapefiles
 target1 = destination + 'shpfiles/'                 
-writeAreaSHP(xyzpts, imn, target1, proj)            
+writeAreaSHP(areas, imn, target1, proj)            
 
 #Write all image extents and dems 
 target2 = destination + 'outputimgs/'
 
 #Plot areas in image plane and as XYZ polygons  
 for i in range(len(areas)):
-    plotAreaPX(uvpts[i], imgset[i].getImageCorr(cameraMatrix, distortP), 
+    plotAreaPX(areas.getPXPath(i), 
+               imgset[i].getImageCorr(cameraMatrix, distortP), 
                show=True, save=target2+'uv_'+str(imn[i]))  
-    plotAreaXYZ(xyzpts[i], dem, show=True, save=target2+'xyz_'+str(imn[i]))
+    plotAreaXYZ(areas.getXYZPath(i), dem, show=True, 
+                save=target2+'xyz_'+str(imn[i]))
 
 
 #------------------------------------------------------------------------------                                                                                                                                                                                                                                                                                                      
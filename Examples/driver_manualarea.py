@@ -85,22 +85,21 @@ writeAreaFile(areas, imn, destination)
 #Create shapefiles
 target1 = destination + 'shpfiles/'    
 proj = 32633
-xyzpts = [item[0][1] for item in areas]
-writeAreaSHP(xyzpts, imn, target1, proj) 
+writeAreaSHP(areas, imn, target1, proj) 
    
 #Write all image extents and dems 
 target2 = destination + 'outputimgs/'
-uvpts = [item[1][1] for item in areas]
 dem = cameraenvironment.getDEM()
 imgset=plumes._imageSet
 cameraMatrix=cameraenvironment.getCamMatrixCV2()
 distortP=cameraenvironment.getDistortCoeffsCV2()
 
 #Plot areas in image plane and as XYZ polygons (only if xyz areas calculated)   
-for i in range(len(xyzpts)):
-    plotAreaPX(uvpts[i], imgset[i].getImageCorr(cameraMatrix, distortP), 
+for i in range(len(areas)):
+    plotAreaPX(areas.getPXPath(i), 
+               imgset[i].getImageCorr(cameraMatrix, distortP), 
                show=True, save=None)  
-    plotAreaXYZ(xyzpts[i], dem, show=True, save=None)
+    plotAreaXYZ(areas.getXYZPath(i), dem, show=True, save=None)
     
     
 #---Alternative method for plotting image extents using original RGB images----                                                                                                                                                                                                                                                                                                      
@@ -114,10 +113,10 @@ newMat, roi = cv2.getOptimalNewCameraMatrix(cameraMatrix, distortP,
     
 #Get corresponding xy pixel areas and images                                            
 count=1
-for p,i in zip(uvpts,ims):
+for n,i in enumerate(ims[:len(areas)]):
     x=[]
     y=[]
-    for ps in p[0]:    
+    for ps in areas.getPXPts(n)[0]:    
         x.append(ps[0])
         y.append(ps[1])
   
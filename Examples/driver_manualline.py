@@ -69,8 +69,7 @@ writeLineFile(lines, imn, destination)
 #Write shapefiles from line data
 target1 = destination + 'shapefiles/'   
 proj = 32633
-xyzcoords = [item[0][1] for item in lines]
-writeLineSHP(xyzcoords, imn, target1, proj)
+writeLineSHP(lines, imn, target1, proj)
 #
 #
 ##----------------------------   Show results   --------------------------------  
@@ -83,13 +82,14 @@ dem = cam.getDEM()
 imgset=terminus._imageSet
 cameraMatrix=cam.getCamMatrixCV2()
 distortP=cam.getDistortCoeffsCV2()
-pxcoords = [item[1][1] for item in lines]
 #
 #Plot lines in image plane and as XYZ lines 
-for i in range(len(pxcoords)):
-    plotLinePX(pxcoords[i], imgset[i].getImageCorr(cameraMatrix, distortP), 
+for i in range(len(lines)):
+    plotLinePX(lines.getPXPts(i), 
+               imgset[i].getImageCorr(cameraMatrix, distortP), 
                show=True, save=target2+'uv_'+str(imn[i]))  
-    plotLineXYZ(xyzcoords[i], dem, show=True, save=target2+'xyz_'+str(imn[i]))
+    plotLineXYZ(lines.getXYZPts(i), dem, show=True, 
+                save=target2+'xyz_'+str(imn[i]))
 
     
 #------------------------------------------------------------------------------
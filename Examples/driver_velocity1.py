@@ -28,6 +28,7 @@ sys.path.append('../')
 from CamEnv import CamEnv
 from Velocity import Velocity
 from FileHandler import writeHomogFile, writeVeloFile, writeVeloSHP, writeCalibFile
+from FileHandler import writeVeloNPZ
 from Utilities import plotVeloPX, plotVeloXYZ, interpolateHelper, plotInterpolate
 
 #-------------------------   Map data sources   -------------------------------
@@ -82,6 +83,7 @@ uvvel=[item[1][0] for item in velocities]
 uv0=[item[1][1] for item in velocities] 
 uv1=[item[1][2] for item in velocities]
 uv1corr=[item[1][3] for item in velocities]
+snr=[item[1][4] for item in velocities]
 
 #---------------------------  Export data   -----------------------------------
 
@@ -108,6 +110,11 @@ if not os.path.exists(target4):
 proj = 32633                            #ESPG:32633 is projection WGS84
 writeVeloSHP(xyzvel, xyz0, imn, target4, proj)       #Write shapefile
 
+#Write all points from the sequence to a single columnar .npz file
+target5 = destination + 'velo_points.npz'
+times = [im.getImageTime() for im in velo.getImages()]
+writeVeloNPZ(xyzvel, xyz0, xyz1, imn, target5, times, snr)
+
 
 #----------------------------   Plot Results   --------------------------------
 
@@ -16,6 +16,14 @@ readMask:               Function to create a mask for point seeding using PIL
                         .jpg mask. The writeMask file path is used to either 
                         open the existing mask at that path or to write the 
                         generated mask to this path.
+writeMaskNPZ:           Function to write a mask losslessly to a packed-bit 
+                        binary .npz file, with the mask polygon.
+readMaskNPZ:            Function to read a mask from a packed-bit binary .npz 
+                        file.
+readBatchFile:          Function to read image coordinates (e.g. masks, 
+                        manual areas and lines, colour range points) keyed by 
+                        image name from a GeoJSON or .npz file, for 
+                        non-interactive processing.
 readCalib:              Function to find camera calibrations from a file given 
                         a list or Matlab file containing the required 
                         parameters. Returns the parameters as a dictionary 
@@ -40,6 +48,14 @@ readGCPs:               Function to read ground control points from a .txt
                         header line. Data is appended by skipping the header 
                         line and finding the world and image coordinates from 
                         each line.
+writeCalibNPZ:          Function to write camera calibration data to a binary
+                        .npz file.
+readCalibNPZ:           Function to read camera calibration data from a binary
+                        .npz file.
+writeSelectionNPZ:      Function to write selected (i.e. verified) polygon 
+                        indices for each image to a binary .npz file.
+readSelectionNPZ:       Function to read selected polygon indices for each 
+                        image from a binary .npz file.
 writeVeloFile:          Function to write all velocity data.
 writeHomogFile:         Function to write all homography data.
 writeAreaFile:          Function to write all area data (if it has been 
@@ -48,22 +64,55 @@ writeAreaFile:          Function to write all area data (if it has been
                         cumulative areas of all polygons, and polygon xyz 
                         coordinates. All these output files are compatible with 
                         the importing tools, namely importAreaData.
+writeAreaCoords:        Function to write polygon coordinates from a single 
+                        array to a .txt file.
+formatCoords:           Function to format point coordinates as tab delimited
+                        strings.
 WriteLineFile:          Function to write all line data (if it has been 
                         calculated) to separate .txt files containing the pixel
                         coordinates of the lines, the pixel line length, the
                         xyz coordinates of the lines, and the real (xyz) line 
                         lengths. All these output files are compatible with the 
                         importing tools, namely importLineData.
+writeLineCoords:        Function to write line coordinates from a single 
+                        array to a .txt file.
+getOGRDriver:           Function to get an OGR driver by name.
+getOGRProjection:       Function to get an OGR spatial reference for a given 
+                        projection, which is constructed only once and reused.
+pointsToWKB:            Function to build WKB point geometries from an array.
+lineToWKB:              Function to build a WKB line geometry from an array.
+polygonToWKB:           Function to build a WKB polygon geometry from an array.
+writeOGRLayer:          Function to write WKB geometries to a new OGR layer 
+                        within a single transaction.
+writeOGRFiles:          Function to write layers to separate shapefiles.
+writeOGRPackage:        Function to write layers to one multi-layer GeoPackage.
+getVeloLayers:          Function to get velocity point layers for writing.
 writeVeloSHP:           Function to write OGR points representing velocities 
                         (from ALL images) to file in a .shp file type that is 
                         compatible with mapping sofrware such as ArcMap and 
                         QGIS.
+writeVeloNPZ:           Function to write velocity points (from ALL image
+                        pairs) to a single columnar .npz file.
+writeVeloGPKG:          Function to write OGR points representing velocities
+                        (from ALL images) to a single GeoPackage file.
+getAreaLayers:          Function to get polygon layers for writing.
 writeAreaSHP:           Function to write OGR polygons (from ALL images) to 
                         file in a .shp file type that is compatible with 
                         mapping sofrware such as ArcMap and QGIS.
+writeAreaGPKG:          Function to write OGR polygons (from ALL images) to a
+                        single GeoPackage file.
+writeAreaNPZ:           Function to write area data (from ALL images) to a 
+                        single .npz file, with all polygon vertices held in 
+                        one array.
+getLineLayers:          Function to get line layers for writing.
 writeLineSHP:           Function to write OGR line features (from ALL images) 
                         to file in a .shp file type that is compatible with 
                         mapping sofrware such as ArcMap and QGIS.
+writeLineGPKG:          Function to write OGR line features (from ALL images)
+                        to a single GeoPackage file.
+writeLineNPZ:           Function to write line data (from ALL images) to a 
+                        single .npz file, with all line vertices held in one 
+                        array.
 importAreaData:         Function to get xyz and px area data from text files 
                         and import it into a specified Measure.Area class 
                         object. This uses the importAreaXYZ and 
@@ -79,7 +128,11 @@ importLineData:         Function to get xyz and px line data from text files
                         script. All imported data is held in the Line class 
                         object specified as an input variable. This can be 
                         easily retrieved from the Line class object itself.
-                        
+importVeloNPZ:          Function to import velocity points from a columnar
+                        .npz file, optionally filtered by image pair.
+importAreaNPZ:          Function to import area data from a .npz file.
+importLineNPZ:          Function to import line data from a .npz file.
+
 @author: Penny How (p.how@ed.ac.uk)
          Nick Hulton 
          Lynne Buie
@@ -89,34 +142,63 @@ importLineData:         Function to get xyz and px line data from text files
 from PIL import Image, ImageDraw
 import numpy as np
 import operator
-import matplotlib.pyplot as plt
-import scipy.io as sio
-from osgeo import ogr,osr
 import os
+import struct
+import json
 
 #------------------------------------------------------------------------------   
 
-def readMask(img, writeMask=None):
+def readMask(img, writeMask=None, imn=None):
     '''Function to create a mask for point seeding using PIL to rasterize 
     polygon. The mask is manually defined by the user using the pyplot ginput 
     function. This subsequently returns the manually defined area as a .jpg 
     mask. 
     
     The writeMask file path is used to either open the existing mask at that 
-    path or to write the generated mask to this path.
+    path or to write the generated mask to this path. Masks written to .png 
+    files are saved as lossless 1-bit images, and masks written to .npz files 
+    are saved as packed bits along with the mask polygon (see writeMaskNPZ).
+    Other file types (e.g. .jpg) are saved as images. If the writeMask file 
+    is a GeoJSON file, or an .npz file of polygons (see readBatchFile), the 
+    mask polygon is read from it and rasterized without user input.
     
     Variables
     img (arr):          Image to define mask in
     writeMask (str):    File destination that mask output is written to
+    imn (str):          Image name that the mask polygon is keyed by in a 
+                        GeoJSON/.npz file (only needed if the file contains
+                        more than one polygon)
     
     Returns
     myMask (arr):       Array defining the image mask
     '''
+    #Load packed mask if it exists
+    if writeMask!=None and isMaskNPZ(writeMask):
+        myMask, x1 = readMaskNPZ(writeMask)
+        print '\nMask loaded from ' + writeMask
+        return myMask
+    
+    #Rasterize mask polygon from file if given
+    if writeMask!=None and isBatchFile(writeMask) and os.path.exists(writeMask):
+        polys=readBatchFile(writeMask)
+        if imn in polys:
+            x1=polys[imn]
+        elif len(polys)==1:
+            x1=polys.values()[0]
+        else:
+            raise ValueError('No mask polygon found for ' + str(imn) + 
+                             ' in ' + writeMask)
+        print '\nMask polygon loaded from ' + writeMask
+        return polygonMask(x1, img.shape[1], img.shape[0])
+        
     #Check if a mask already exists, if not enter digitising
     if writeMask!=None:
         try:
             myMask = Image.open(writeMask)
-            myMask = np.array(myMask)
+            if myMask.mode == '1':
+                myMask = np.array(myMask, dtype=np.uint8)
+            else:
+                myMask = np.array(myMask)
             print ('\nMask loaded. It is recommended that you check this ' 
                    'against the start and end of the sequence using the ' 
                    'self.checkMask() function of the TimeLapse object')
@@ -125,6 +207,7 @@ def readMask(img, writeMask=None):
             print '\nMask file not found. Proceeding to manually digitise...'
 
     #Plot mask manually on the selected image
+    import matplotlib.pyplot as plt
     fig=plt.gcf()
     fig.canvas.set_window_title('Click to create mask. Press enter to record' 
                                 ' points.')
@@ -137,35 +220,154 @@ def readMask(img, writeMask=None):
     
     #Close shape
     x1.append(x1[0])
-    
-    #Generate polygon
-    ring = ogr.Geometry(ogr.wkbLinearRing)
-    for p in x1:
-        ring.AddPoint(p[0],p[1])
-    p=x1[0]
-    ring.AddPoint(p[0],p[1])    
-    poly = ogr.Geometry(ogr.wkbPolygon)
-    poly.AddGeometry(ring)
      
     #Rasterize polygon using PIL
-    height = img.shape[0]
-    width = img.shape[1]
-    img1 = Image.new('L', (width,height), 0)
-    draw=ImageDraw.Draw(img1)
-    draw.polygon(x1, outline=1, fill=1)
-    myMask=np.array(img1)
+    myMask=polygonMask(x1, img.shape[1], img.shape[0])
     
-    #Write to .jpg file    
+    #Write to file (packed .npz, 1-bit .png or .jpg)    
     if writeMask!=None:
         print '\nMask plotted: ' + writeMask
+        ext=os.path.splitext(writeMask)[1].lower()
         try:
-            img1.save(writeMask, 'jpg', quality=75)
+            if ext=='.npz':
+                writeMaskNPZ(myMask, writeMask, x1)
+            elif ext=='.png':
+                img1=Image.fromarray(myMask*255).convert('1')
+                img1.save(writeMask)
+            else:
+                img1=Image.fromarray(myMask)
+                img1.save(writeMask, 'jpg', quality=75)
         except:
             print '\nFailed to write file: ' + writeMask
         
     return myMask  
 
 
+def writeMaskNPZ(mask, fname, polygon=None):
+    '''Function to write a mask losslessly to a compact binary .npz file, 
+    with the mask packed to one bit per pixel. The polygon that the mask was
+    rasterized from can also be stored. The file can be read back with the 
+    readMaskNPZ function.
+    
+    Variables
+    mask (arr):         Mask array
+    fname (str):        Filename for output file (.npz)
+    polygon (arr):      UV coordinates of the mask polygon (optional)
+    '''
+    mask=np.asarray(mask)
+    if polygon is None:
+        polygon=np.zeros([0,2])
+    np.savez(fname, maskbits=np.packbits(mask.astype(bool)), 
+             shape=np.array(mask.shape), 
+             polygon=np.asarray(polygon, dtype=np.float64).reshape(-1,2))
+    
+    
+def readMaskNPZ(fname):
+    '''Function to read a mask from a binary .npz file written with the 
+    writeMaskNPZ function.
+    
+    Variables
+    fname (str):        File path for mask file (.npz)
+    
+    Returns
+    mask (arr):         Mask array (uint8, 1 inside the mask and 0 outside)
+    polygon (arr):      UV coordinates of the mask polygon (None if no 
+                        polygon was stored)
+    '''
+    data=np.load(fname)
+    shape=tuple(data['shape'])
+    mask=np.unpackbits(data['maskbits'])[:int(np.prod(shape))].reshape(shape)
+    polygon=data['polygon']
+    data.close()
+    if len(polygon)==0:
+        polygon=None
+    return mask, polygon
+    
+    
+def isMaskNPZ(fname):
+    '''Function to check whether a file path refers to an existing mask 
+    file written with the writeMaskNPZ function.'''
+    if os.path.splitext(str(fname))[1].lower()!='.npz':
+        return False
+    if not os.path.exists(fname):
+        return False
+    data=np.load(fname)
+    packed='maskbits' in data.files
+    data.close()
+    return packed
+    
+
+def polygonMask(pts, width, height):
+    '''Function to rasterize a polygon into a mask array using PIL.
+    
+    Variables
+    pts (arr):          UV coordinates of the polygon
+    width (int):        Width of the mask
+    height (int):       Height of the mask
+    
+    Returns
+    myMask (arr):       Array defining the mask (1 inside the polygon, 0 
+                        outside)
+    '''
+    img1 = Image.new('L', (width,height), 0)
+    draw=ImageDraw.Draw(img1)
+    draw.polygon([(float(p[0]),float(p[1])) for p in pts], outline=1, fill=1)
+    return np.array(img1)
+    
+
+def isBatchFile(fname):
+    '''Function to check whether a file path refers to a GeoJSON or .npz 
+    file of image coordinates (as read by readBatchFile).'''
+    ext=os.path.splitext(str(fname))[1].lower()
+    return ext in ['.geojson', '.json', '.npz']
+    
+    
+def readBatchFile(fname):
+    '''Function to read image (uv) coordinates keyed by image name from a 
+    file, so that masks, manual areas and lines, and colour range points can 
+    be supplied without user input (e.g. for processing on headless 
+    machines). Two file types are accepted:
+    GeoJSON (.geojson/.json): A FeatureCollection where each feature has an 
+                              "image" property giving the image name, and a 
+                              Polygon, LineString, MultiPoint or Point 
+                              geometry in pixel coordinates. Only the exterior
+                              ring of polygons is used.
+    Numpy (.npz):             One (N,2) array of pixel coordinates per image,
+                              keyed by image name.
+    
+    Variables
+    fname (str):            File path for input file
+    
+    Returns
+    inputs (dict):          (N,2) arrays of uv coordinates, keyed by image 
+                            name
+    '''
+    inputs={}
+    
+    #Read numpy arrays
+    if os.path.splitext(fname)[1].lower()=='.npz':
+        data=np.load(fname)
+        for k in data.files:
+            inputs[k]=np.asarray(data[k], dtype=np.float64).reshape(-1,2)
+        data.close()
+        return inputs
+    
+    #Read GeoJSON features
+    with open(fname, 'r') as f:
+        features=json.load(f)['features']
+    for feat in features:
+        imn=str(feat['properties']['image'])
+        geom=feat['geometry']
+        if geom['type']=='Polygon':
+            coords=geom['coordinates'][0]
+        elif geom['type']=='Point':
+            coords=[geom['coordinates']]
+        else:
+            coords=geom['coordinates']
+        inputs[imn]=np.array([c[:2] for c in coords], dtype=np.float64)
+    return inputs
+    
+    
 def readCalib(fileName, paramList):
     '''Function to find camera calibrations from a file given a list or 
     Matlab file containing the required parameters. Returns the parameters as a
@@ -188,6 +390,7 @@ def readCalib(fileName, paramList):
     calib (list):           Calibration parameters denoted by keywords
     
     '''    
+    import scipy.io as sio
     #Load as text file if txt format
     if fileName[-3:] == 'txt':            
         #Open file
@@ -468,6 +671,71 @@ def writeCalibFile(intrMat, tanDis, radDis, fname):
             'End')
             
 
+def writeCalibNPZ(intrMat, tanDis, radDis, err, fname):
+    '''Write camera calibration data to a binary .npz file, including camera 
+    matrix, radial and tangential distortion parameters, and the calibration
+    error. The file can be read back with the readCalibNPZ function.
+
+    Variables
+    intrMat (arr):          Intrinsic camera matrix
+    tanDis (arr):           Tangential distortion parameters
+    radDis (arr):           Radial distortion parameters
+    err (float):            Calibration error
+    fname (str):            Filename for output file (.npz)
+    '''
+    np.savez(fname, intrMat=intrMat, tanDis=tanDis, radDis=radDis, 
+             err=np.array(err))
+    
+    
+def readCalibNPZ(fname):
+    '''Read camera calibration data from a binary .npz file written with the
+    writeCalibNPZ function.
+    
+    Variables
+    fname (str):            File path for calibration file (.npz)
+    
+    Returns
+    calib (list):           Intrinsic matrix, tangential distortion and 
+                            radial distortion parameters
+    err (float):            Calibration error
+    '''
+    data=np.load(fname)
+    calib=[data['intrMat'], data['tanDis'], data['radDis']]
+    err=float(data['err'])
+    data.close()
+    return calib, err
+
+
+def writeSelectionNPZ(selection, fname):
+    '''Write the indices of selected (e.g. manually verified) polygons in 
+    each image to a binary .npz file, so that a selection can be replayed 
+    without user input. The file can be read back with the readSelectionNPZ
+    function.
+    
+    Variables
+    selection (dict):       Indices of selected polygons, keyed by image name
+    fname (str):            Filename for output file (.npz)
+    '''
+    np.savez(fname, **dict((str(k), np.asarray(v, dtype=np.int64)) 
+                           for k,v in selection.items()))
+    
+    
+def readSelectionNPZ(fname):
+    '''Read the indices of selected polygons in each image from a binary 
+    .npz file written with the writeSelectionNPZ function.
+    
+    Variables
+    fname (str):            File path for selection file (.npz)
+    
+    Returns
+    selection (dict):       Indices of selected polygons, keyed by image name
+    '''
+    data=np.load(fname)
+    selection=dict((k, data[k]) for k in data.files)
+    data.close()
+    return selection
+    
+
 def writeVeloFile(xyzvel, uvvel, homog, imn, fname):
     '''Function to write all velocity data from a given timeLapse sequence to 
     .csv file. Data is formatted as sequential columns containing the following
@@ -678,78 +946,92 @@ def writeAreaFile(areas, imn, dest):
         Polygon real coordinates:       Written as a tab delimited text file 
                                         containing polygon xyz coordinates
                                         
-    All these file types are compatible with the importing tools (importPX, 
-    importXYZ).
+    All these file types are compatible with the importing tools 
+    (importAreaData, importAreaFile).
     
     Variables
-    pxextent (list):                    Pixel extents
-    pxpts (list):                       Pixel coordinates
-    xyzarea (list):                     XYZ areas
-    xyzpts (list):                      XYZ coordinates
+    areas (AreaSeries/list):            XYZ and UV area information
     imn (list):                         Image names
     dest (str):                         Folder directory where output files 
                                         will be written to (NOT a specific 
                                         file).
     ''' 
+    from Area import AreaSeries
     #Make directory if it does not exist
     if not os.path.exists(dest):
         os.makedirs(dest)
     
-    #Get xyz and px info from input
-    xyzarea = [item[0][0] for item in areas]
-    xyzpts = [item[0][1] for item in areas]
-    pxextent = [item[1][0] for item in areas]
-    pxpts = [item[1][1] for item in areas]
+    #Get area data with all polygon vertices held in a single array
+    if not isinstance(areas, AreaSeries):
+        areas = AreaSeries(areas)
+    polyoffsets = areas.getPolygonOffsets()
+    imageoffsets = areas.getImageOffsets()
     
     #Cumulative area of all pixel extents       
-    if pxextent is not None:
-        target = dest + 'px_sum.txt'
-        f = open(target, 'w')
-        f.write('Image \t Pixel extent \n')            
-        for i in range(len(pxextent)):
-            f.write(str(imn[i]) + '\t' + str(pxextent[i]) + '\n')
+    pxextent = areas.getPXExtent()
+    f = open(dest + 'px_sum.txt', 'w')
+    f.write('Image \t Pixel extent \n')            
+    for i in range(len(areas)):
+        f.write(str(imn[i]) + '\t' + str(pxextent[i]) + '\n')
+    f.close()
 
     #Pixel cooridnates of all pixel extents
-    if pxpts is not None:
-        target = dest + 'px_coords.txt'        
-        f = open(target, 'w')
-        polycount=1        
-        for i in range(len(pxpts)):
-            f.write('Img ' + str(imn[i]) + '\t')                
-            for pol in pxpts[i]:
-                f.write('Poly' + str(polycount) + '\t')                    
-                for pts in pol:
-                    if len(pts)==1:
-                        f.write(str(pts[0][0]) + '\t' + str(pts[0][1]) + '\t')
-                    elif len(pts)==2:
-                        f.write(str(pts[0]) + '\t' + str(pts[1]) + '\t')
-                polycount = polycount+1
-            f.write('\n\n')
-            polycount=1
+    writeAreaCoords(areas.getPXVertices(), polyoffsets, imageoffsets, imn, 
+                    dest + 'px_coords.txt')
             
-    #Areas and cumulative areas of polygons
-    if xyzarea is not None:
-        target = dest + 'area_sum.txt'
-        f = open(target, 'w')
+    if areas.getXYZVertices() is not None:
+        
+        #Areas and cumulative areas of polygons
+        xyzarea = areas.getXYZExtent()
+        f = open(dest + 'area_sum.txt', 'w')
         f.write('Image \t XYZ area \n')                       
-        for i in range(len(xyzarea)):
-            f.write(str(imn[i]) + '\t' + str(sum(xyzarea[i])) + '\n')
-
-    #XYZ coordinates of polygons
-    if xyzpts is not None:             
-        target = dest + 'area_coords.txt'                   
-        polycount=1  
-        f = open(target, 'w')
-        for i in range(len(xyzpts)):                
-            f.write('Img ' + str(imn[i]) + '\t')
-            for pol in xyzpts[i]:
-                f.write('Poly' + str(polycount) + '\t')
-                for pts in pol:
-                    f.write(str(pts[0]) + '\t' + str(pts[1]) + '\t' + 
-                            str(pts[2]) + '\t')
-                polycount=polycount+1
-            f.write('\n\n')
-            polycount=1
+        for i in range(len(areas)):
+            f.write(str(imn[i]) + '\t' + str(xyzarea[i]) + '\n')
+        f.close()
+
+        #XYZ coordinates of polygons
+        writeAreaCoords(areas.getXYZVertices(), polyoffsets, imageoffsets, 
+                        imn, dest + 'area_coords.txt')
+
+
+def writeAreaCoords(pts, polyoffsets, imageoffsets, imn, fname):
+    '''Write polygon coordinates to a tab delimited text file, with one 
+    line for each image. All coordinates are formatted at once, and then 
+    written image by image.
+    
+    Variables
+    pts (arr):                          UV/XYZ coordinates of all polygon 
+                                        vertices
+    polyoffsets (arr):                  Index of the first vertex of each
+                                        polygon
+    imageoffsets (arr):                 Index of the first polygon of each
+                                        image
+    imn (list):                         Image names
+    fname (str):                        Filename for output file (.txt)
+    '''
+    rows = formatCoords(pts)
+    f = open(fname, 'w')
+    for i in range(len(imageoffsets)-1):
+        f.write('Img ' + str(imn[i]) + '\t')
+        polys = range(imageoffsets[i], imageoffsets[i+1])
+        for polycount, p in enumerate(polys):
+            f.write('Poly' + str(polycount+1) + '\t')
+            f.write(''.join(rows[polyoffsets[p]:polyoffsets[p+1]]))
+        f.write('\n\n')
+    f.close()
+
+
+def formatCoords(pts):
+    '''Format point coordinates as tab delimited strings (one for each 
+    point).
+    
+    Variables
+    pts (arr):                          UV/XYZ point coordinates
+    
+    Returns
+    rows (list):                        Tab delimited coordinates
+    '''
+    return ['\t'.join(p) + '\t' for p in np.asarray(pts).astype(str)]
                     
 
 def writeLineFile(lines, imn, dest):
@@ -768,66 +1050,338 @@ def writeLineFile(lines, imn, dest):
                                         containing line xyz coordinates 
     
     All these file types are compatible with the importing tools 
-    (importLinePX, importLineXYZ)
+    (importLineData, importLineFile)
     
     Variables
-    pxline (list):                      Pixel line lengths
-    pxpts (list):                       Pixel coordinates
-    xyzline (list):                     XYZ line lengths
-    xyzpts (list):                      XYZ coordinates
+    lines (LineSeries/list):            XYZ and UV line information
     imn (list):                         Image names
     dest (str):                         Folder directory where output files 
                                         will be written to (NOT a specific 
                                         file).      
     '''
+    from Line import LineSeries
     #Make directory if it does not exist
     if not os.path.exists(dest):
         os.makedirs(dest)
 
-    #Get xyz and px info from input
-    xyzline = [item[0][0] for item in lines]
-    xyzpts = [item[0][1] for item in lines]
-    pxline = [item[1][0] for item in lines]
-    pxpts = [item[1][1] for item in lines]
+    #Get line data with all line vertices held in a single array
+    if not isinstance(lines, LineSeries):
+        lines = LineSeries(lines)
+    offsets = lines.getOffsets()
         
     #Pixel line coordinates file generation             
-    if pxpts is not None:            
-        target = dest + 'line_pxcoords.txt'
-        f = open(target, 'w')
-        for i in range(len(pxpts)):
-            f.write('Img ' + str(imn[i]) + '\t')                                   
-            for pts in pxpts[i]:
-                f.write(str(pts[0]) + '\t' + str(pts[1]) + '\t')    
-            f.write('\n\n')
+    writeLineCoords(lines.getPXVertices(), offsets, imn, 
+                    dest + 'line_pxcoords.txt')
 
     #Pixel line length file generation            
-    if pxline is not None:
-        target = dest + 'line_pxlength.txt'
-        f = open(target, 'w')
-        f.write('Image \t Pixel length \n')            
-        for i in range(len(pxline)):
-            f.write(str(imn[i]) + '\t' + str(pxline[i]) + '\n')
-    
-    #Real line coordinates file generation
-    if xyzpts is not None:
-        target = dest + 'line_realcoords.txt'                    
-        f = open(target, 'w')
-        for i in range(len(xyzpts)):                
-            f.write('Img ' + str(imn[i]) + '\t')
-            for pts in xyzpts[i]:
-                f.write(str(pts[0]) + '\t' + str(pts[1]) + '\t' + str(pts[2]) 
-                + '\t')
-            f.write('\n\n')
-    
-    #Real line length file generation            
-    if xyzline is not None:
-        target = dest + 'line_reallength.txt'
-        f = open(target, 'w')
+    pxline = lines.getPXLine()
+    f = open(dest + 'line_pxlength.txt', 'w')
+    f.write('Image \t Pixel length \n')            
+    for i in range(len(lines)):
+        f.write(str(imn[i]) + '\t' + str(pxline[i]) + '\n')
+    f.close()
+    
+    if lines.getXYZVertices() is not None:
+        
+        #Real line coordinates file generation
+        writeLineCoords(lines.getXYZVertices(), offsets, imn, 
+                        dest + 'line_realcoords.txt')
+    
+        #Real line length file generation            
+        xyzline = lines.getXYZLine()
+        f = open(dest + 'line_reallength.txt', 'w')
         f.write('Image \t XYZ length \n')
-        for i in range(len(xyzline)):
+        for i in range(len(lines)):
             f.write(str(imn[i]) + '\t' + str(xyzline[i]) + '\n')
+        f.close()
+
+
+def writeLineCoords(pts, offsets, imn, fname):
+    '''Write line coordinates to a tab delimited text file, with one line
+    for each image. All coordinates are formatted at once, and then written
+    image by image.
+    
+    Variables
+    pts (arr):                          UV/XYZ coordinates of all line 
+                                        vertices
+    offsets (arr):                      Index of the first vertex of the line
+                                        in each image
+    imn (list):                         Image names
+    fname (str):                        Filename for output file (.txt)
+    '''
+    rows = formatCoords(pts)
+    f = open(fname, 'w')
+    for i in range(len(offsets)-1):
+        f.write('Img ' + str(imn[i]) + '\t')
+        f.write(''.join(rows[offsets[i]:offsets[i+1]]))
+        f.write('\n\n')
+    f.close()
 
 
+def getOGRDriver(typ):
+    '''Get an OGR driver by name, raising an error if it is not available.
+    
+    Inputs
+    typ (str):                  OGR driver name (e.g. 'ESRI Shapefile', 'GPKG')
+    
+    Returns
+    driver (ogr.Driver):        OGR driver
+    '''
+    from osgeo import ogr
+    driver = ogr.GetDriverByName(typ)
+    if driver is None:
+        raise IOError('%s Driver not available:\n' % typ)
+    return driver
+
+
+#Spatial references already constructed, keyed by projection
+ogrProjections = {}
+
+def getOGRProjection(projection):
+    '''Get the OGR spatial reference for a given projection. Spatial 
+    references are only constructed once for each projection and then reused
+    for every subsequent file and layer.
+    
+    Inputs
+    projection (int/str):       Coordinate projection. This can either be an 
+                                ESPG number (expressed as an integer) or a 
+                                well-known geographical coordinate system 
+                                (expressed as a string). Well-known 
+                                geographical coordinate systems are: 'WGS84', 
+                                'WGS72', NAD83' or 'EPSG:n'
+    
+    Returns
+    proj (osr.SpatialReference):Spatial reference (None if no projection is
+                                given)
+    '''
+    from osgeo import osr
+    if type(projection) is not int and type(projection) is not str:
+        return None
+        
+    if projection not in ogrProjections:
+        proj = osr.SpatialReference()
+        if type(projection) is int:
+            proj.ImportFromEPSG(projection)
+        else:
+            proj.SetWellKnownGeogCS(projection)
+        ogrProjections[projection] = proj
+        
+    return ogrProjections[projection]
+
+
+def pointsToWKB(xy):
+    '''Build well-known binary (WKB) 2D point geometries directly from an 
+    array of xy coordinates. All points are packed into one contiguous buffer
+    which is then split into the individual geometries.
+    
+    Inputs
+    xy (arr):                   Point coordinates (N x 2 or more)
+    
+    Returns
+    wkbs (list):                WKB point geometries
+    '''
+    from osgeo import ogr
+    xy = np.asarray(xy, dtype=np.float64).reshape(len(xy),-1)
+    
+    #Pack byte order, geometry type and coordinates for all points
+    rec = np.zeros(len(xy), dtype=[('order','u1'), ('type','<u4'), 
+                                   ('x','<f8'), ('y','<f8')])
+    rec['order'] = 1
+    rec['type'] = ogr.wkbPoint
+    rec['x'] = xy[:,0]
+    rec['y'] = xy[:,1]
+    
+    #Split buffer into individual geometries
+    buf = rec.tobytes()
+    size = rec.dtype.itemsize
+    return [buf[i*size:(i+1)*size] for i in range(len(rec))]
+
+
+def lineToWKB(xy):
+    '''Build a well-known binary (WKB) 2D line geometry directly from an 
+    array of xy coordinates.
+    
+    Inputs
+    xy (arr):                   Line coordinates (N x 2 or more)
+    
+    Returns
+    wkb (str):                  WKB line geometry
+    '''
+    from osgeo import ogr
+    xy = np.asarray(xy, dtype=np.float64).reshape(len(xy),-1)[:,:2]
+    head = struct.pack('<BII', 1, ogr.wkbLineString, len(xy))
+    return head + np.ascontiguousarray(xy, dtype='<f8').tobytes()
+
+
+def polygonToWKB(xyz):
+    '''Build a well-known binary (WKB) 2.5D polygon geometry directly from an
+    array of xyz coordinates. Points with NaN coordinates are removed and the 
+    ring is closed if it is not already.
+    
+    Inputs
+    xyz (arr):                  Polygon coordinates (N x 3)
+    
+    Returns
+    wkb (str):                  WKB polygon geometry
+    '''
+    from osgeo import ogr
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(len(xyz),-1)[:,:3]
+    xyz = xyz[~np.isnan(xyz[:,0])]
+    
+    #Close ring
+    if len(xyz) > 0 and not np.array_equal(xyz[0], xyz[-1]):
+        xyz = np.vstack([xyz, xyz[:1]])
+        
+    #Geometry type is packed unsigned (the 25D flag is the sign bit in OGR)
+    head = struct.pack('<BIII', 1, ogr.wkbPolygon25D & 0xffffffff, 1, 
+                       len(xyz))
+    return head + np.ascontiguousarray(xyz, dtype='<f8').tobytes()
+    
+
+def writeOGRLayer(ds, name, proj, geomtype, field, wkbs, values=None):
+    '''Write a set of WKB geometries and attribute values to a new layer in
+    an OGR datasource. All features are created from one reused feature 
+    object within a single layer transaction.
+    
+    Inputs
+    ds (ogr.DataSource):        Datasource to create the layer in
+    name (str):                 Layer name
+    proj (osr.SpatialReference):Layer spatial reference (can be None)
+    geomtype (int):             OGR geometry type
+    field (str):                Name of the real-valued attribute field
+    wkbs (list):                WKB geometries
+    values (list/func):         Attribute values, or a function returning the
+                                attribute value from each OGR geometry. Values
+                                are not set if this is None.
+    '''
+    from osgeo import ogr
+    layer = ds.CreateLayer(name, proj, geomtype)
+    
+    #Add attributes to layer
+    layer.CreateField(ogr.FieldDefn('id', ogr.OFTInteger))
+    layer.CreateField(ogr.FieldDefn(field, ogr.OFTReal))
+    
+    #Get field indexes and one reusable feature
+    defn = layer.GetLayerDefn()
+    idfield = defn.GetFieldIndex('id')
+    valfield = defn.GetFieldIndex(field)
+    feature = ogr.Feature(defn)
+    
+    #Create all features within a single transaction
+    layer.StartTransaction()
+    for i in range(len(wkbs)):
+        geom = ogr.CreateGeometryFromWkb(wkbs[i])
+        feature.SetFID(-1)
+        feature.SetGeometry(geom)
+        feature.SetField(idfield, i+1)
+        if callable(values):
+            feature.SetField(valfield, float(values(geom)))
+        elif values is not None:
+            feature.SetField(valfield, float(values[i]))
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    
+    #Free up data space
+    feature.Destroy()
+
+
+def writeOGRFiles(layers, geomtype, field, fileDirectory, suffix, 
+                  projection=None):
+    '''Write layers of WKB geometries to separate shapefiles, one for each
+    image.
+    
+    Inputs
+    layers (list):              Layers, given as image name, WKB geometries
+                                and attribute values
+    geomtype (int):             OGR geometry type
+    field (str):                Name of the real-valued attribute field
+    fileDirectory (str):        Destination that shapefiles will be written to
+    suffix (str):               Suffix added to the image name for each file
+    projection (int/str):       Coordinate projection
+    '''
+    #Make directory if it does not exist
+    if not os.path.exists(fileDirectory):
+        os.makedirs(fileDirectory)
+        
+    #Get driver and projection
+    driver = getOGRDriver('ESRI Shapefile')
+    proj = getOGRProjection(projection)
+    
+    for im, wkbs, values in layers:
+        
+        #Create file space            
+        shp = fileDirectory + str(im) + suffix + '.shp'
+        if os.path.exists(shp):
+            driver.DeleteDataSource(shp)
+        ds = driver.CreateDataSource(shp)
+        if ds is None:
+            print 'Could not create file %s' %shp
+            continue
+        
+        #Write layer and free up data space
+        writeOGRLayer(ds, ' ', proj, geomtype, field, wkbs, values)
+        ds.Destroy()
+
+
+def writeOGRPackage(layers, geomtype, field, fname, suffix, projection=None):
+    '''Write layers of WKB geometries to a single multi-layer GeoPackage file,
+    with one layer for each image.
+    
+    Inputs
+    layers (list):              Layers, given as image name, WKB geometries
+                                and attribute values
+    geomtype (int):             OGR geometry type
+    field (str):                Name of the real-valued attribute field
+    fname (str):                Filename for output file (.gpkg)
+    suffix (str):               Suffix added to the image name for each layer
+    projection (int/str):       Coordinate projection
+    '''
+    #Make directory if it does not exist
+    dest = os.path.dirname(fname)
+    if dest != '' and not os.path.exists(dest):
+        os.makedirs(dest)
+        
+    #Get driver and projection
+    driver = getOGRDriver('GPKG')
+    proj = getOGRProjection(projection)
+    
+    #Create file space
+    if os.path.exists(fname):
+        driver.DeleteDataSource(fname)
+    ds = driver.CreateDataSource(fname)
+    if ds is None:
+        raise IOError('Could not create file %s' % fname)
+    
+    #Write one layer per image
+    for im, wkbs, values in layers:
+        writeOGRLayer(ds, str(im) + suffix, proj, geomtype, field, wkbs, 
+                      values)
+    
+    #Free up data space
+    ds.Destroy()
+    
+    print '\nGeoPackage written: ' + fname
+    
+    
+def getVeloLayers(xyzvel, xyz0, imn):
+    '''Get velocity point layers (WKB point geometries and velocities) for 
+    each image. Images without velocity data are skipped.
+    
+    Inputs
+    xyzvel (list):              XYZ velocities
+    xyz0 (list):                XYZ pt0
+    imn (list):                 Image names
+    
+    Returns
+    layers (list):              Image name, WKB geometries and velocities
+    '''
+    layers = []
+    for vel, pt0, im in zip(xyzvel, xyz0, imn):
+        if vel is not None:
+            layers.append([im, pointsToWKB(pt0), vel])
+    return layers
+    
+    
 def writeVeloSHP(xyzvel, xyz0, imn, fileDirectory, projection=None):
     '''Write OGR real velocity points (from ALL images) to file in a .shp
     file type that is compatible with ESRI mapping software.
@@ -846,83 +1400,136 @@ def writeVeloSHP(xyzvel, xyz0, imn, fileDirectory, projection=None):
                                 systems are: 'WGS84', 'WGS72', NAD83' or 
                                 'EPSG:n'
     ''' 
+    from osgeo import ogr
+    layers = getVeloLayers(xyzvel, xyz0, imn)
+    writeOGRFiles(layers, ogr.wkbPoint, 'velocity', fileDirectory, '_vel', 
+                  projection)
+
+
+def writeVeloGPKG(xyzvel, xyz0, imn, fname, projection=None):
+    '''Write OGR real velocity points (from ALL images) to a single 
+    GeoPackage file, with one point layer for each image.
+    
+    Inputs
+    xyzvel (list):              XYZ velocities
+    xyz0 (list):                XYZ pt0
+    imn (list):                 Image name
+    fname (str):                Filename for output file (.gpkg)
+    projection (int/str):       Coordinate projection that the file will 
+                                exist in (see writeVeloSHP)
+    ''' 
+    from osgeo import ogr
+    layers = getVeloLayers(xyzvel, xyz0, imn)
+    writeOGRPackage(layers, ogr.wkbPoint, 'velocity', fname, '_vel', 
+                    projection)
+
+
+def writeVeloNPZ(xyzvel, xyz0, xyz1, imn, fname, times=None, snr=None,
+                 compress=False):
+    '''Write real velocity points (from ALL image pairs) to a single columnar
+    .npz file. Each column is written as one contiguous array, with point
+    columns holding every point in the sequence and pair columns holding one
+    entry per image pair. Points are linked to their image pair by the 'pair'
+    column:
+        pair:                   Image pair number of each point
+        x0, y0, z0:             XYZ point positions in the first image
+        x1, y1, z1:             XYZ point positions in the second image
+        velocity:               XYZ velocity of each point
+        snr:                    Signal-to-noise ratio of each point (NaN if
+                                not given)
+        pairs:                  Image pair numbers
+        im0, im1:               Image names of each image pair
+        time0, time1:           Image times of each image pair (NaT if not
+                                given)
+
+    The file can be read back with the importVeloNPZ function.
+
+    Variables
+    xyzvel (list):              XYZ velocities
+    xyz0 (list):                XYZ pt0
+    xyz1 (list):                XYZ pt1
+    imn (list):                 Image names
+    fname (str):                Filename for output file (.npz)
+    times (list):               Image times (as datetime objects)
+    snr (list):                 Signal-to-noise ratio of each tracked point
+    compress (bool):            Flag denoting whether the file is compressed
+    '''
     #Make directory if it does not exist
-    if not os.path.exists(fileDirectory):
-        os.makedirs(fileDirectory)
-        
-    #Get driver and create shapeData in shp file directory              
-    typ = 'ESRI Shapefile'
-    driver = ogr.GetDriverByName(typ)
-    if driver is None:
-        raise IOError('%s Driver not available:\n' % typ)
-        pass
-        
-    for i in range(len(xyzvel)): 
-        
-        #Get velocity, pt and image name for time step
-        vel = xyzvel[i]
-        pt0 = xyz0[i]            
-        im = imn[i] 
-        
-        #Create file space            
-        shp = fileDirectory + str(im) + '_vel.shp'
-        if os.path.exists(shp):
-            driver.DeleteDataSource(shp)
-        ds = driver.CreateDataSource(shp)
-        if ds is None:
-            print 'Could not create file %s' %shp
-        
-        #Set projection
-        if type(projection) is int:
-            proj = osr.SpatialReference()
-            proj.ImportFromEPSG(projection)
-            layer = ds.CreateLayer(' ', proj, ogr.wkbPoint)
-        elif type(projection) is str:
-            proj = osr.SpatialReference()
-            proj.SetWellKnownGeogCS(projection)
-            layer = ds.CreateLayer(' ', proj, ogr.wkbPoint)
-        else:
-            layer = ds.CreateLayer(' ', None, ogr.wkbPoint)
-   
-        #Add attributes to layer
-        layer.CreateField(ogr.FieldDefn('id', ogr.OFTInteger))     #ID    
-        layer.CreateField(ogr.FieldDefn('velocity', ogr.OFTReal))  #Velo
-        
-        #Get xy coordinates
-        x0 = pt0[:,0]
-        y0 = pt0[:,1]
-        
-        #Create point features with data attributes in layer           
-        for v,x,y in zip(vel, x0, y0):
-            count=1
-        
-            #Create feature    
-            feature = ogr.Feature(layer.GetLayerDefn())
-        
-            #Create feature attributes    
-            feature.SetField('id', count)
-            feature.SetField('velocity', v)
-        
-            #Create feature location
-            wkt = "POINT(%f %f)" %  (float(x) , float(y))
-            point = ogr.CreateGeometryFromWkt(wkt)
-            feature.SetGeometry(point)
-            layer.CreateFeature(feature)
-        
-            #Free up data space
-            feature.Destroy()                       
-            count=count+1
+    dest = os.path.dirname(fname)
+    if dest != '' and not os.path.exists(dest):
+        os.makedirs(dest)
 
-        #Free up data space                          
-        ds.Destroy()
-        
+    #Get image pairs with velocity data
+    pairs = [i for i in range(len(xyzvel)) if xyzvel[i] is not None]
+    counts = [len(xyzvel[i]) for i in pairs]
 
+    #Get pair number of each point
+    pair = np.repeat(np.array(pairs, dtype=np.int32), counts)
+
+    #Stack velocities and point positions from all pairs into columns
+    vel = np.concatenate([np.asarray(xyzvel[i], dtype=np.float64)
+                          for i in pairs] + [np.empty(0)])
+    pt0 = np.concatenate([np.asarray(xyz0[i], dtype=np.float64).reshape(-1,3)
+                          for i in pairs] + [np.empty((0,3))])
+    pt1 = np.concatenate([np.asarray(xyz1[i], dtype=np.float64).reshape(-1,3)
+                          for i in pairs] + [np.empty((0,3))])
+
+    #Stack signal-to-noise ratios if given
+    if snr is not None:
+        sn = np.concatenate([np.asarray(snr[i], dtype=np.float64).ravel()
+                             for i in pairs] + [np.empty(0)])
+    else:
+        sn = np.full(vel.shape, np.nan)
+
+    #Get image names and times of each pair
+    im0 = np.array([str(imn[i]) for i in pairs] + [''])[:-1]
+    im1 = np.array([str(imn[i+1]) for i in pairs] + [''])[:-1]
+    if times is not None:
+        t0 = np.array([times[i] for i in pairs], dtype='datetime64[s]')
+        t1 = np.array([times[i+1] for i in pairs], dtype='datetime64[s]')
+    else:
+        t0 = np.full(len(pairs), np.datetime64('NaT'), dtype='datetime64[s]')
+        t1 = np.full(len(pairs), np.datetime64('NaT'), dtype='datetime64[s]')
+
+    #Write all columns to file
+    if compress is True:
+        save = np.savez_compressed
+    else:
+        save = np.savez
+    save(fname, pair=pair, x0=pt0[:,0], y0=pt0[:,1], z0=pt0[:,2],
+         x1=pt1[:,0], y1=pt1[:,1], z1=pt1[:,2], velocity=vel, snr=sn,
+         pairs=np.array(pairs, dtype=np.int32), im0=im0, im1=im1,
+         time0=t0, time1=t1)
+
+    print '\nVelocity file written: ' + fname
+
+
+def getAreaLayers(xyzpts, imn):
+    '''Get polygon layers (WKB polygon geometries) for each image. Polygon 
+    areas are calculated from the geometries when they are written.
+    
+    Inputs
+    xyzpts (list/AreaSeries):   XYZ coordinates for polygons
+    imn (list):                 Image names
+    
+    Returns
+    layers (list):              Image name, WKB geometries and area function
+    '''
+    #Get polygons of each image as views of the area container vertices
+    if hasattr(xyzpts, 'getXYZPts'):
+        xyzpts = [xyzpts.getXYZPts(i) for i in range(len(xyzpts))]
+        
+    area = lambda geom: geom.Area()
+    return [[im, [polygonToWKB(shape) for shape in polys], area] 
+            for polys, im in zip(xyzpts, imn)]
+    
+    
 def writeAreaSHP(xyzpts, imn, fileDirectory, projection=None):
     '''Write OGR real polygon areas (from ALL images) to file in a .shp
     file type that is compatible with ESRI mapping software.
     
     Inputs
-    xyzpts (list):              XYZ coordinates for polygons
+    xyzpts (list/AreaSeries):   XYZ coordinates for polygons
     imn (list):                 Iname names
     fileDirectory (str):        Destination that shapefiles will be written to           
                                 e.g. /python_workspace/Results/
@@ -934,79 +1541,106 @@ def writeAreaSHP(xyzpts, imn, fileDirectory, projection=None):
                                 systems are: 'WGS84', 'WGS72', NAD83' or 
                                 'EPSG:n'
     ''' 
+    from osgeo import ogr
+    layers = getAreaLayers(xyzpts, imn)
+    writeOGRFiles(layers, ogr.wkbPolygon25D, 'area', fileDirectory, '_area', 
+                  projection)
+
+
+def writeAreaGPKG(xyzpts, imn, fname, projection=None):
+    '''Write OGR real polygon areas (from ALL images) to a single GeoPackage
+    file, with one polygon layer for each image.
+    
+    Inputs
+    xyzpts (list/AreaSeries):   XYZ coordinates for polygons
+    imn (list):                 Image names
+    fname (str):                Filename for output file (.gpkg)
+    projection (int/str):       Coordinate projection that the file will 
+                                exist in (see writeAreaSHP)
+    ''' 
+    from osgeo import ogr
+    layers = getAreaLayers(xyzpts, imn)
+    writeOGRPackage(layers, ogr.wkbPolygon25D, 'area', fname, '_area', 
+                    projection)
+
+
+def writeAreaNPZ(areas, imn, fname, compress=False):
+    '''Write area data (from ALL images) to a single .npz file, with the 
+    vertices of all polygons held in one contiguous array:
+        uv:                     UV coordinates of all polygon vertices
+        xyz:                    XYZ coordinates of all polygon vertices (only
+                                written if areas are georectified)
+        polyoffsets:            Index of the first vertex of each polygon,
+                                followed by the total number of vertices
+        imageoffsets:           Index of the first polygon of each image,
+                                followed by the total number of polygons
+        pxextent:               Pixel extent given for each image, e.g. 
+                                verified pixel counts (NaN where it is the 
+                                sum of the polygon areas; only written if 
+                                given)
+        imn:                    Image names
+    
+    Polygon areas are recalculated from the vertices when the file is read 
+    with the importAreaNPZ function.
+    
+    Variables
+    areas (AreaSeries/list):    XYZ and UV area information
+    imn (list):                 Image names
+    fname (str):                Filename for output file (.npz)
+    compress (bool):            Flag denoting whether the file is compressed
+    '''
+    from Area import AreaSeries
     #Make directory if it does not exist
-    if not os.path.exists(fileDirectory):
-        os.makedirs(fileDirectory)
+    dest = os.path.dirname(fname)
+    if dest != '' and not os.path.exists(dest):
+        os.makedirs(dest)
         
-    #Get driver and create shapeData in shp file directory        
-    typ = 'ESRI Shapefile'        
-    driver = ogr.GetDriverByName(typ)
-    if driver is None:
-        raise IOError('%s Driver not available:\n' % typ)
-        pass
+    #Get area data with all polygon vertices held in a single array
+    if not isinstance(areas, AreaSeries):
+        areas = AreaSeries(areas)
+    data = {'uv': areas.getPXVertices(), 
+            'polyoffsets': areas.getPolygonOffsets(),
+            'imageoffsets': areas.getImageOffsets(),
+            'imn': np.array([str(i) for i in imn] + [''])[:-1]}
+    if areas.getXYZVertices() is not None:
+        data['xyz'] = areas.getXYZVertices()
+    if areas._pxextent is not None:
+        data['pxextent'] = areas._pxextent
         
-    for i in range(len(xyzpts)): 
+    #Write all arrays to file
+    if compress is True:
+        np.savez_compressed(fname, **data)
+    else:
+        np.savez(fname, **data)
+
+    print '\nArea file written: ' + fname
         
-        #Get polygon coordinates and image name for each time step
-        polys = xyzpts[i]          
-        im = imn[i] 
-                      
-        #Create datasource in shapefile
-        shp = fileDirectory + str(im) + '_area.shp'
         
-        if os.path.exists(shp):
-            driver.DeleteDataSource(shp)
-        ds = driver.CreateDataSource(shp)
-        if ds is None:
-            print 'Could not create file %s' %shp
+def getLineLayers(xyzpts, imn):
+    '''Get line layers (WKB line geometries) for each image. Line lengths are
+    calculated from the geometries when they are written.
     
-        if type(projection) is int:
-            proj = osr.SpatialReference()
-            proj.ImportFromEPSG(projection)
-            layer = ds.CreateLayer(' ', proj, ogr.wkbPolygon)
-        elif type(projection) is str:
-            proj = osr.SpatialReference()
-            proj.SetWellKnownGeogCS(projection)
-            layer = ds.CreateLayer(' ', proj, ogr.wkbPolygon)
-        else:
-            layer = ds.CreateLayer(' ', None, ogr.wkbPolygon)
+    Inputs
+    xyzpts (list/LineSeries):   XYZ coordinates for lines
+    imn (list):                 Image names
     
-        #Add attributes
-        layer.CreateField(ogr.FieldDefn('id', ogr.OFTInteger))
-        layer.CreateField(ogr.FieldDefn('area', ogr.OFTReal))
-        
-        #Get ogr polygons from xyz areal data at given image 
-        ogrpolys = []        
-        for shape in polys:
-            ring = ogr.Geometry(ogr.wkbLinearRing)
-            for pt in shape:
-                if np.isnan(pt[0]) == False:                   
-                    ring.AddPoint(pt[0],pt[1],pt[2])
-            poly = ogr.Geometry(ogr.wkbPolygon)
-            poly.AddGeometry(ring)
-            ogrpolys.append(poly)
-            
-        polycount=1
-
-        #Create feature            
-        for p in ogrpolys:
-            feature = ogr.Feature(layer.GetLayerDefn())
-            feature.SetGeometry(p)
-            feature.SetField('id', polycount)
-            feature.SetField('area', p.Area())
-            layer.CreateFeature(feature)
-            feature.Destroy()                
-            polycount=polycount+1
-        
-        ds.Destroy()
-        
+    Returns
+    layers (list):              Image name, WKB geometries and length function
+    '''
+    #Get line of each image as a view of the line container vertices
+    if hasattr(xyzpts, 'getXYZPts'):
+        xyzpts = [xyzpts.getXYZPts(i) for i in range(len(xyzpts))]
         
+    length = lambda geom: geom.Length()
+    return [[im, [lineToWKB(rline)], length] for rline, im in zip(xyzpts, imn)]
+    
+    
 def writeLineSHP(xyzpts, imn, fileDirectory, projection=None):
     '''Write OGR real line features (from ALL images) to file in a .shp
     file type that is compatible with ESRI mapping software.
     
     Inputs
-    xyzpts (list):              XYZ coordinates for lines
+    xyzpts (list/LineSeries):   XYZ coordinates for lines
     imn (list):                 Image names
     fileDirectory (str):        Destination that shapefiles will be written to           
                                 e.g. /python_workspace/Results/
@@ -1018,63 +1652,71 @@ def writeLineSHP(xyzpts, imn, fileDirectory, projection=None):
                                 systems are: 'WGS84', 'WGS72', NAD83' or 
                                 'EPSG:n'
     ''' 
-    #Make directory if it does not exist
-    if not os.path.exists(fileDirectory):
-        os.makedirs(fileDirectory)
-        
-    #Get driver and create shapeData in shp file directory        
-    typ = 'ESRI Shapefile'        
-    driver = ogr.GetDriverByName(typ)
-    if driver is None:
-        raise IOError('%s Driver not available:\n' % typ)
-        pass
-       
-    for i in range(len(xyzpts)):
-        
-        #Get polygon coordinates and image name for each time step
-        rline = xyzpts[i]  
-        im = imn[i]
+    from osgeo import ogr
+    layers = getLineLayers(xyzpts, imn)
+    writeOGRFiles(layers, ogr.wkbLineString, 'length', fileDirectory, '_line',
+                  projection)
 
-        #Create datasource in shapefile
-        shp = fileDirectory + str(im) + '_line.shp'
-        
-        if os.path.exists(shp):
-            driver.DeleteDataSource(shp)
-        ds = driver.CreateDataSource(shp)
-        if ds is None:
-            print 'Could not create file %s' %shp
+
+def writeLineGPKG(xyzpts, imn, fname, projection=None):
+    '''Write OGR real line features (from ALL images) to a single GeoPackage
+    file, with one line layer for each image.
     
-        if type(projection) is int:
-            proj = osr.SpatialReference()
-            proj.ImportFromEPSG(projection)
-            layer = ds.CreateLayer(' ', proj, ogr.wkbLineString)
-        elif type(projection) is str:
-            proj = osr.SpatialReference()
-            proj.SetWellKnownGeogCS(projection)
-            layer = ds.CreateLayer(' ', proj, ogr.wkbLineString)
-        else:
-            layer = ds.CreateLayer(' ', None, ogr.wkbLineString)
-        
-        #Add attributes
-        layer.CreateField(ogr.FieldDefn('id', ogr.OFTInteger))
-        layer.CreateField(ogr.FieldDefn('length', ogr.OFTReal))
+    Inputs
+    xyzpts (list/LineSeries):   XYZ coordinates for lines
+    imn (list):                 Image names
+    fname (str):                Filename for output file (.gpkg)
+    projection (int/str):       Coordinate projection that the file will 
+                                exist in (see writeLineSHP)
+    ''' 
+    from osgeo import ogr
+    layers = getLineLayers(xyzpts, imn)
+    writeOGRPackage(layers, ogr.wkbLineString, 'length', fname, '_line', 
+                    projection)
 
-        lcount=1
-        
-        line = ogr.Geometry(ogr.wkbLineString)   
-        for p in rline:
-            line.AddPoint(p[0],p[1])
+
+def writeLineNPZ(lines, imn, fname, compress=False):
+    '''Write line data (from ALL images) to a single .npz file, with the 
+    vertices of all lines held in one contiguous array:
+        uv:                     UV coordinates of all line vertices
+        xyz:                    XYZ coordinates of all line vertices (only
+                                written if lines are georectified)
+        offsets:                Index of the first vertex of the line in each
+                                image, followed by the total number of 
+                                vertices
+        imn:                    Image names
+    
+    Line lengths are recalculated from the vertices when the file is read 
+    with the importLineNPZ function.
+    
+    Variables
+    lines (LineSeries/list):    XYZ and UV line information
+    imn (list):                 Image names
+    fname (str):                Filename for output file (.npz)
+    compress (bool):            Flag denoting whether the file is compressed
+    '''
+    from Line import LineSeries
+    #Make directory if it does not exist
+    dest = os.path.dirname(fname)
+    if dest != '' and not os.path.exists(dest):
+        os.makedirs(dest)
         
-        #Create feature            
-        feature = ogr.Feature(layer.GetLayerDefn())
-        feature.SetGeometry(line)
-        feature.SetField('id', lcount)
-        feature.SetField('length', line.Length())
-        layer.CreateFeature(feature)
-        feature.Destroy() 
-        lcount=lcount+1
+    #Get line data with all line vertices held in a single array
+    if not isinstance(lines, LineSeries):
+        lines = LineSeries(lines)
+    data = {'uv': lines.getPXVertices(), 
+            'offsets': lines.getOffsets(),
+            'imn': np.array([str(i) for i in imn] + [''])[:-1]}
+    if lines.getXYZVertices() is not None:
+        data['xyz'] = lines.getXYZVertices()
         
-        ds.Destroy()
+    #Write all arrays to file
+    if compress is True:
+        np.savez_compressed(fname, **data)
+    else:
+        np.savez(fname, **data)
+
+    print '\nLine file written: ' + fname
 
 
 def importAreaData(xyzfile, pxfile):
@@ -1085,13 +1727,20 @@ def importAreaData(xyzfile, pxfile):
     pxfile (str):       File directory to uv coordinates
             
     Returns
-    areas (list):       Coordinates and areas of detected areas
+    areas (AreaSeries): Coordinates and areas of detected areas
     '''
+    from Area import AreaSeries
     #Get real-world coordinates and areas       
     xyz = importAreaFile(xyzfile,3)
 
     #Get pixel coordinates and areas    
     uv = importAreaFile(pxfile,2)
+    
+    #Check both files hold the same images (polygons and vertices are 
+    #checked when the areas are compiled)
+    if len(xyz) != len(uv):
+        raise ValueError('%s holds %d images but %s holds %d images' 
+                         % (xyzfile, len(xyz), pxfile, len(uv)))
 
     #Compile data together
     areas=[]
@@ -1099,7 +1748,7 @@ def importAreaData(xyzfile, pxfile):
         areas.append([i,j])
         
     #Return all area data   
-    return areas
+    return AreaSeries(areas)
 
 
 def importLineData(xyzfile, pxfile):
@@ -1110,8 +1759,9 @@ def importLineData(xyzfile, pxfile):
     pxfile (str):        File directory to uv coordinates
             
     Returns
-    lines (list):        Coordinates and lengths of detected lines
+    lines (LineSeries):  Coordinates and lengths of detected lines
     '''
+    from Line import LineSeries
     #Get real-world coordinates and distances
     xyz = importLineFile(xyzfile, 3)
     
@@ -1124,20 +1774,141 @@ def importLineData(xyzfile, pxfile):
         lines.append([i,j])
         
     #Return all line data
-    return lines
-   
+    return LineSeries(lines)
+
+
+def importVeloNPZ(fname, pairs=None, columns=None):
+    '''Import velocity points from a columnar .npz file (as written by the
+    writeVeloNPZ function). Points can be filtered by image pair, and only the
+    requested columns are read from file. Image pair columns (im0, im1, time0,
+    time1) are returned for each point.
+
+    Variables
+    fname (str):         Path to the .npz file containing the velocity data
+    pairs (list):        Image pairs to import, given either as image pair
+                         numbers or as the name of the first image in each
+                         pair. All pairs are imported if None
+    columns (list):      Names of columns to import. All columns are imported
+                         if None
+
+    Returns
+    velo (dict):         Velocity data columns, keyed by column name
+    '''
+    #Open file (columns are only read when requested)
+    data = np.load(fname)
+    if columns is None:
+        columns = ['pair', 'im0', 'im1', 'time0', 'time1', 'x0', 'y0', 'z0',
+                   'x1', 'y1', 'z1', 'velocity', 'snr']
+
+    #Get point and image pair numbers
+    pair = data['pair']
+    pairnum = data['pairs']
+
+    #Find points in the requested pairs
+    rows = None
+    if pairs is not None:
+        im0 = data['im0']
+        select = []
+        for p in pairs:
+            if isinstance(p, basestring):
+                select.extend(pairnum[im0==p].tolist())
+            else:
+                select.append(p)
+        rows = np.nonzero(np.in1d(pair, select))[0]
+        pair = pair[rows]
+
+    #Get the position of each point's pair in the image pair columns
+    pairidx = np.searchsorted(pairnum, pair)
+
+    #Read requested columns
+    velo = {}
+    for c in columns:
+        if c == 'pair':
+            velo[c] = pair
+        elif c in ['im0', 'im1', 'time0', 'time1']:
+            velo[c] = data[c][pairidx]
+        elif rows is not None:
+            velo[c] = data[c][rows]
+        else:
+            velo[c] = data[c]
+    data.close()
+
+    print ('\nImported ' + str(pair.shape[0]) + ' velocity points from '
+           + fname)
+    return velo
+
+
+def importAreaNPZ(fname):
+    '''Import area data from a .npz file (as written by the writeAreaNPZ 
+    function). Polygon areas are calculated from the vertices.
+
+    Variables
+    fname (str):         Path to the .npz file containing the area data
+
+    Returns
+    areas (AreaSeries):  Coordinates and areas of detected areas
+    imn (list):          Image names
+    '''
+    from Area import AreaSeries
+    #Read vertices and offsets from file
+    data = np.load(fname)
+    xyz = None
+    if 'xyz' in data.files:
+        xyz = data['xyz']
+    pxextent = None
+    if 'pxextent' in data.files:
+        pxextent = data['pxextent']
+    areas = AreaSeries()
+    areas.setVertices(data['uv'], xyz, data['polyoffsets'], 
+                      data['imageoffsets'], pxextent)
+    imn = [str(i) for i in data['imn']]
+    data.close()
+    
+    print ('\nImported ' + str(len(areas.getPolygonOffsets())-1) + 
+           ' polygons from ' + str(len(imn)) + ' images')
+    return areas, imn
+
+
+def importLineNPZ(fname):
+    '''Import line data from a .npz file (as written by the writeLineNPZ 
+    function). Line lengths are calculated from the vertices.
+
+    Variables
+    fname (str):         Path to the .npz file containing the line data
+
+    Returns
+    lines (LineSeries):  Coordinates and lengths of detected lines
+    imn (list):          Image names
+    '''
+    from Line import LineSeries
+    #Read vertices and offsets from file
+    data = np.load(fname)
+    xyz = None
+    if 'xyz' in data.files:
+        xyz = data['xyz']
+    lines = LineSeries()
+    lines.setVertices(data['uv'], xyz, data['offsets'])
+    imn = [str(i) for i in data['imn']]
+    data.close()
+    
+    print '\nImported lines from ' + str(len(imn)) + ' images'
+    return lines, imn
+
 
 def importAreaFile(fname, dimension):
-    '''Import pixel polygon data from text file and compute pixel extents.
+    '''Import polygon data from text file and compute polygon areas. 
+    Polygons are separated by their 'Poly' labels (as written by the
+    writeAreaFile function).
     
     Variables    
-    fname (str):         Path to the text file containing the UV coordinate 
-                         data
+    fname (str):         Path to the text file containing the UV/XYZ 
+                         coordinate data
+    dimension (int):     Number of dimensions in point coordinates i.e. 2 or 3
 
     Returns
-    uv (list):           UV coordinates for polygons 
-    extent (list):       Pixel areas for polygons          
+    areas (list):        Polygon areas and coordinates for each image
     '''
+    from Area import polygonAreas
     #Read file and detect number of images based on number of lines
     f=file(fname,'r')      
     alllines=[]
@@ -1150,37 +1921,37 @@ def importAreaFile(fname, dimension):
     #Extract strings from lines         
     areas=[] 
     for line in alllines:        
-        coords=[]
-        raw=[]
+        polys=[]
+        raw=None
                       
-        #Extract coordinate values from strings
+        #Extract coordinate values from strings, starting a new polygon at
+        #each polygon label
         vals = line.split('\t')
         for v in vals:
+            if v.startswith('Poly'):
+                raw=[]
+                polys.append(raw)
+                continue
             try:
                 a=float(v)
-                raw.append(a)
             except ValueError:
-                pass
-            
-        if dimension==2:
-            struc = len(raw)/2
-            coords = np.array(raw).reshape(struc, 2)
-        elif dimension==3:
-            struc = len(raw)/3
-            coords = np.array(raw).reshape(struc, 3)
+                continue
+            if raw is None:
+                raw=[]
+                polys.append(raw)
+            raw.append(a)
         
-        #Create geometries from polgon values using ogr               
-        ring = ogr.Geometry(ogr.wkbLinearRing)
-        for pt in coords:
-            if dimension==2:                   
-                ring.AddPoint(pt[0],pt[1])
-            elif dimension==3:
-                ring.AddPoint(pt[0],pt[1],pt[2])
-        poly = ogr.Geometry(ogr.wkbPolygon)
-        poly.AddGeometry(ring) 
+        #Restructure coordinates into 2D or 3D points
+        coords=[np.array(r).reshape(-1, dimension) for r in polys 
+                if len(r) > 0]
+        offsets=np.cumsum([0] + [len(c) for c in coords])
         
-        #Append coordinates and polygon area
-        areas.append([[poly.GetArea()],[coords]])
+        #Append polygon areas and coordinates
+        if len(coords) > 0:
+            area=list(polygonAreas(np.vstack(coords), offsets))
+        else:
+            area=[]
+        areas.append([area, coords])
     
     return areas
      
@@ -1196,6 +1967,7 @@ def importLineFile(fname, dimension):
     Returns
     lines (list):        Line coordinates and lengths
     '''
+    from Line import lineLength
     #Read file and detect number of images based on number of lines
     f=file(fname,'r')      
     alllines=[]
@@ -1228,14 +2000,8 @@ def importLineFile(fname, dimension):
             struc = len(raw)/3            
             coords = np.array(raw).reshape(struc, 3)
      
-        #Create OGR line object       
-        ogrline = ogr.Geometry(ogr.wkbLineString)   
-        for p in coords:
-            if dimension==2:
-                ogrline.AddPoint(p[0],p[1])
-            elif dimension==3:
-                ogrline.AddPoint(p[0],p[1],p[2])
-        lines.append([ogrline.Length(),coords])
+        #Append planimetric line length and coordinates
+        lines.append([lineLength(coords[:,:2]),coords])
     
     return lines
    
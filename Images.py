@@ -34,8 +34,21 @@ getLength:                      Return length of image set
 
 
 Key stand-alone functions
+getNewCameraMatrix:             Return the (cached) optimal new camera matrix 
+                                for undistortion
+getUndistortMaps:               Return the (cached) undistortion maps for a 
+                                camera and image size
+undistortImage:                 Correct an image for distortion using cached
+                                undistortion maps
+clearUndistortCache:            Remove cached camera matrices and 
+                                undistortion maps for a camera
+undistortPts:                   Correct point positions for distortion
+distortMask:                    Transform a mask from the corrected image space
+                                into the raw image space
 enhanceImage:                   Change brightness and contrast of image using 
                                 phi and theta variables
+maskBBox:                       Return the bounding box of a mask, for 
+                                cropping images to the region of interest
     
 @author: Penny How (p.how@ed.ac.uk)
          Nick Hulton 
@@ -49,7 +62,6 @@ import operator
 from PIL import Image 
 from PIL.ExifTags import TAGS
 from datetime import datetime
-from pylab import array, uint8
 import glob
 import imghdr
 import os
@@ -175,27 +187,15 @@ class CamImage(object):
     
     def getImageCorr(self, cameraMatrix, distortP):
         '''Return the image array that is corrected for the specificied 
-        camera matrix and distortion parameters.'''
+        camera matrix and distortion parameters. The undistortion maps are 
+        only calculated once for each camera and image size (see the 
+        undistortImage function).'''
         #Get image array        
         if self._imageArray is None:
             self._readImageData()
             
-        size=self.getImageSize()      
-        
-        #Calculate optimal camera matrix 
-        h = size[0]
-        w = size[1]
-        newMat, roi = cv2.getOptimalNewCameraMatrix(cameraMatrix, 
-                                                    distortP, 
-                                                    (w,h), 
-                                                    1, 
-                                                    (w,h))
         #Correct image for distortion                                                
-        corr_image = cv2.undistort(self._imageArray, 
-                                   cameraMatrix, 
-                                   distortP, 
-                                   newCameraMatrix=newMat)
-        return corr_image
+        return undistortImage(self._imageArray, cameraMatrix, distortP)
 
         
     def getImageArray(self):
@@ -446,6 +446,124 @@ class ImageSequence(object):
         return len(self._imageSet)
 
 
+#Optimal camera matrices and undistortion maps already calculated, keyed by 
+#camera matrix, distortion parameters and image size
+newMatCache={}
+undistortMapCache={}
+
+
+def getUndistortKey(cameraMatrix, distortP, size):
+    '''Return the key for a camera matrix, distortion parameters and image 
+    size (w,h) in the undistortion caches.'''
+    return (np.asarray(cameraMatrix,dtype=np.float64).tobytes(), 
+            np.asarray(distortP,dtype=np.float64).ravel().tobytes(), 
+            (int(size[0]),int(size[1])))
+            
+            
+def clearUndistortCache(cameraMatrix, distortP):
+    '''Remove the optimal new camera matrices and undistortion maps cached 
+    for a given camera matrix and distortion parameters (for all image 
+    sizes), e.g. after the camera matrix has changed.'''
+    key=getUndistortKey(cameraMatrix, distortP, (0,0))
+    for cache in [newMatCache, undistortMapCache]:
+        for k in list(cache.keys()):
+            if k[0]==key[0] and k[1]==key[1]:
+                del cache[k]
+            
+            
+def getNewCameraMatrix(cameraMatrix, distortP, size):
+    '''Return the optimal new camera matrix for undistortion (calculated 
+    with OpenCV's getOptimalNewCameraMatrix function) for a given camera 
+    matrix, distortion parameters and image size (w,h). The matrix is only 
+    calculated once for each camera and image size.'''
+    key=getUndistortKey(cameraMatrix, distortP, size)
+    if key not in newMatCache:
+        newMat, roi = cv2.getOptimalNewCameraMatrix(cameraMatrix, distortP, 
+                                                    key[2], 1, key[2])
+        newMatCache[key]=newMat
+    return newMatCache[key]
+    
+    
+def getUndistortMaps(cameraMatrix, distortP, size):
+    '''Return the undistortion maps for a given camera matrix, distortion 
+    parameters and image size (w,h). The maps are calculated once with 
+    OpenCV's initUndistortRectifyMap function, in fixed-point format 
+    (CV_16SC2) for fast remapping, and then reused.'''
+    key=getUndistortKey(cameraMatrix, distortP, size)
+    if key not in undistortMapCache:
+        newMat=getNewCameraMatrix(cameraMatrix, distortP, size)
+        map1, map2 = cv2.initUndistortRectifyMap(cameraMatrix, distortP, None,
+                                                 newMat, key[2], 
+                                                 cv2.CV_16SC2)
+        undistortMapCache[key]=[map1, map2]
+    return undistortMapCache[key]
+    
+    
+def undistortImage(img, cameraMatrix, distortP):
+    '''Correct an image array for distortion, given the camera matrix and 
+    distortion parameters. This is equivalent to OpenCV's undistort function
+    (with the optimal new camera matrix), but the undistortion maps are only
+    calculated once for each camera and image size and applied with 
+    OpenCV's remap function.'''
+    h = img.shape[0]
+    w = img.shape[1]
+    map1, map2 = getUndistortMaps(cameraMatrix, distortP, (w,h))
+    return cv2.remap(img, map1, map2, cv2.INTER_LINEAR)
+    
+    
+def undistortPts(pts, cameraMatrix, distortP, size):
+    '''Correct point positions (N x 1 x 2) for distortion, given the camera
+    matrix, distortion parameters and image size (w,h). The corrected points
+    are in the same coordinate system as images corrected with 
+    undistortImage. No image undistortion is needed for this.'''
+    newMat=getNewCameraMatrix(cameraMatrix, distortP, size)
+    return cv2.undistortPoints(pts, cameraMatrix, distortP, P=newMat)
+    
+
+def distortMask(mask, cameraMatrix, distortP):
+    '''Transform a mask defined on an image corrected for distortion (e.g. 
+    with undistortImage) into the raw (distorted) image space, given the 
+    camera matrix and distortion parameters. The corrected position of every
+    raw image pixel is found with undistortPts, and the mask is sampled at 
+    these positions.'''
+    h = mask.shape[0]
+    w = mask.shape[1]
+    
+    #Get corrected position of each raw image pixel
+    v, u = np.mgrid[0:h,0:w].astype(np.float32)
+    pts = np.dstack([u.ravel(),v.ravel()]).reshape(-1,1,2)
+    corr = undistortPts(pts, cameraMatrix, distortP, (w,h)).reshape(h,w,2)
+    
+    #Sample mask at corrected positions
+    return cv2.remap(np.asarray(mask,dtype=np.uint8), 
+                     corr[:,:,0].astype(np.float32), 
+                     corr[:,:,1].astype(np.float32), cv2.INTER_NEAREST)
+    
+    
+def maskBBox(mask, margin=0):
+    '''Return the bounding box of the non-zero pixels of a mask, expanded by
+    a margin and limited to the mask extent. Images can be cropped to this box
+    (img[ymin:ymax,xmin:xmax]) so that only the region of interest is 
+    processed, with (xmin,ymin) added to the resulting image coordinates.
+    
+    Inputs
+    mask (arr):                 Mask array
+    margin (int):               Margin to add to each side of the box (px)
+    
+    Outputs
+    bbox (tuple):               Bounding box (xmin, ymin, xmax, ymax), with 
+                                exclusive maximums (None if the mask is empty)
+    '''
+    rows = np.nonzero(np.any(mask, axis=1))[0]
+    cols = np.nonzero(np.any(mask, axis=0))[0]
+    if len(rows) == 0:
+        return None
+    h = mask.shape[0]
+    w = mask.shape[1]
+    return (int(max(cols[0]-margin, 0)), int(max(rows[0]-margin, 0)), 
+            int(min(cols[-1]+1+margin, w)), int(min(rows[-1]+1+margin, h)))
+    
+    
 def enhanceImage(img, diff, phi, theta):
     '''Change brightness and contrast of image using phi and theta 
     variables. Change phi and theta values accordingly.
@@ -479,7 +597,7 @@ def enhanceImage(img, diff, phi, theta):
         #Increase intensity such that dark pixels become much brighter
         #and bright pixels become slightly brighter
         img1 = (maxIntensity/phi)*(img/(maxIntensity/theta))**0.5
-        img1 = array(img1, dtype = uint8)
+        img1 = np.array(img1, dtype=np.uint8)
     
     #If diff variable is dark
     elif diff == 'dark':        
@@ -487,14 +605,14 @@ def enhanceImage(img, diff, phi, theta):
         #Decrease intensity such that dark pixels become much darker and 
         #bright pixels become slightly darker          
         img1 = (maxIntensity/phi)*(img/(maxIntensity/theta))**2
-        img1 = array(img1, dtype=uint8)
+        img1 = np.array(img1, dtype=np.uint8)
     
     #If diff variable not assigned then reassign to light
     else:          
         print '\nInvalid diff variable' 
         print 'Re-assigning diff variable to "light"'
         img1 = (maxIntensity/phi)*(img/(maxIntensity/theta))**0.5
-        img1 = array(img1, dtype = uint8)
+        img1 = np.array(img1, dtype=np.uint8)
     
     #Return enhanced image
     return img1
@@ -17,6 +17,9 @@ Line:                           A class for handling lines/distances (e.g.
                                 sequence, with methods to manually define pixel 
                                 lines in the image plane and georectify them to 
                                 generate real-world coordinates and distances
+LineSeries:                     A compact container for the lines of an image
+                                sequence, with all line vertices held in a 
+                                single array
 
 Key class functions
 calcManualLines:                Calculate xyz and uv lines/distances from a
@@ -25,6 +28,9 @@ calcManualLines:                Calculate xyz and uv lines/distances from a
 Key stand-alone functions
 calcManualLine:                 Calculate xyz and uv lines/distances from an 
                                 image
+lineLengths:                    Calculate the lengths of a set of lines held 
+                                in a single array
+lineLength:                     Calculate the length of a line
                                                                
 @author: Penny How (p.how@ed.ac.uk)
          Nick Hulton 
@@ -32,13 +38,12 @@ calcManualLine:                 Calculate xyz and uv lines/distances from an
 '''
 
 #Import packages
-import matplotlib.pyplot as plt
 import numpy as np
-import ogr
 
 #Import PyTrx functions and classes
+from FileHandler import readBatchFile
 from Images import ImageSequence
-from CamEnv import invproject, setInvProjVars
+from CamEnv import invproject
 
 #------------------------------------------------------------------------------
 
@@ -81,70 +86,219 @@ class Line(ImageSequence):
         self._calibFlag=calibFlag
 
         
-    def calcManualLines(self):
+    def calcManualLines(self, inputFile=None):
         '''Method to manually define pixel lines from an image sequence. The 
-        lines are manually defined by the user on an image plot. Returns the 
-        line pixel coordinates and pixel length.
+        lines are manually defined by the user on an image plot, or are read 
+        from a file without user input. Returns the line pixel coordinates and 
+        pixel length.
+        
+        Args
+        inputFile (str):        File path for lines keyed by image name 
+                                (GeoJSON/.npz, see readBatchFile). Images are 
+                                not loaded if this is given.
         
         Returns
-        lines (list):           XYZ and UV line lengths and coordinates
+        lines (LineSeries):     XYZ and UV line lengths and coordinates
         ''' 
         print '\n\nCOMMENCING LINE DETECTION'                        
             
         #Set up output dataset
         lines=[]        
 
-        #Get DEM from camera environment
-        dem = self._camEnv.getDEM() 
-
-        #Get inverse projection variables through camera info               
-        invprojvars = setInvProjVars(dem, self._camEnv._camloc, 
-                                     self._camEnv._camDirection, 
-                                     self._camEnv._radCorr, 
-                                     self._camEnv._tanCorr, 
-                                     self._camEnv._focLen, 
-                                     self._camEnv._camCen, 
-                                     self._camEnv._refImage)
+        #Get inverse projection variables from camera environment
+        invprojvars = self._camEnv.getInvProjVars()
+        
+        #Get lines if given
+        inputs=None
+        if inputFile is not None:
+            inputs=readBatchFile(inputFile)
         
         #Cycle through image pairs (numbered from 0)
         for i in range(self.getLength()):
-            
-            #Get corrected/distorted image
-            if self._calibFlag is True:
-                cameraMatrix=self._camEnv.getCamMatrixCV2()
-                distortP=self._camEnv.getDistortCoeffsCV2()
-                img1 = self._imageSet[i].getImageCorr(cameraMatrix, 
-                                                      distortP)
-            else:
-                img1=self._imageSet[i].getImageArray()
 
             #Get image name
             imn=self._imageSet[i].getImageName()
             
+            #Get line from inputs
+            if inputs is not None:
+                img1=None
+                pxpts=inputs.get(imn, [])
+                if len(pxpts)==0:
+                    print '\nNo line given for ' + imn
+            
+            #Get corrected/distorted image
+            else:
+                pxpts=None
+                if self._calibFlag is True:
+                    cameraMatrix=self._camEnv.getCamMatrixCV2()
+                    distortP=self._camEnv.getDistortCoeffsCV2()
+                    img1 = self._imageSet[i].getImageCorr(cameraMatrix, 
+                                                          distortP)
+                else:
+                    img1=self._imageSet[i].getImageArray()
+            
             #Define line data
-            out = calcManualLine(img1, imn, invprojvars)
+            out = calcManualLine(img1, imn, invprojvars, pxpts)
            
             #Append to list
             lines.append(out)
         
         #Return pixel point coordinates and lines
-        return lines
+        return LineSeries(lines)
+
+
+#------------------------------------------------------------------------------
+
+class LineSeries(object):
+    '''A compact container for the lines of an image sequence. The vertices
+    of the lines from all images are held in one contiguous array (for uv and
+    xyz coordinates), with the offset to the first vertex of the line in each
+    image. Line lengths are calculated from the vertices in one pass when the
+    container is filled.
+
+    Indexing the container returns the line information of an image in the
+    same nested form as calcManualLine (i.e. [[xyzline, xyzpts], [pxline,
+    pxpts]]), so it can be used in place of a list of line outputs.
+
+    Args
+    lines (list):              XYZ and UV line information for each image, as
+                               returned by calcManualLine (optional).
+    '''
+
+    #Object initialisation
+    def __init__(self, lines=None):
+
+        #Get line coordinates from each image
+        uvlines=[]
+        xyzlines=[]
+        for item in lines or []:
+            uvlines.append(np.asarray(item[1][1], 
+                                      dtype=np.float64).reshape(-1,2))
+            if item[0][1] is None:
+                xyzlines = None
+            elif xyzlines is not None:
+                xyzlines.append(np.asarray(item[0][1], 
+                                           dtype=np.float64).reshape(-1,3))
+
+        #Concatenate all line vertices, with offsets to the line of each image
+        offsets = np.cumsum([0] + [len(line) for line in uvlines])
+        uv = np.concatenate(uvlines + [np.zeros([0,2])])
+        if xyzlines is not None:
+            xyz = np.concatenate(xyzlines + [np.zeros([0,3])])
+        else:
+            xyz = None
+
+        self.setVertices(uv, xyz, offsets)
+
+
+    def setVertices(self, uv, xyz, offsets):
+        '''Set the line vertices of the image sequence and calculate the 
+        length of each line. XYZ line lengths are planimetric.
+
+        Args
+        uv (arr):                 UV coordinates of all line vertices (N,2)
+        xyz (arr):                XYZ coordinates of all line vertices (N,3),
+                                  or None
+        offsets (arr):            Index of the first vertex of the line in 
+                                  each image, followed by the total number of 
+                                  vertices
+        '''
+        self._uv = np.asarray(uv, dtype=np.float64).reshape(-1,2)
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._pxline = lineLengths(self._uv, self._offsets)
+
+        if xyz is not None:
+            self._xyz = np.asarray(xyz, dtype=np.float64).reshape(-1,3)
+            self._xyzline = lineLengths(self._xyz[:,:2], self._offsets)
+        else:
+            self._xyz = None
+            self._xyzline = None
+
+
+    def __len__(self):
+        '''Return the number of images.'''
+        return len(self._offsets)-1
+
+
+    def __getitem__(self, i):
+        '''Return the line information of an image in nested form, i.e.
+        [[xyzline, xyzpts], [pxline, pxpts]].'''
+        if i < 0:
+            i = i + len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('Image index out of range')
+
+        if self._xyz is not None:
+            xyz = [float(self._xyzline[i]), self.getXYZPts(i)]
+        else:
+            xyz = [None, None]
+        return [xyz, [float(self._pxline[i]), self.getPXPts(i)]]
+
+
+    def toList(self):
+        '''Return the line information of all images in nested form (see
+        calcManualLines).'''
+        return [self[i] for i in range(len(self))]
+
+
+    def getPXPts(self, i):
+        '''Return the UV coordinates of the line in an image (as a view of 
+        the vertex array).'''
+        return self._uv[self._offsets[i]:self._offsets[i+1]]
+
+
+    def getXYZPts(self, i):
+        '''Return the XYZ coordinates of the line in an image (as a view of 
+        the vertex array), or None if lines are not georectified.'''
+        if self._xyz is None:
+            return None
+        return self._xyz[self._offsets[i]:self._offsets[i+1]]
+
+
+    def getPXLine(self):
+        '''Return the pixel length of the line in each image.'''
+        return self._pxline
+
+
+    def getXYZLine(self):
+        '''Return the XYZ length of the line in each image, or None if lines 
+        are not georectified.'''
+        return self._xyzline
+
+
+    def getPXVertices(self):
+        '''Return the UV coordinates of all line vertices.'''
+        return self._uv
+
+
+    def getXYZVertices(self):
+        '''Return the XYZ coordinates of all line vertices, or None if lines
+        are not georectified.'''
+        return self._xyz
+
+
+    def getOffsets(self):
+        '''Return the index of the first vertex of the line in each image, 
+        followed by the total number of vertices.'''
+        return self._offsets
 
 
 #------------------------------------------------------------------------------
 
-def calcManualLine(img, imn, invprojvars=None):
+def calcManualLine(img, imn, invprojvars=None, pxpts=None):
     '''Manually define a line in a given image to produce XYZ and UV line 
     length and corresponding coordinates. Lines are defined through user input 
     by clicking in the interactive image plot. This primarily operates via the 
     pyplot.ginput function which allows users to define coordinates through 
     plot interaction. If inverse projection variables are given, XYZ lines
-    and coordinates are also calculated.
+    and coordinates are also calculated. If the line coordinates are given, 
+    no user input is needed.
     
     Args
     img (arr):              Image array for plotting.
     imn (str):              Image name.
     invprojvars (list):     Inverse projection variables
+    pxpts (arr):            UV coordinates of line (defined by user if None)
     
     Returns
     xyzline (list):         Line length (xyz)
@@ -152,25 +306,30 @@ def calcManualLine(img, imn, invprojvars=None):
     pxline (list):          Line length (px)
     pxpts (list):           UV coordinates of lines
     '''
-    #Initialise figure window
-    fig=plt.gcf()
-    fig.canvas.set_window_title(imn + ': Define line. ' 
-                                'Press enter to record points.')
-    
-    #Plot image
-    plt.imshow(img, origin='upper',cmap='gray')        
-    pxpts = plt.ginput(n=0, timeout=0, show_clicks=True, 
-                     mouse_add=1, mouse_pop=3, mouse_stop=2)            
-    print '\nYou clicked ' + str(len(pxpts)) + ' points in image ' + imn
+    if pxpts is None:
+        
+        #Initialise figure window
+        import matplotlib.pyplot as plt
+        fig=plt.gcf()
+        fig.canvas.set_window_title(imn + ': Define line. ' 
+                                    'Press enter to record points.')
+        
+        #Plot image
+        plt.imshow(img, origin='upper',cmap='gray')        
+        pxpts = plt.ginput(n=0, timeout=0, show_clicks=True, 
+                         mouse_add=1, mouse_pop=3, mouse_stop=2)            
+        print '\nYou clicked ' + str(len(pxpts)) + ' points in image ' + imn
+        
+        #Show plot
+        plt.show()
+        plt.close()
     
-    #Show plot
-    plt.show()
-    plt.close()
+    else:
+        pxpts = [tuple(p) for p in pxpts]
     
-    #Create OGR pixl line object and extract length
-    pxline = getOGRLine(pxpts)
-    print 'Line contains %i points' % (pxline.GetPointCount())  
-    pxline = pxline.Length()                 
+    #Extract pixel line length
+    print 'Line contains %i points' % (len(pxpts))  
+    pxline = lineLength(np.array(pxpts).reshape(-1,2))
     print 'Line length: %d px' % (pxline)
     
     #Re-format pixel point coordinates
@@ -180,9 +339,8 @@ def calcManualLine(img, imn, invprojvars=None):
         #Get xyz coordinates with inverse projection           
         xyzpts = invproject(pxpts, invprojvars)
             
-        #Create ogr line object
-        xyzline = getOGRLine(xyzpts)
-        xyzline = xyzline.Length()
+        #Extract planimetric line length
+        xyzline = lineLength(xyzpts[:,:2])
             
         print 'Line length: %d m' % (xyzline)
         
@@ -193,30 +351,54 @@ def calcManualLine(img, imn, invprojvars=None):
         return [[None, None], [pxline, pxpts]]
 
 
-def getOGRLine(pts):
-    '''Function to construct an OGR line from a set of uv coordinates.
+def lineLengths(pts, offsets):
+    '''Calculate the lengths of a set of lines, with the vertices of all 
+    lines held in one array. Lengths are calculated in the dimensions given 
+    (i.e. 2D for (N,2) arrays and 3D for (N,3) arrays). Vertices with NaN 
+    coordinates are ignored.
     
     Args
-    pts (arr):                A series of uv coordinates denoting a line.
+    pts (arr):                UV/XYZ coordinates of all line vertices
+    offsets (arr):            Index of the first vertex of each line in pts,
+                              followed by the total number of vertices
     
     Returns
-    line (ogr.Geometry):      A line object constructed from the input 
-                              coordinates.
-    ''' 
-    #Initially construct geometry object             
-    line = ogr.Geometry(ogr.wkbLineString)
+    lengths (arr):            Length of each line
+    '''
+    pts = np.asarray(pts, dtype=np.float64)
+    if pts.ndim != 2:
+        pts = pts.reshape(len(pts),-1)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    nline = len(offsets)-1
+    if nline < 1:
+        return np.zeros(0)
     
-    #Append points to geometry object
-    for p in pts:
-        if np.isnan(p[0]) == False: 
-            if len(p)==2:
-                line.AddPoint(p[0],p[1])
-            else:
-                line.AddPoint(p[0],p[1],p[2])
-            
-    #Return geometry line
-    return line 
-        
+    #Remove NaN vertices and update offsets
+    valid = ~np.isnan(pts[:,0])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    pts = pts[valid]
+    offsets = counts[offsets]
+    
+    #Sum segment lengths, excluding segments between lines
+    seg = np.sqrt(np.sum(np.diff(pts, axis=0)**2, axis=1))
+    ids = np.repeat(np.arange(nline), np.diff(offsets))[1:]
+    keep = np.ones(len(seg), dtype=bool)
+    breaks = offsets[1:-1]
+    keep[breaks[(breaks>0) & (breaks<len(pts))]-1] = False
+    return np.bincount(ids[keep], weights=seg[keep], minlength=nline)
+    
+    
+def lineLength(pts):
+    '''Calculate the length of a line (see lineLengths).
+    
+    Args
+    pts (arr):                UV/XYZ coordinates of line vertices
+    
+    Returns
+    length (float):           Line length
+    '''
+    return float(lineLengths(pts, [0, len(pts)])[0])
+
 
 #------------------------------------------------------------------------------
 
@@ -43,7 +43,6 @@ plotInterpolate:                Plot the results of the velocity
 '''
 
 #Import packages
-from scipy.interpolate import griddata
 import matplotlib.pyplot as plt
 import numpy as np
 import math
@@ -165,7 +164,9 @@ def plotAreaPX(uv, img, show=True, save=None):
     line features).
     
     Variables
-    uv (arr):           Input uv coordinates for plotting over image
+    uv (arr):           Input uv coordinates for plotting over image, either
+                        as a list of polygons or as one array with polygons
+                        separated by NaN rows (see AreaSeries.getPXPath)
     img (arr):          Image array
     show (bool):        Flag to denote whether the figure is shown
     save (str):         Destination file to save figure to    
@@ -190,6 +191,11 @@ def plotAreaPX(uv, img, show=True, save=None):
     else:
         fig.canvas.set_window_title('UV output')
     
+    #Plot all polygons at once if given in one array
+    if isinstance(uv, np.ndarray) and uv.ndim == 2:
+        ax1.plot(uv[:,0], uv[:,1], c='#FFFF33', linestyle='-')
+        uv = []
+        
     #Extract xy data from features               
     for shp in uv: 
         xl=[]
@@ -314,7 +320,9 @@ def plotAreaXYZ(xyz, dem, show=True, save=None):
     either areas or line features.
     
     Variables
-    xyz (arr):              Input xyz coordinates for plotting
+    xyz (arr):              Input xyz coordinates for plotting, either as a
+                            list of polygons or as one array with polygons
+                            separated by NaN rows (see AreaSeries.getXYZPath)
     dem (ExplicitRaster):   Underlying DEM for plotting over
     show (bool):            Flag to denote whether the figure is shown
     save (str):             Destination file to save figure to 
@@ -340,6 +348,11 @@ def plotAreaXYZ(xyz, dem, show=True, save=None):
         implot = ax1.imshow(demz, origin='lower', extent=demextent)
         implot.set_cmap('gray')
         ax1.axis([demextent[0], demextent[1],demextent[2], demextent[3]])
+    
+    #Plot all polygons at once if given in one array
+    if isinstance(xyz, np.ndarray) and xyz.ndim == 2:
+        ax1.plot(xyz[:,0], xyz[:,1], c='#FFFF33', linestyle='-')
+        xyz = []
                            
     #Extract xy data from features               
     for shp in xyz: 
@@ -523,6 +536,7 @@ def interpolateHelper(xyzvel, xyz0, xyz1, method='linear'):
     grid (arr):             Interpolated grid 
     pointsextent (list):    Grid extent
     '''                                             
+    from scipy.interpolate import griddata
     #Create empty lists for xyz information without NaNs
     velo=[]  
     x1=[]
@@ -29,6 +29,8 @@ calcHomographyPairs:            Calculate homography between succesive image
 Key standalone functions
 calcVelocity:                   Calculate velocities between an image pair
 calcHomography:                 Calculate homography between an image pair
+calcHomographyPose:             Convert a homography into a camera pose 
+                                (yaw, pitch, roll)
                                                                
 @author: Penny How (p.how@ed.ac.uk)
          Nick Hulton 
@@ -39,11 +41,12 @@ calcHomography:                 Calculate homography between an image pair
 import numpy as np
 import cv2
 import math
+import os
 
 #Import PyTrx functions and classes
 from FileHandler import readMask
-from Images import ImageSequence
-from CamEnv import invproject, setInvProjVars
+from Images import ImageSequence, undistortPts, maskBBox
+from CamEnv import invproject, updateInvProjVars, optimiseCamera
 
 #------------------------------------------------------------------------------
 
@@ -92,6 +95,7 @@ class Velocity(ImageSequence):
         self._camEnv = camEnv
         self._imageN = self.getLength()-1
         self._calibFlag = calibFlag
+        self._camPoses = None
         
         #Set mask 
         if maskPath is None:
@@ -109,7 +113,7 @@ class Velocity(ImageSequence):
 
 
     def calcVelocities(self, homog=None, back_thresh=1.0, maxpoints=50000, 
-                       quality=0.1, mindist=5.0, min_features=4):
+                       quality=0.1, mindist=5.0, min_features=4, drift=False):
         '''Function to calculate velocities between succesive image pairs. 
         Image pairs are called from the ImageSequence object. Points are seeded
         in the first of these pairs using the Shi-Tomasi algorithm with 
@@ -143,6 +147,25 @@ class Velocity(ImageSequence):
         quality:                    Corner feature quality.
         mindist:                    Minimum distance between seeded points.                 
         min_features:               Minimum number of seeded points to track.
+        drift:                      Flag to denote whether camera pose drift
+                                    is corrected. If True (and homography is
+                                    given), the homographies are accumulated
+                                    from the first image and converted into 
+                                    a yaw/pitch/roll update of the camera 
+                                    pose for each image pair. The inverse 
+                                    projection variables are then updated for
+                                    each pose, without recalculating the 
+                                    viewshed. The camera poses can be 
+                                    retrieved with getCamPoses. The camera 
+                                    environment pose is assumed to be the 
+                                    pose of the first image in the sequence,
+                                    so the camera environment reference 
+                                    image should be the first image. If a 
+                                    homography is missing then the pose can 
+                                    no longer be chained from the first 
+                                    image, so drift correction is stopped and
+                                    the camera environment pose is used for 
+                                    the remaining image pairs.
         
         Outputs
         xyz:                        List containing the xyz velocities for each 
@@ -159,23 +182,19 @@ class Velocity(ImageSequence):
                                     calculated using the homography model for
                                     image registration (uv[3]). If the 
                                     corrected points have not been calculated 
-                                    then an empty list is merely returned.                                 
+                                    then an empty list is merely returned. The
+                                    signal-to-noise ratio of each point is
+                                    also returned (uv[4]).
         '''
-           
+
         print '\n\nCALCULATING VELOCITIES'
         velocity=[]
         
         #Get camera environment 
         camenv = self.getCamEnv()
         
-        #Get DEM from camera environment
-        dem = camenv.getDEM() 
-
-        #Get inverse projection variables through camera info               
-        invprojvars = setInvProjVars(dem, camenv._camloc, camenv._camDirection, 
-                                     camenv._radCorr, camenv._tanCorr, 
-                                     camenv._focLen, camenv._camCen, 
-                                     camenv._refImage) 
+        #Get inverse projection variables from camera environment
+        invprojvars = camenv.getInvProjVars()
         
         #Get camera matrix and distortion parameters for calibration
         mtx=self._camEnv.getCamMatrixCV2()
@@ -184,6 +203,21 @@ class Velocity(ImageSequence):
         #Get mask
         mask=self.getMask()
         
+        #Check that the first image is the camera environment reference image
+        if drift is True and homog is not None:
+            if (os.path.abspath(self._imageSet[0].getImagePath()) != 
+                os.path.abspath(camenv._refImage.getImagePath())):
+                print ('\nWarning: first image is not the camera environment '
+                       'reference image. Drift correction assumes that the '
+                       'camera environment pose is the pose of the first '
+                       'image')
+        
+        #Set camera pose and cumulative homography of the first image
+        ypr=camenv._camDirection
+        hcum=np.identity(3)
+        pairvars=invprojvars
+        self._camPoses=[]
+        
         #Get first image (image0) file path and array data for initial tracking
         imn1=self._imageSet[0].getImageName()
         im1=self._imageSet[0].getImageArray()
@@ -201,10 +235,38 @@ class Velocity(ImageSequence):
             self._imageSet[i].clearAll()
            
             print '\nFeature-tracking for images: ',imn0,' and ',imn1
+            
+            #Stop drift correction if the homography chain is broken
+            if (drift is True and homog is not None and i>0 and 
+                homog[i-1] is None):
+                print ('\nWarning: no homography for image pair ' + str(i-1) 
+                       + '. Drift correction stopped and camera environment '
+                       'pose used for remaining image pairs')
+                drift=False
+                ypr=camenv._camDirection
+                pairvars=invprojvars
+                
+            #Update camera pose and inverse projection variables for drift
+            if drift is True and homog is not None and i>0:
+                hcum=np.dot(homog[i-1][0],hcum)
+                ypr=calcHomographyPose(hcum, invprojvars, camenv._camloc, ypr, 
+                                       camenv._radCorr, camenv._tanCorr, 
+                                       camenv._focLen, camenv._camCen, 
+                                       camenv._refImage)
+                pairvars=updateInvProjVars(invprojvars, camenv._camloc, ypr, 
+                                           camenv._radCorr, camenv._tanCorr, 
+                                           camenv._focLen, camenv._camCen, 
+                                           camenv._refImage)
+            self._camPoses.append(ypr)
+            
+            #Get homography for image pair
+            if homog is not None and homog[i] is not None:
+                hg=[homog[i][0],homog[i][3]]
+            else:
+                hg=None
 
             #Calculate velocities between image pair with homography
-            pts=calcVelocity(im0, im1, mask, [mtx,distort], 
-                             [homog[i][0],homog[i][3]], invprojvars, 
+            pts=calcVelocity(im0, im1, mask, [mtx,distort], hg, pairvars, 
                              back_thresh, maxpoints, quality, mindist, 
                              min_features)                      
 
@@ -281,6 +343,12 @@ class Velocity(ImageSequence):
         return homog
 
 
+    def getCamPoses(self):
+        '''Return the camera pose (yaw, pitch, roll) used for the first image
+        of each image pair in the last velocity calculation.'''
+        return self._camPoses
+        
+        
     def getMask(self):
         '''Return image mask.'''
         return self._mask
@@ -349,7 +417,10 @@ def calcVelocity(img1, img2, mask, calib=None, homog=None, invprojvars=None,
                                 calculated using the homography model for
                                 image registration (uv[3]). If the 
                                 corrected points have not been calculated 
-                                then an empty list is merely returned.                                 
+                                then an empty list is merely returned. The
+                                signal-to-noise ratio of each point from the
+                                forward-backward tracking is also returned
+                                (uv[4]).
     '''       
     #Set threshold difference for point tracks
     displacement_tolerance_rel=2.0
@@ -368,26 +439,19 @@ def calcVelocity(img1, img2, mask, calib=None, homog=None, invprojvars=None,
         return None        
         
     if calib is not None:        
-        #Calculate optimal camera matrix 
+        #Get image size
         size=img1.shape
         h = size[0]
         w = size[1]
-        newMat, roi = cv2.getOptimalNewCameraMatrix(calib[0], 
-                                                    calib[1], 
-                                                    (w,h), 1, (w,h))
         
         #Correct tracked points for image distortion. The displacement here 
         #is defined forwards (i.e. the points in image 1 are first 
         #corrected, followed by those in image 2)      
         #Correct points in first image 
-        src_pts_corr=cv2.undistortPoints(points[0], 
-                                         calib[0], 
-                                         calib[1],P=newMat)
+        src_pts_corr=undistortPts(points[0], calib[0], calib[1], (w,h))
         
         #Correct points in second image                                         
-        dst_pts_corr=cv2.undistortPoints(points[1], 
-                                         calib[0], 
-                                         calib[1],P=newMat) 
+        dst_pts_corr=undistortPts(points[1], calib[0], calib[1], (w,h))
     else:
         src_pts_corr = points[0]
         dst_pts_corr = points[1]
@@ -424,6 +488,7 @@ def calcVelocity(img1, img2, mask, calib=None, homog=None, invprojvars=None,
         src_pts_corr=src_pts_corr[good]
         dst_pts_corr=dst_pts_corr[good]
         dst_pts_homog=dst_pts_homog[good]
+        snr=ptserrors[2][good]
         
         print 'Points removed because of homography uncertainty:'
         print 'Before: '+str(tracked)+' After: '+str(dst_pts_corr.shape[0])
@@ -432,6 +497,7 @@ def calcVelocity(img1, img2, mask, calib=None, homog=None, invprojvars=None,
         #Original tracked points assigned if homography not given
         print 'Homography matrix not supplied. Original tracked points kept'
         dst_pts_homog=dst_pts_corr
+        snr=ptserrors[2]
     
     #Calculate pixel velocity
     pxvel=[]       
@@ -460,14 +526,15 @@ def calcVelocity(img1, img2, mask, calib=None, homog=None, invprojvars=None,
         xyzvel=None
             
     #Return real-world point positions (original and tracked points),
-    #and xy pixel positions (original, tracked, and homography-corrected)
-    if hmatrix is not None:
+    #and xy pixel positions (original, tracked, and homography-corrected),
+    #along with the signal-to-noise ratio of each point
+    if homog is not None:
         return [[xyzvel, xyzs, xyzd], 
-                [pxvel, src_pts_corr, dst_pts_corr, dst_pts_homog]]
+                [pxvel, src_pts_corr, dst_pts_corr, dst_pts_homog, snr]]
     
     else:
         return [[xyzvel, xyzs, xyzd], 
-                [pxvel, src_pts_corr, dst_pts_corr, None]]
+                [pxvel, src_pts_corr, dst_pts_corr, None, snr]]
         
         
 def calcHomography(img1, img2, mask, correct, method=cv2.RANSAC, 
@@ -530,26 +597,19 @@ def calcHomography(img1, img2, mask, correct, method=cv2.RANSAC,
     
     if correct is not None:
         
-        #Calculate optimal camera matrix 
+        #Get image size
         size=img1.shape
         h = size[0]
         w = size[1]
-        newMat, roi = cv2.getOptimalNewCameraMatrix(correct[0], 
-                                                    correct[1], 
-                                                    (w,h), 1, (w,h))
                
         #Correct tracked points for image distortion. The homgraphy here is 
         #defined forwards (i.e. the points in image 1 are first corrected, 
         #followed by those in image 2)        
         #Correct points in first image  
-        src_pts_corr=cv2.undistortPoints(points[0], 
-                                         correct[0], 
-                                         correct[1],P=newMat)
+        src_pts_corr=undistortPts(points[0], correct[0], correct[1], (w,h))
         
         #Correct tracked points in second image
-        dst_pts_corr=cv2.undistortPoints(points[1], 
-                                         correct[0], 
-                                         correct[1],P=newMat) 
+        dst_pts_corr=undistortPts(points[1], correct[0], correct[1], (w,h))
     else:
         src_pts_corr = points[0]
         dst_pts_corr = points[1]
@@ -582,6 +642,48 @@ def calcHomography(img1, img2, mask, correct, method=cv2.RANSAC,
             homogerrors)
 
 
+def calcHomographyPose(hmatrix, invprojvars, camloc, camdir, radial, tangen, 
+                       foclen, camcen, refimg, npts=200):
+    '''Function to convert a homography (relative to the image that the 
+    inverse projection variables were set for) into a camera pose. The 
+    homography is assumed to be caused by a small rotation of the camera 
+    (i.e. wind or thermal drift of the camera mount). A subset of the 
+    inverse projection points is transformed by the homography, and the 
+    camera yaw, pitch and roll are then solved against these by minimising 
+    their reprojection error.
+    
+    Inputs
+    hmatrix:                    Homography matrix
+    invprojvars:                Inverse projection variables for the 
+                                reference camera pose
+    camloc:                     Camera location
+    camdir:                     Initial camera direction [yaw,pitch,roll]
+    radial, tangen:             Radial and tangential distortion coefficients
+    foclen, camcen:             Focal length and camera centre
+    refimg:                     Reference image (used for image size)
+    npts:                       Number of points used to solve the pose
+    
+    Outputs
+    camdir:                     Camera direction [yaw,pitch,roll]
+    '''
+    #Get subset of inverse projection points
+    uv0=invprojvars[3]
+    idx=np.unique(np.linspace(0, uv0.shape[0]-1, min(npts, uv0.shape[0]))
+                  .astype(int))
+    xyz=np.column_stack([invprojvars[0][idx], invprojvars[1][idx], 
+                         invprojvars[2][idx]])
+    
+    #Transform points with homography
+    uv=cv2.perspectiveTransform(uv0[idx].reshape(-1,1,2).astype(np.float64), 
+                                hmatrix).reshape(-1,2)
+    
+    #Solve camera direction from transformed points
+    loc,ypr,foc,stats=optimiseCamera(xyz, uv, camloc, camdir, radial, tangen,
+                                     foclen, camcen, refimg, optloc=False, 
+                                     optdir=True, optfoc=False)
+    return ypr
+    
+    
 def apply_persp_homographyPts(pts, homog, inverse=False):        
     '''Funtion to apply a perspective homography to a sequence of 2D 
     values held in X and Y. The perspective homography is represented as a 
@@ -638,7 +740,7 @@ def apply_persp_homographyPts(pts, homog, inverse=False):
         
 
 def featureTrack(i0, iN, mask, back_thresh=1.0, maxpoints=50000, quality=0.1, 
-                 mindist=5.0, min_features=1):
+                 mindist=5.0, min_features=1, margin=None):
     '''Function to feature track between two masked images. The
     Shi-Tomasi algorithm with OpenCV's goodFeaturesToTrack function is used
     to initially seed points in the first image. Then, the Lucas Kanade 
@@ -655,6 +757,11 @@ def featureTrack(i0, iN, mask, back_thresh=1.0, maxpoints=50000, quality=0.1,
     
     This class returns the points in both images as a list, along with the 
     corresponding list of SNR measures.
+    
+    If a mask is given, both images are cropped to the bounding box of the 
+    mask (plus a margin for the optical flow search window and any 
+    displacement), and the point coordinates are returned in the full image
+    frame.
 
     Variables
     i0 (arr):                   Image 1 in the image pair
@@ -667,6 +774,10 @@ def featureTrack(i0, iN, mask, back_thresh=1.0, maxpoints=50000, quality=0.1,
     quality (int):              Corner feature quality
     mindist (int):              Minimum distance between seeded points                
     min_features (int):         Minimum number of seeded points to track
+    margin (int):               Margin around the mask bounding box that 
+                                images are cropped to (px). By default, this 
+                                is the window size at the coarsest pyramid 
+                                level of the optical flow search
     
     Returns
     p0 (arr):                   Point coordinates for points seeded in image 1
@@ -684,6 +795,18 @@ def featureTrack(i0, iN, mask, back_thresh=1.0, maxpoints=50000, quality=0.1,
                       maxLevel = 2,
                       criteria = (cv2.TERM_CRITERIA_EPS | 
                                   cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+    
+    #Crop images and mask to the mask bounding box (plus margin)
+    offset=None
+    if mask is not None:
+        if margin is None:
+            margin=lk_params['winSize'][0]*2**lk_params['maxLevel']
+        bbox=maskBBox(mask, margin)
+        if bbox is not None:
+            i0=i0[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+            iN=iN[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+            mask=mask[bbox[1]:bbox[3],bbox[0]:bbox[2]]
+            offset=np.array([bbox[0],bbox[1]], dtype=np.float32)
                                   
     #Find corners of the first image. p0 is returned as an array of shape 
     #(n,1,2), where n is the number of features identified 
@@ -692,7 +815,10 @@ def featureTrack(i0, iN, mask, back_thresh=1.0, maxpoints=50000, quality=0.1,
     else:
         p0=cv2.goodFeaturesToTrack(i0,maxpoints,quality,mindist)
         
-    #tracked is the number of features returned by goodFeaturesToTrack        
+    #tracked is the number of features returned by goodFeaturesToTrack
+    if p0 is None:
+        print 'Not enough features found to track.  Found: 0'
+        return None
     tracked=p0.shape[0]
             
     #Check if there are enough points to initially track 
@@ -741,6 +867,12 @@ def featureTrack(i0, iN, mask, back_thresh=1.0, maxpoints=50000, quality=0.1,
     
     #Error to contain the original lengths, back-tracking error and snr
     error=[length,dist,snr]
+    
+    #Return point coordinates in the full image frame
+    if offset is not None:
+        p0=p0+offset
+        p1=p1+offset
+        p0r=p0r+offset
         
     return [p0,p1,p0r], error
 